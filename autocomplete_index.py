@@ -0,0 +1,198 @@
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+# Characters that start a new "word" inside a model name, e.g. "Llama 4 Scout" or "gpt-4o"
+WORD_SPLIT = re.compile(r"[\s\-_/:.()]+")
+
+
+@lru_cache(maxsize=512)
+def fuzzy_pattern(query: str):
+    """Regex matching the query's characters in order within a single line
+
+    Each gap is a possessive ``[^c\n]*+`` run, so a failed match never
+    backtracks and the scan stays linear in the corpus size.
+    """
+    parts = [re.escape(query[0])]
+    for ch in query[1:]:
+        parts.append(f"[^{re.escape(ch)}\n]*+{re.escape(ch)}")
+    return re.compile("".join(parts))
+
+
+class AutocompleteIndex:
+    """Pre-built search index over model names for the /change autocomplete
+
+    Matches are returned in tiers: names starting with the query, names with a
+    word starting with the query, names containing the query, and finally
+    fuzzy (in-order subsequence) matches. Everything is answered from memory;
+    prefix lookups use binary search over sorted key lists, and the substring
+    and fuzzy tiers scan a single pre-joined string of all names in C, stopping
+    as soon as a page of results is full.
+    """
+
+    def __init__(self, names: Iterable[str], cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._cache: Dict[tuple, List[int]] = {}
+        self.names: List[str] = list(dict.fromkeys(n for n in names if n))
+        self._lowered = [n.lower() for n in self.names]
+        self._position = {n: i for i, n in enumerate(self.names)}
+
+        # Sorted (key, entry) pairs for full names and for every word suffix within a name
+        full_keys = sorted((lowered, i) for i, lowered in enumerate(self._lowered))
+        word_keys = []
+        for i, lowered in enumerate(self._lowered):
+            for match in WORD_SPLIT.finditer(lowered):
+                suffix = lowered[match.end():]
+                if suffix:
+                    word_keys.append((suffix, i))
+        word_keys.sort()
+        self._full_keys = [k for k, _ in full_keys]
+        self._full_entries = [i for _, i in full_keys]
+        self._word_keys = [k for k, _ in word_keys]
+        self._word_entries = [i for _, i in word_keys]
+
+        # All names, shortest first, joined into one string so substring and fuzzy
+        # scans run in C (str.find / re) instead of a Python loop per name
+        self._by_length = sorted(range(len(self.names)), key=lambda i: (len(self._lowered[i]), self._lowered[i]))
+        self._corpus = "\n".join(self._lowered[i] for i in self._by_length)
+        self._line_starts = []
+        offset = 0
+        for i in self._by_length:
+            self._line_starts.append(offset)
+            offset += len(self._lowered[i]) + 1
+
+        # Alphabetical order used for empty queries
+        self._alphabetical = self._full_entries
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def _scan_prefix(keys: List[str], entries: List[int], query: str, results: List[int], seen: Set[int], limit: int):
+        """Append entries whose key starts with ``query`` in key order, up to ``limit`` results"""
+        for pos in range(bisect_left(keys, query), len(keys)):
+            if len(results) >= limit or not keys[pos].startswith(query):
+                break
+            entry = entries[pos]
+            if entry not in seen:
+                seen.add(entry)
+                results.append(entry)
+
+    def _scan_corpus(self, find, results: List[int], seen: Set[int], limit: int):
+        """Append entries found by ``find(corpus, pos) -> match offset or -1``, shortest names first"""
+        corpus_len = len(self._corpus)
+        pos = 0
+        while pos < corpus_len and len(results) < limit:
+            hit = find(pos)
+            if hit < 0:
+                break
+            line = bisect_right(self._line_starts, hit) - 1
+            entry = self._by_length[line]
+            if entry not in seen:
+                seen.add(entry)
+                results.append(entry)
+            # Continue from the start of the next name
+            pos = self._line_starts[line + 1] if line + 1 < len(self._line_starts) else corpus_len
+
+    def _base_search(self, q: str, limit: int) -> List[int]:
+        """Ranked entries for a lowered, stripped query, without per-user preferences"""
+        entries: List[int] = []
+        seen: Set[int] = set()
+
+        if not q:
+            return self._alphabetical[:limit]
+
+        # Tier 1 and 2: the name, or one of its words, starts with the query
+        self._scan_prefix(self._full_keys, self._full_entries, q, entries, seen, limit)
+        self._scan_prefix(self._word_keys, self._word_entries, q, entries, seen, limit)
+
+        # Tier 3: the name contains the query anywhere
+        if len(entries) < limit:
+            self._scan_corpus(lambda pos: self._corpus.find(q, pos), entries, seen, limit)
+
+        # Tier 4: the query's characters appear in order, e.g. "gfl" -> "gemini flash"
+        if len(entries) < limit and len(q) > 1:
+            pattern = fuzzy_pattern(q)
+
+            def find(pos):
+                match = pattern.search(self._corpus, pos)
+                return match.start() if match else -1
+
+            self._scan_corpus(find, entries, seen, limit)
+
+        return entries
+
+    def search(self, query: str, limit: int = 25, preferred: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Return up to ``limit`` names matching ``query``
+
+        Args:
+            query: What the user has typed so far
+            limit: Maximum number of names (Discord allows 25 choices)
+            preferred: Names to rank first when they match, most relevant first
+        """
+        q = query.lower().strip()
+
+        # Keystrokes repeat a lot across users, so remember recent answers
+        key = (q, limit)
+        entries = self._cache.get(key)
+        if entries is None:
+            entries = self._base_search(q, limit)
+            if self.cache_size:
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+                self._cache[key] = entries
+
+        if not preferred:
+            return [self.names[i] for i in entries]
+
+        # Recently used models jump the queue when they match at all
+        ranked: List[int] = []
+        pattern = fuzzy_pattern(q) if q else None
+        for name in preferred:
+            entry = self._position.get(name)
+            if entry is None or entry in ranked:
+                continue
+            if pattern is None or pattern.search(self._lowered[entry]):
+                ranked.append(entry)
+        for entry in entries:
+            if entry not in ranked:
+                ranked.append(entry)
+        return [self.names[i] for i in ranked[:limit]]
+
+
+class ModelUsageTracker:
+    """Remembers which models each user picked recently, for ranking suggestions
+
+    Bounded in both directions: at most ``per_user`` models per user and an LRU
+    over ``max_users`` users.
+    """
+
+    def __init__(self, per_user: int = 5, max_users: int = 10000):
+        self.per_user = per_user
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, List[str]]" = OrderedDict()
+
+    def record(self, user_id: str, model_name: str):
+        with self._lock:
+            recent = self._recent.pop(user_id, [])
+            if model_name in recent:
+                recent.remove(model_name)
+            recent.insert(0, model_name)
+            del recent[self.per_user:]
+            self._recent[user_id] = recent
+            while len(self._recent) > self.max_users:
+                self._recent.popitem(last=False)
+
+    def recent(self, user_id: str) -> List[str]:
+        """Most recently used first"""
+        with self._lock:
+            return list(self._recent.get(user_id, ()))
+
+
+# Shared by /change (records picks) and its autocomplete (ranks suggestions)
+model_usage = ModelUsageTracker()
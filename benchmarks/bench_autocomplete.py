@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the /change autocomplete index
+
+Builds an index over thousands of synthetic model names and times searches
+for typical keystroke sequences, with and without the index's result cache.
+Exits non-zero if the uncached p99 search time is not below the budget
+(1 ms by default).
+
+Usage: python benchmarks/bench_autocomplete.py [--models 5000] [--budget-ms 1.0]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autocomplete_index import AutocompleteIndex
+
+VENDORS = ["Gemini", "GPT", "Llama", "Claude", "DeepSeek", "Mistral", "Qwen", "Dolphin", "Devstral", "Phi", "Command", "Nova"]
+VARIANTS = ["Flash", "Pro", "Scout", "Maverick", "Haiku", "Sonnet", "Opus", "Turbo", "Mini", "Instruct", "Vision", "Coder"]
+SUFFIXES = ["", " Free", " Preview", " Beta", " Image", " Chat"]
+
+
+def make_names(count, rng):
+    names = set()
+    while len(names) < count:
+        version = f"{rng.randint(1, 5)}.{rng.randint(0, 9)}" if rng.random() < 0.7 else f"{rng.choice([7, 8, 24, 70, 405])}B"
+        names.add(f"{rng.choice(VENDORS)} {rng.choice(VARIANTS)} {version}{rng.choice(SUFFIXES)} #{len(names)}")
+    return sorted(names)
+
+
+def make_queries(names, rng, count):
+    queries = []
+    for _ in range(count):
+        name = rng.choice(names).lower()
+        kind = rng.random()
+        if kind < 0.5:
+            # Progressive typing of a prefix
+            queries.append(name[:rng.randint(1, 8)])
+        elif kind < 0.75:
+            # A word from the middle of the name
+            words = name.split()
+            queries.append(rng.choice(words)[:rng.randint(1, 5)])
+        elif kind < 0.9:
+            # Fuzzy abbreviation, e.g. "gfl" for "gemini flash"
+            queries.append("".join(w[0] for w in name.split()[:3]))
+        else:
+            # No match at all
+            queries.append("zzq" + str(rng.randint(0, 9)))
+    return queries
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=5000, help="Number of synthetic model names")
+    parser.add_argument("--queries", type=int, default=20000, help="Number of searches to time")
+    parser.add_argument("--budget-ms", type=float, default=1.0, help="Maximum allowed p99 per search")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = make_names(args.models, rng)
+
+    started = time.perf_counter()
+    index = AutocompleteIndex(names)
+    build_ms = (time.perf_counter() - started) * 1000
+    print(f"📊 Autocomplete index: {len(index)} models, built in {build_ms:.1f} ms")
+
+    queries = make_queries(names, rng, args.queries)
+    preferred = rng.sample(names, 3)
+
+    # Cold: every search computed from scratch. Warm: the index's keystroke cache is on.
+    cold = AutocompleteIndex(names, cache_size=0)
+    for label, target in (("cold", cold), ("warm", index)):
+        for query in queries[:500]:
+            target.search(query, limit=25, preferred=preferred)
+
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            target.search(query, limit=25, preferred=preferred)
+            samples.append((time.perf_counter() - started) * 1000)
+
+        p50, p95, p99 = (percentile(samples, p) for p in (50, 95, 99))
+        print(f"   {label}: {len(samples)} searches, mean {sum(samples) / len(samples):.4f} ms, "
+              f"p50 {p50:.4f} ms, p95 {p95:.4f} ms, p99 {p99:.4f} ms, max {max(samples):.4f} ms")
+        if label == "cold":
+            cold_p99 = p99
+
+    if cold_p99 >= args.budget_ms:
+        print(f"❌ Uncached p99 {cold_p99:.4f} ms exceeds the {args.budget_ms} ms budget")
+        sys.exit(1)
+
+    print(f"✅ Uncached p99 is within the {args.budget_ms} ms budget")
+
+
+if __name__ == "__main__":
+    main()
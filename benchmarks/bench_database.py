@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the ConversationHistory data layer
+
+Fills throwaway SQLite databases with synthetic history (one measured user
+with N messages among other users' rows) and times every data-layer entry
+point the bot uses, with the rollback journal and with WAL. The SQL each
+entry point runs is captured and checked with EXPLAIN QUERY PLAN; the run
+exits non-zero if a query on conversation_history stops using the
+idx_user_created index, or, with --baseline, if an entry point's p95 got
+slower than the baseline report allows.
+
+Usage: python benchmarks/bench_database.py [--scales 10,1000,100000] [--journal wal,delete]
+       [--json report.json] [--baseline previous.json [--tolerance 1.5]]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, text
+
+from database import db, ConversationHistory, ConversationStats, conversation_cache, SUMMARY_ROLE
+from retention import HistoryRetention
+
+INDEX = "idx_user_created"
+USER_ID = "100000000000000001"
+WORDS = ("model", "answer", "discord", "server", "token", "memory", "context", "question", "history", "cache")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def make_app(path, journal):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        mode = db.session.execute(text(f"PRAGMA journal_mode={journal}")).scalar()
+        db.session.commit()
+        if mode.lower() != journal:
+            raise RuntimeError(f"SQLite refused journal_mode={journal} (got {mode})")
+    return app
+
+
+def fill(user_id, rows, started, rng, summary=False):
+    """Bulk insert ``rows`` alternating user/assistant messages for a user"""
+    table = ConversationHistory.__table__
+    batch = []
+    for i in range(rows):
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60)))
+        batch.append({
+            "user_id": user_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": content,
+            "model_name": "Bench Fast",
+            "created_at": started + timedelta(seconds=i),
+            "token_count": len(content) // 4
+        })
+        if len(batch) == 10000:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if summary:
+        batch.append({"user_id": user_id, "role": SUMMARY_ROLE, "content": "Earlier: the user asked about benchmarks.",
+                      "model_name": "Bench Fast", "created_at": started + timedelta(seconds=rows), "token_count": 10})
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def memory_info(user_id):
+    """What /memory_info runs per invocation"""
+    if ConversationStats.for_user(user_id)["messages"]:
+        ConversationHistory.get_user_history(user_id, limit=5)
+
+
+def load_context(user_id):
+    # Always measure the database path, not the in-memory tier
+    conversation_cache.drop(user_id)
+    ConversationHistory.load_conversation_context(user_id, limit=20, token_budget=4000)
+
+
+OPERATIONS = [
+    ("get_user_history", lambda: ConversationHistory.get_user_history(USER_ID, limit=10)),
+    ("count_messages", lambda: ConversationHistory.count_messages(USER_ID)),
+    ("count_messages(role)", lambda: ConversationHistory.count_messages(USER_ID, role="user")),
+    ("get_summary", lambda: ConversationHistory.get_summary(USER_ID)),
+    ("conversation_stats", lambda: ConversationStats.for_user(USER_ID)),
+    ("memory_info", lambda: memory_info(USER_ID)),
+    ("load_conversation_context", lambda: load_context(USER_ID)),
+    ("add_message", lambda: ConversationHistory.add_message(USER_ID, "user", "How fast is the history table?", "Bench Fast")),
+]
+
+
+class StatementCapture:
+    """Collects the SQL (with parameters) sent to conversation_history while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.active = False
+        event.listen(engine, "before_cursor_execute", self.before)
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and "conversation_history" in statement and not executemany:
+            if statement.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE")):
+                self.statements.append((statement, parameters))
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self.before)
+
+
+def check_plans(capture):
+    """``(operation, plan)`` pairs for captured queries that don't use the index"""
+    failures = []
+    seen = set()
+    with db.engine.connect() as conn:
+        for name, statement, parameters in capture:
+            if (name, statement) in seen:
+                continue
+            seen.add((name, statement))
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            details = " | ".join(row[-1] for row in plan)
+            if INDEX not in details:
+                failures.append((name, statement.split()[0], details))
+    return failures
+
+
+def run_scale(journal, rows, args, rng):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    app = make_app(path, journal)
+    try:
+        with app.app_context():
+            started = datetime.utcnow() - timedelta(days=30)
+            filled = time.perf_counter()
+            fill(USER_ID, rows, started, rng, summary=True)
+            # Other users' rows, so the index has to pick the measured user out of the table
+            for other in range(args.users):
+                fill(str(200000000000000000 + other), max(1, rows // max(1, args.users)), started, rng)
+            fill_s = time.perf_counter() - filled
+            db.session.execute(text("ANALYZE"))
+            db.session.commit()
+
+            capture = StatementCapture(db.engine)
+            results = []
+            captured = []
+            for name, operation in OPERATIONS:
+                for _ in range(min(20, args.repeat)):
+                    operation()
+                capture.statements, capture.active = [], True
+                operation()
+                capture.active = False
+                captured.extend((name, statement, parameters) for statement, parameters in capture.statements)
+
+                samples = []
+                for _ in range(args.repeat):
+                    t = time.perf_counter()
+                    operation()
+                    samples.append((time.perf_counter() - t) * 1000)
+                results.append(result(journal, rows, name, samples))
+
+            # Clearing destroys the data set, so it is timed once, on the full table, last
+            capture.statements, capture.active = [], True
+            t = time.perf_counter()
+            ConversationHistory.clear_user_history(USER_ID)
+            results.append(result(journal, rows, "clear_user_history", [(time.perf_counter() - t) * 1000]))
+            capture.active = False
+            captured.extend(("clear_user_history", statement, parameters) for statement, parameters in capture.statements)
+
+            # The rows the clear hid, purged in batches; the longest batch is what a writer could wait for
+            retention = HistoryRetention(batch_pause=0)
+            t = time.perf_counter()
+            retention.run_once()
+            results.append(result(journal, rows, "retention_purge", [(time.perf_counter() - t) * 1000]))
+            results.append(result(journal, rows, "retention_max_batch", [retention.max_batch_ms]))
+
+            failures = check_plans(captured)
+            capture.close()
+            db.session.remove()
+            db.engine.dispose()
+        return fill_s, results, failures
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def result(journal, rows, name, samples):
+    return {
+        "journal": journal,
+        "rows": rows,
+        "operation": name,
+        "samples": len(samples),
+        "mean_ms": round(sum(samples) / len(samples), 4),
+        "p50_ms": round(percentile(samples, 50), 4),
+        "p95_ms": round(percentile(samples, 95), 4),
+        "p99_ms": round(percentile(samples, 99), 4)
+    }
+
+
+def compare(results, baseline_path, tolerance, slack_ms):
+    """Entry points whose p95 grew beyond ``tolerance`` times the baseline (plus ``slack_ms``)"""
+    with open(baseline_path) as f:
+        baseline = {(r["journal"], r["rows"], r["operation"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        before = baseline.get((r["journal"], r["rows"], r["operation"]))
+        if before and r["samples"] > 1 and r["p95_ms"] > before["p95_ms"] * tolerance + slack_ms:
+            regressions.append((r, before))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10,1000,100000", help="Comma separated history sizes for the measured user (e.g. add 1000000)")
+    parser.add_argument("--users", type=int, default=20, help="Other users sharing the table")
+    parser.add_argument("--journal", default="wal,delete", help="SQLite journal modes to compare")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed calls per entry point")
+    parser.add_argument("--json", help="Write the results to this file (use as a later --baseline)")
+    parser.add_argument("--baseline", help="Fail if a p95 regressed against this earlier --json report")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed p95 growth factor against the baseline")
+    parser.add_argument("--slack-ms", type=float, default=0.2, help="Absolute p95 growth always allowed, for noise on fast queries")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    scales = [int(s) for s in args.scales.split(",") if s]
+    journals = [j.strip().lower() for j in args.journal.split(",") if j.strip()]
+
+    results = []
+    plan_failures = []
+    for journal in journals:
+        for rows in scales:
+            fill_s, scale_results, failures = run_scale(journal, rows, args, rng)
+            print(f"📊 {journal.upper()} journal, {rows} messages for the user (+{args.users} other users), filled in {fill_s:.1f}s")
+            for r in scale_results:
+                print(f"   {r['operation']:<26} p50 {r['p50_ms']:>9.4f} ms  p95 {r['p95_ms']:>9.4f} ms  p99 {r['p99_ms']:>9.4f} ms")
+            for name, verb, details in failures:
+                print(f"   ❌ {name}: {verb} does not use {INDEX}: {details}")
+            results.extend(scale_results)
+            plan_failures.extend((journal, rows) + failure for failure in failures)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"created_at": datetime.utcnow().isoformat(), "users": args.users, "results": results}, f, indent=2)
+
+    failed = False
+    if plan_failures:
+        print(f"❌ {len(plan_failures)} queries stopped using {INDEX}")
+        failed = True
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance, args.slack_ms)
+        for r, before in regressions:
+            print(f"❌ {r['operation']} ({r['journal']}, {r['rows']} rows): p95 {before['p95_ms']:.4f} ms -> {r['p95_ms']:.4f} ms")
+        if regressions:
+            failed = True
+        else:
+            print(f"✅ No p95 regressions against {args.baseline}")
+
+    if failed:
+        sys.exit(1)
+    print(f"✅ Every conversation_history query uses {INDEX}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Offline load test of /ask against a local OpenRouter stand-in
+
+Starts benchmarks/fake_openrouter.py in-process, builds the real DiscordBot
+(without connecting to Discord) and drives its /ask command callback with
+synthetic interactions, so everything from admission control to the
+database writes runs as in production. Reports throughput, end-to-end and
+first-token latency percentiles, outcomes and memory use.
+
+Requests arrive either from --concurrency closed-loop workers or, with
+--rate, as an open-loop Poisson stream. The database defaults to a
+throwaway SQLite file; pass --database-url (repeatable) to run against
+PostgreSQL or another backend, each one in its own process, and get a
+side-by-side report. Rows created on a real database are removed again.
+
+With --record the run's OpenRouter traffic is saved to a cassette, and
+--replay serves a cassette back instead of the fake server (latencies
+scaled by --replay-scale), so client changes can be compared against
+exactly the same upstream behaviour.
+
+Usage: python benchmarks/bench_load.py [--requests 500] [--users 50] [--concurrency 25]
+       [--rate 20] [--ttft lognormal:0.8,0.5] [--error-429 0.02]
+       [--database-url sqlite:///bench.db --database-url postgresql://localhost/bench] [--json report.json]
+       [--record ask.jsonl.gz | --replay ask.jsonl.gz [--replay-scale 1.0]]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_openrouter import add_arguments, from_arguments
+
+MODEL_NAME = "Bench Fast"
+MODEL_OFFICIAL_NAME = "bench/fast-model"
+MODEL_API_KEY = "sk-or-bench"
+HEADER = f"🤖 **{MODEL_NAME} Response:**\n"
+TRUNCATED = "so ask again if you need the rest.*"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def rss_mb():
+    """Current resident set size, or None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class FakeMessage:
+    def __init__(self, interaction, content):
+        self.interaction = interaction
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        await self.interaction.discord_delay()
+        self.content = content
+        self.interaction.seen(content)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, wait=False, **kwargs):
+        await self.interaction.discord_delay()
+        message = FakeMessage(self.interaction, content)
+        self.interaction.messages.append(message)
+        self.interaction.seen(content)
+        return message
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    async def defer(self, **kwargs):
+        await self.interaction.discord_delay()
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await self.interaction.discord_delay()
+        self._done = True
+        self.interaction.rejected = content
+
+    def is_done(self):
+        return self._done
+
+
+class FakeUser:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+
+
+class FakeInteraction:
+    """Just enough of ``discord.Interaction`` for the /ask callback, with simulated Discord latency"""
+
+    def __init__(self, user_id, guild_id, discord_latency, rng):
+        self.user = FakeUser(user_id, f"bench-user-{user_id}")
+        self.guild_id = guild_id
+        self.command = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.messages = []
+        self.rejected = None
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.discord_latency = discord_latency
+        self.rng = rng
+
+    async def discord_delay(self):
+        if self.discord_latency > 0:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.discord_latency)
+
+    def seen(self, content):
+        if self.first_token is None and content and content.startswith(HEADER) and len(content) > len(HEADER):
+            self.first_token = time.perf_counter()
+
+    def outcome(self):
+        if self.rejected is not None:
+            return "rejected"
+        text = self.messages[-1].content if self.messages else ""
+        if text.endswith(TRUNCATED):
+            return "truncated"
+        if self.messages and self.messages[0].content.startswith(HEADER) and not text.endswith("▌"):
+            return "ok"
+        if text.startswith("⏳"):
+            return "busy"
+        if text.startswith("⏹️"):
+            return "cancelled"
+        return "error"
+
+
+def seed_database(app, user_ids):
+    from database import db, AIModel, UserPreference
+    with app.app_context():
+        db.create_all()
+        if not AIModel.query.filter_by(name=MODEL_NAME).first():
+            db.session.add(AIModel(name=MODEL_NAME, official_name=MODEL_OFFICIAL_NAME, api_key=MODEL_API_KEY, is_active=True))
+        for user_id in user_ids:
+            db.session.add(UserPreference(user_id=str(user_id), model_name=MODEL_NAME))
+        db.session.commit()
+
+
+def clean_database(app, user_ids):
+    """Remove every row the run created for its synthetic users, summaries and per-user stats included"""
+    from database import (db, AIModel, ConversationHistory, ConversationStats, HistoryWatermark, UserPreference,
+                          conversation_cache, history_writer)
+    with app.app_context():
+        ids = [str(user_id) for user_id in user_ids]
+        with history_writer.flush_lock:
+            for user_id in ids:
+                history_writer.discard_user(user_id)
+            for model in (ConversationHistory, ConversationStats, HistoryWatermark, UserPreference):
+                model.query.filter(model.user_id.in_(ids)).delete(synchronize_session=False)
+            AIModel.query.filter_by(name=MODEL_NAME).delete()
+            db.session.commit()
+        for user_id in ids:
+            conversation_cache.drop(user_id)
+
+
+async def drive(args):
+    server = from_arguments(args, seed=args.seed)
+    base_url = await server.start()
+
+    # Imported only now so the environment set up in main() is what Config reads
+    from config import Config
+    Config.OPENROUTER_BASE_URL = base_url
+    import discord_bot
+    from cassette import cassette
+
+    rng = random.Random(args.seed)
+    # Random high IDs keep runs against a shared database apart from real users and each other
+    first_id = int(uuid.uuid4().int % 10 ** 12) * 10 ** 6
+    user_ids = [first_id + i for i in range(args.users)]
+    guild_ids = [first_id + i for i in range(max(1, args.guilds))]
+
+    app = discord_bot.get_flask_app()
+    seed_database(app, user_ids)
+    bot = discord_bot.DiscordBot()
+    ask = bot.bot.tree.get_command("ask").callback
+    prompts = [f"Benchmark question {i}: how does the bot handle load?" for i in range(args.prompts)] if args.prompts else None
+
+    interactions = []
+
+    async def one(i):
+        user_id = user_ids[i % len(user_ids)]
+        interaction = FakeInteraction(user_id, rng.choice(guild_ids), args.discord_latency, rng)
+        interactions.append(interaction)
+        # Same questions on every run, so a replayed cassette matches them
+        content = rng.choice(prompts) if prompts else f"Benchmark question {i} from user {i % len(user_ids)}"
+        try:
+            await ask(interaction, content=content)
+        except Exception as e:
+            print(f"❌ /ask raised: {e}")
+        interaction.finished = time.perf_counter()
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    if args.rate > 0:
+        tasks = []
+        for i in range(args.requests):
+            tasks.append(asyncio.create_task(one(i)))
+            await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+    else:
+        counter = iter(range(args.requests))
+
+        async def worker():
+            for i in counter:
+                await one(i)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    rss_after = rss_mb()
+
+    await bot.shutdown()
+    await server.stop()
+    if not args.keep_data:
+        clean_database(app, user_ids)
+
+    outcomes = {}
+    for interaction in interactions:
+        outcome = interaction.outcome()
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    ok = [i for i in interactions if i.outcome() == "ok"]
+    latencies = [(i.finished - i.started) * 1000 for i in ok]
+    ttfts = [(i.first_token - i.started) * 1000 for i in ok if i.first_token is not None]
+
+    backend = Config.DATABASE_URL.split(":", 1)[0]
+    return {
+        "backend": backend,
+        "requests": len(interactions),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "outcomes": outcomes,
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 1) for p in (50, 95, 99)},
+        "ttft_ms": {f"p{p}": round(percentile(ttfts, p), 1) for p in (50, 95, 99)},
+        "rss_mb": {"before": rss_before and round(rss_before, 1), "after": rss_after and round(rss_after, 1),
+                   "peak": round(peak_rss_mb(), 1)},
+        "upstream": server.stats(),
+        "cassette": cassette.stats() if cassette.mode else None,
+        "settings": {"streaming": Config.ASK_STREAMING, "rate_limit_rps": Config.RATE_LIMIT_RPS,
+                     "model_concurrency": Config.SCHEDULER_MODEL_CONCURRENCY, "max_queue": Config.SCHEDULER_MAX_QUEUE}
+    }
+
+
+def print_report(report):
+    latency, ttft, rss = report["latency_ms"], report["ttft_ms"], report["rss_mb"]
+    print(f"📊 /ask load test on {report['backend']}: {report['requests']} requests in {report['elapsed_s']:.1f}s, "
+          f"{report['throughput_rps']:.2f} answers/s")
+    print(f"   outcomes: {', '.join(f'{k} {v}' for k, v in sorted(report['outcomes'].items()))}")
+    print(f"   latency: p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, p99 {latency['p99']:.0f} ms")
+    print(f"   first token: p50 {ttft['p50']:.0f} ms, p95 {ttft['p95']:.0f} ms, p99 {ttft['p99']:.0f} ms")
+    print(f"   memory: RSS {rss['before']} -> {rss['after']} MB, peak {rss['peak']} MB")
+    print(f"   upstream: {json.dumps(report['upstream'])}")
+    if report["cassette"]:
+        print(f"   cassette: {json.dumps(report['cassette'])}")
+    print(f"   settings: {json.dumps(report['settings'])}")
+
+
+def print_comparison(reports):
+    print("📊 Backend comparison")
+    print(f"   {'backend':<12}{'answers/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ok':>7}{'peak MB':>9}")
+    for report in reports:
+        latency = report["latency_ms"]
+        print(f"   {report['backend']:<12}{report['throughput_rps']:>10.2f}{latency['p50']:>9.0f}{latency['p95']:>9.0f}"
+              f"{latency['p99']:>9.0f}{report['outcomes'].get('ok', 0):>7}{report['rss_mb']['peak']:>9.1f}")
+
+
+def without_database_urls(argv):
+    """Command line arguments minus --database-url and --json, for re-running per backend"""
+    result, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ("--database-url", "--json"):
+            skip = True
+        elif not arg.startswith(("--database-url=", "--json=")):
+            result.append(arg)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="Total /ask invocations")
+    parser.add_argument("--users", type=int, default=50, help="Distinct simulated users")
+    parser.add_argument("--guilds", type=int, default=5, help="Distinct simulated guilds")
+    parser.add_argument("--concurrency", type=int, default=25, help="Closed-loop workers (ignored with --rate)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open-loop arrival rate in requests/s")
+    parser.add_argument("--prompts", type=int, default=0, help="Draw questions from this many distinct prompts (0: all unique)")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="Mean seconds per simulated Discord API call")
+    parser.add_argument("--no-stream", action="store_true", help="Use non-streaming completions (ASK_STREAMING=false)")
+    parser.add_argument("--database-url", action="append", help="Database to test against; repeat to compare backends")
+    parser.add_argument("--keep-data", action="store_true", help="Leave the benchmark's rows in the database")
+    parser.add_argument("--json", help="Also write the report(s) to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own log output")
+    parser.add_argument("--seed", type=int, default=42)
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument("--record", metavar="CASSETTE", help="Record the run's OpenRouter traffic to this cassette")
+    cassette_group.add_argument("--replay", metavar="CASSETTE", help="Replay this cassette instead of the fake server")
+    parser.add_argument("--replay-scale", type=float, default=1.0, help="Multiply replayed latencies by this factor")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    urls = args.database_url or [None]
+    if len(urls) > 1:
+        reports = []
+        for url in urls:
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                path = f.name
+            try:
+                command = [sys.executable, os.path.abspath(__file__), *without_database_urls(sys.argv[1:]),
+                           "--database-url", url, "--json", path]
+                if subprocess.run(command).returncode != 0:
+                    print(f"❌ Load test against {url.split(':', 1)[0]} failed")
+                    sys.exit(1)
+                with open(path) as f:
+                    reports.extend(json.load(f))
+            finally:
+                os.unlink(path)
+        print_comparison(reports)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(reports, f, indent=2)
+        return
+
+    temp_db = None
+    if urls[0] is None:
+        temp_db = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+        os.environ["DATABASE_URL"] = f"sqlite:///{temp_db}"
+        args.keep_data = True
+    else:
+        os.environ["DATABASE_URL"] = urls[0]
+    os.environ.setdefault("DISCORD_BOT_TOKEN", "bench")
+    os.environ["ASK_STREAMING"] = "false" if args.no_stream else "true"
+    if args.record or args.replay:
+        os.environ["OPENROUTER_CASSETTE"] = os.path.abspath(args.record or args.replay)
+        os.environ["OPENROUTER_CASSETTE_MODE"] = "record" if args.record else "replay"
+        os.environ["OPENROUTER_REPLAY_SCALE"] = str(args.replay_scale)
+    # Keep the trace file out of the way of a real deployment's logs
+    os.environ.setdefault("TRACE_FILE", "")
+
+    try:
+        # The bot logs every request; keep the report readable unless asked
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+            report = asyncio.run(drive(args))
+    finally:
+        if temp_db:
+            os.unlink(temp_db)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([report], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
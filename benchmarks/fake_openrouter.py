@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenRouter chat completions API
+
+Serves POST /api/v1/chat/completions (JSON or server-sent events when the
+request asks for ``stream``) and GET /api/v1/models, with configurable
+latency and injected 429/5xx errors, so the bot can be load tested without
+spending API credits. Point the bot at it with OPENROUTER_BASE_URL, or let
+bench_load.py start it in-process.
+
+Latency specs: ``fixed:S``, ``uniform:LOW,HIGH``, ``exp:MEAN`` and
+``lognormal:MEDIAN,SIGMA`` (all in seconds).
+
+Usage: python benchmarks/fake_openrouter.py [--port 8089] [--ttft lognormal:0.8,0.5] [--error-429 0.02]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+
+from aiohttp import web
+
+WORDS = ("the", "model", "answer", "discord", "server", "token", "stream", "memory", "context", "quickly",
+         "because", "request", "latency", "response", "history", "bot", "user", "question", "cache", "queue")
+
+
+def parse_latency(spec):
+    """Turn a latency spec such as ``lognormal:0.8,0.5`` into a sampling function"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) if values[0] > 0 else 0.0
+    raise ValueError(f"Invalid latency spec {spec!r}")
+
+
+class FakeOpenRouter:
+    """OpenRouter-compatible server answering with filler text after simulated delays
+
+    ``ttft`` is the delay before the first token (or before the whole JSON
+    body when not streaming), ``token_delay`` the gap between streamed
+    tokens and ``tokens`` the answer length as ``(low, high)``. A share of
+    requests given by ``error_429`` and ``error_5xx`` fails instead, the
+    429s with a ``Retry-After`` header like the real API.
+    """
+
+    def __init__(self, ttft="lognormal:0.8,0.5", token_delay="fixed:0.02", tokens=(40, 200),
+                 error_429=0.0, error_5xx=0.0, retry_after=1, seed=None):
+        self.ttft = parse_latency(ttft)
+        self.token_delay = parse_latency(token_delay)
+        self.tokens = tokens
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.runner = None
+        self.base_url = None
+
+        self.requests = 0
+        self.streams = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.injected_429 = 0
+        self.injected_5xx = 0
+        self.tokens_sent = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", self.completions)
+        app.router.add_get("/api/v1/models", self.models)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving; returns the base URL to use as OPENROUTER_BASE_URL"""
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}/api/v1"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def models(self, request):
+        return web.json_response({"data": [
+            {"id": "bench/fast-model", "name": "Bench Fast", "context_length": 32768},
+            {"id": "bench/slow-model", "name": "Bench Slow", "context_length": 128000}
+        ]})
+
+    async def completions(self, request):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            body = await request.json()
+            roll = self.rng.random()
+            if roll < self.error_429:
+                self.injected_429 += 1
+                await asyncio.sleep(min(self.ttft(self.rng), 0.05))
+                return web.json_response({"error": {"code": 429, "message": "Rate limit exceeded (fake)"}},
+                                         status=429, headers={"Retry-After": str(self.retry_after)})
+            if roll < self.error_429 + self.error_5xx:
+                self.injected_5xx += 1
+                await asyncio.sleep(self.ttft(self.rng))
+                return web.json_response({"error": {"code": 502, "message": "Upstream provider error (fake)"}},
+                                         status=self.rng.choice((500, 502, 503)))
+
+            count = self.rng.randint(*self.tokens)
+            words = [self.rng.choice(WORDS) for _ in range(count)]
+            await asyncio.sleep(self.ttft(self.rng))
+            if body.get("stream"):
+                return await self._stream(request, body, words)
+
+            for _ in range(count):
+                await asyncio.sleep(self.token_delay(self.rng))
+            self.tokens_sent += count
+            return web.json_response({
+                "id": f"gen-fake-{self.requests}",
+                "model": body.get("model"),
+                "choices": [{"message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": self._prompt_tokens(body), "completion_tokens": count,
+                          "total_tokens": self._prompt_tokens(body) + count}
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request, body, words):
+        self.streams += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay(self.rng))
+            chunk = {"id": f"gen-fake-{self.requests}", "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.tokens_sent += 1
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _prompt_tokens(body):
+        return sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "streams": self.streams,
+            "max_in_flight": self.max_in_flight,
+            "injected_429": self.injected_429,
+            "injected_5xx": self.injected_5xx,
+            "tokens_sent": self.tokens_sent
+        }
+
+
+def add_arguments(parser):
+    """Server options shared with bench_load.py"""
+    parser.add_argument("--ttft", default="lognormal:0.8,0.5", help="Latency spec for the time to the first token")
+    parser.add_argument("--token-delay", default="fixed:0.02", help="Latency spec for the gap between streamed tokens")
+    parser.add_argument("--tokens", type=int, nargs=2, default=(40, 200), metavar=("LOW", "HIGH"), help="Answer length range in tokens")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Share of requests answered with a 5xx error")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+
+
+def from_arguments(args, seed=None):
+    return FakeOpenRouter(ttft=args.ttft, token_delay=args.token_delay, tokens=tuple(args.tokens),
+                          error_429=args.error_429, error_5xx=args.error_5xx, retry_after=args.retry_after, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    async def serve():
+        server = from_arguments(args)
+        base_url = await server.start(args.host, args.port)
+        print(f"🧪 Fake OpenRouter listening, set OPENROUTER_BASE_URL={base_url}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print(f"   {json.dumps(server.stats())}")
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from multidict import CIMultiDict
+from requests.structures import CaseInsensitiveDict
+from config import Config
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Response headers worth keeping; the rate limiter reacts to these
+KEPT_HEADERS = ("content-type", "retry-after", "x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset")
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def payload_keys(payload: Dict[str, Any]) -> Tuple[str, str, Tuple[str, bool]]:
+    """Exact, same-question and same-model keys for a chat completions payload"""
+    model = payload.get("model")
+    stream = bool(payload.get("stream"))
+    messages = payload.get("messages") or [{}]
+    return _digest(payload), _digest([model, stream, messages[-1].get("content")]), (model, stream)
+
+
+class _ReplayContent:
+    """Streams recorded SSE lines back with their original spacing, times ``scale``"""
+
+    def __init__(self, chunks: List[List[Any]], scale: float):
+        self.chunks = chunks
+        self.scale = scale
+
+    async def __aiter__(self):
+        started = time.monotonic()
+        for offset_ms, line in self.chunks:
+            delay = offset_ms / 1000 * self.scale - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield line.encode("utf-8") + b"\n"
+
+
+class ReplayResponse:
+    """The parts of ``aiohttp.ClientResponse`` the async client uses, served from a recording"""
+
+    def __init__(self, entry: Dict[str, Any], scale: float):
+        self.status = entry["status"]
+        self.headers = CIMultiDict(entry.get("headers") or {})
+        self.content = _ReplayContent(entry.get("chunks") or [], scale)
+        self._body = entry.get("body") or ""
+
+    async def json(self, **kwargs):
+        return json.loads(self._body)
+
+    async def text(self):
+        return self._body
+
+    def release(self):
+        pass
+
+
+class SyncReplayResponse:
+    """The parts of ``requests.Response`` the sync client uses, served from a recording"""
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.status_code = entry["status"]
+        self.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        self.text = entry.get("body") or ""
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class _RecordingContent:
+    def __init__(self, recorder: "RecordingResponse"):
+        self.recorder = recorder
+
+    async def __aiter__(self):
+        recorder = self.recorder
+        async for raw_line in recorder.response.content:
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+            if line:
+                recorder.entry["chunks"].append([round((time.monotonic() - recorder.headers_at) * 1000, 1), line])
+            yield raw_line
+
+
+class RecordingResponse:
+    """Wraps an ``aiohttp.ClientResponse`` and writes what was read from it to the cassette on release"""
+
+    def __init__(self, cassette: "Cassette", entry: Dict[str, Any], response):
+        self.cassette = cassette
+        self.entry = entry
+        self.response = response
+        self.headers_at = time.monotonic()
+        self.content = _RecordingContent(self)
+        self._saved = False
+
+    @property
+    def status(self):
+        return self.response.status
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    async def text(self):
+        self.entry["body"] = await self.response.text()
+        return self.entry["body"]
+
+    async def json(self, **kwargs):
+        return json.loads(await self.text())
+
+    def release(self):
+        if not self._saved:
+            self._saved = True
+            self.cassette._save(self.entry)
+        self.response.release()
+
+
+class Cassette:
+    """Record/replay of OpenRouter chat completions for reproducible benchmarks
+
+    In ``record`` mode every completion the clients make is appended to a
+    JSONL cassette (gzipped when the path ends in ``.gz``): the request's
+    keys, status, rate limit headers, time to headers and either the body or
+    each streamed line with its offset. In ``replay`` mode nothing goes over
+    the network; each request gets the next recording with the same payload,
+    else one for the same question and model (conversation history differs
+    between runs), else the next one for the model, served with the recorded
+    latencies multiplied by ``scale``. Recordings for one payload replay in
+    order, so a recorded 429 followed by a retry plays out the same way.
+    Streams that were cut short are not recorded.
+    """
+
+    def __init__(self, path: str = Config.OPENROUTER_CASSETTE, mode: str = Config.OPENROUTER_CASSETTE_MODE,
+                 scale: float = Config.OPENROUTER_REPLAY_SCALE):
+        if mode not in ("", RECORD, REPLAY):
+            print(f"⚠️ Unknown OPENROUTER_CASSETTE_MODE {mode!r}, not recording or replaying")
+            mode = ""
+        self.path = path
+        self.mode = mode if path else ""
+        self.scale = scale
+        self._lock = threading.Lock()
+        self._file = None
+        self._index: Optional[Dict[str, Dict[Any, deque]]] = None
+
+        self.recorded = 0
+        self.skipped = 0
+        self.replayed = {"exact": 0, "question": 0, "model": 0}
+        self.misses = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == RECORD
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    # Recording
+
+    def _entry(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        key, question, (model, stream) = payload_keys(payload)
+        entry = {"key": key, "question": question, "model": model, "stream": stream}
+        if stream:
+            entry["chunks"] = []
+        return entry
+
+    def _headers(self, headers) -> Dict[str, str]:
+        return {name: headers[name] for name in KEPT_HEADERS if headers.get(name) is not None}
+
+    def record(self, payload: Dict[str, Any], response, elapsed: float) -> RecordingResponse:
+        """Wrap an aiohttp response that took ``elapsed`` seconds to arrive"""
+        entry = self._entry(payload)
+        entry.update(status=response.status, headers=self._headers(response.headers), ttfb_ms=round(elapsed * 1000, 1))
+        return RecordingResponse(self, entry, response)
+
+    def record_sync(self, payload: Dict[str, Any], response, elapsed: float):
+        entry = self._entry(payload)
+        entry.update(status=response.status_code, headers=self._headers(response.headers),
+                     ttfb_ms=round(elapsed * 1000, 1), body=response.text)
+        self._save(entry)
+
+    def _save(self, entry: Dict[str, Any]):
+        # A stream that never reached [DONE] was cancelled or broke; replaying it would mislead
+        if entry.get("stream") and entry["status"] == 200 and (not entry["chunks"] or entry["chunks"][-1][1] != "data: [DONE]"):
+            self.skipped += 1
+            return
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = self._open("a")
+                atexit.register(self.close)
+            self._file.write(line)
+            if not self.path.endswith(".gz"):
+                self._file.flush()
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # Replay
+
+    def _load(self) -> Dict[str, Dict[Any, deque]]:
+        with self._lock:
+            if self._index is None:
+                index = {"exact": {}, "question": {}, "model": {}}
+                try:
+                    with self._open("r") as f:
+                        entries = [json.loads(line) for line in f if line.strip()]
+                except OSError as e:
+                    print(f"❌ Cannot read cassette {self.path}: {e}")
+                    entries = []
+                for entry in entries:
+                    index["exact"].setdefault(entry["key"], deque()).append(entry)
+                    index["question"].setdefault(entry["question"], deque()).append(entry)
+                    index["model"].setdefault((entry["model"], entry["stream"]), deque()).append(entry)
+                print(f"📼 Replaying {len(entries)} OpenRouter responses from {self.path}")
+                self._index = index
+        return self._index
+
+    def find(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Next recording for a payload, cycling through the matches in recorded order"""
+        index = self._load()
+        for tier, key in zip(("exact", "question", "model"), payload_keys(payload)):
+            entries = index[tier].get(key)
+            if entries:
+                with self._lock:
+                    entry = entries[0]
+                    entries.rotate(-1)
+                    self.replayed[tier] += 1
+                return entry
+        self.misses += 1
+        print(f"⚠️ No cassette recording for {payload.get('model')}, answering 502")
+        return None
+
+    @staticmethod
+    def _miss() -> Dict[str, Any]:
+        return {"status": 502, "headers": {"content-type": "application/json"}, "ttfb_ms": 0,
+                "body": json.dumps({"error": {"code": 502, "message": "No recording in cassette"}})}
+
+    async def replay(self, payload: Dict[str, Any]) -> ReplayResponse:
+        entry = self.find(payload) or self._miss()
+        if entry["ttfb_ms"] and self.scale > 0:
+            await asyncio.sleep(entry["ttfb_ms"] / 1000 * self.scale)
+        return ReplayResponse(entry, self.scale)
+
+    def replay_sync(self, payload: Dict[str, Any]) -> SyncReplayResponse:
+        entry = self.find(payload) or self._miss()
+        if entry["ttfb_ms"] and self.scale > 0:
+            time.sleep(entry["ttfb_ms"] / 1000 * self.scale)
+        return SyncReplayResponse(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode or None,
+            "path": self.path or None,
+            "scale": self.scale,
+            "recorded": self.recorded,
+            "skipped": self.skipped,
+            "replayed": dict(self.replayed),
+            "misses": self.misses
+        }
+
+
+# Shared by every OpenRouter client in the process; inactive unless configured
+cassette = Cassette()
@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+from config import Config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Health of one OpenRouter model, judged from its recent requests
+
+    Trips open when, over the last ``window`` seconds and at least
+    ``min_requests`` requests, the share of failures or of calls slower than
+    ``slow_call`` seconds reaches its threshold. After ``cooldown`` seconds it
+    goes half-open and lets one probe request through every
+    ``probe_interval`` seconds; a successful probe closes it again and a
+    failed one re-opens it.
+    """
+
+    def __init__(self, name: str, window: float, min_requests: int, error_rate: float,
+                 slow_call: float, slow_rate: float, cooldown: float, probe_interval: float):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.last_probe = 0.0
+        self.transitions = 0
+        self.reason = None
+        # (timestamp, ok, latency) for requests inside the window
+        self._calls = deque()
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _rates(self):
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, ok, latency in self._calls if ok and latency >= self.slow_call)
+        return failures / total, slow / total
+
+    def _transition(self, state: str, now: float, reason: Optional[str] = None):
+        self.state = state
+        self.transitions += 1
+        self.reason = reason
+        if state == OPEN:
+            self.opened_at = now
+        elif state == CLOSED:
+            self.opened_at = None
+            self._calls.clear()
+
+    def allow(self, now: float) -> bool:
+        """Whether a request may be sent now, moving from open to half-open once the cooldown is over"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if now - self.opened_at < self.cooldown:
+                return False
+            self._transition(HALF_OPEN, now, self.reason)
+        # Half-open: one probe per interval
+        if now - self.last_probe >= self.probe_interval:
+            self.last_probe = now
+            return True
+        return False
+
+    def record(self, now: float, ok: bool, latency: float):
+        if self.state == HALF_OPEN:
+            if ok and latency < self.slow_call:
+                self._transition(CLOSED, now)
+            else:
+                self._transition(OPEN, now, "probe failed" if not ok else "probe slow")
+            return
+        if self.state == OPEN:
+            return
+
+        self._calls.append((now, ok, latency))
+        self._trim(now)
+        if len(self._calls) < self.min_requests:
+            return
+        error_rate, slow_rate = self._rates()
+        if error_rate >= self.error_rate:
+            self._transition(OPEN, now, f"error rate {error_rate:.0%}")
+        elif slow_rate >= self.slow_rate:
+            self._transition(OPEN, now, f"slow calls {slow_rate:.0%}")
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        self._trim(now)
+        error_rate, slow_rate = self._rates()
+        latencies = sorted(latency for _, ok, latency in self._calls if ok)
+        return {
+            "official_name": self.name,
+            "state": self.state,
+            "reason": self.reason,
+            "transitions": self.transitions,
+            "requests": len(self._calls),
+            "error_rate": round(error_rate, 4),
+            "slow_rate": round(slow_rate, 4),
+            "p95_latency": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+            "open_for": round(now - self.opened_at, 3) if self.opened_at is not None else None
+        }
+
+
+class CircuitBreakerRegistry:
+    """One :class:`CircuitBreaker` per model ``official_name``, shared process-wide
+
+    ``on_change`` is called with the breaker's snapshot after every state
+    transition, from whichever thread recorded the outcome; the bot uses it
+    to store breaker state for the dashboard.
+    """
+
+    def __init__(self, window: float = Config.BREAKER_WINDOW, min_requests: int = Config.BREAKER_MIN_REQUESTS,
+                 error_rate: float = Config.BREAKER_ERROR_RATE, slow_call: float = Config.BREAKER_SLOW_CALL,
+                 slow_rate: float = Config.BREAKER_SLOW_RATE, cooldown: float = Config.BREAKER_COOLDOWN,
+                 probe_interval: float = Config.BREAKER_PROBE_INTERVAL):
+        self.settings = dict(window=window, min_requests=min_requests, error_rate=error_rate, slow_call=slow_call,
+                             slow_rate=slow_rate, cooldown=cooldown, probe_interval=probe_interval)
+        self.on_change: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **self.settings)
+            self._breakers[name] = breaker
+        return breaker
+
+    def _notify(self, snapshot: Optional[Dict[str, Any]]):
+        if snapshot is not None and self.on_change is not None:
+            try:
+                self.on_change(snapshot)
+            except Exception as e:
+                print(f"❌ Failed to report circuit breaker change: {e}")
+
+    def allow(self, name: str) -> bool:
+        """Claim permission to send a request to ``name`` (consumes a half-open probe)"""
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._get(name)
+            transitions = breaker.transitions
+            allowed = breaker.allow(now)
+            snapshot = breaker.snapshot(now) if breaker.transitions != transitions else None
+        self._notify(snapshot)
+        return allowed
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            return breaker.state if breaker else CLOSED
+
+    def is_available(self, name: str) -> bool:
+        """Whether ``name`` is closed or due a probe, without claiming anything"""
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None or breaker.state == CLOSED:
+                return True
+            if breaker.state == OPEN:
+                return now - breaker.opened_at >= breaker.cooldown
+            return now - breaker.last_probe >= breaker.probe_interval
+
+    def record(self, name: str, ok: bool, latency: float):
+        """Report a request's outcome: ``ok`` for a healthy response, latency to first byte"""
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._get(name)
+            transitions = breaker.transitions
+            breaker.record(now, ok, latency)
+            snapshot = breaker.snapshot(now) if breaker.transitions != transitions else None
+        if snapshot is not None:
+            print(f"⚡ Circuit breaker for {name} is now {snapshot['state']}"
+                  + (f" ({snapshot['reason']})" if snapshot['reason'] else ""))
+        self._notify(snapshot)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [breaker.snapshot(now) for breaker in self._breakers.values()]
+
+
+# Shared by the OpenRouter clients (outcomes) and /ask (routing)
+circuit_breakers = CircuitBreakerRegistry()
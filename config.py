@@ -11,4 +11,135 @@ class Config:
     # Use PostgreSQL in production, SQLite in development
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bot_database.db')
     if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
-        DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1) 
\ No newline at end of file
+        DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+
+    # OpenRouter API endpoint; point it at benchmarks/fake_openrouter.py for offline load tests
+    OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1').rstrip('/')
+
+    # Record chat completions to the OPENROUTER_CASSETTE file ("record"), or answer from it without
+    # touching the network ("replay") with the recorded latencies times OPENROUTER_REPLAY_SCALE
+    OPENROUTER_CASSETTE = os.getenv('OPENROUTER_CASSETTE', '')
+    OPENROUTER_CASSETTE_MODE = os.getenv('OPENROUTER_CASSETTE_MODE', '').lower()
+    OPENROUTER_REPLAY_SCALE = float(os.getenv('OPENROUTER_REPLAY_SCALE', 1.0))
+
+    # OpenRouter HTTP connection pooling (one pool per API key, shared process-wide)
+    OPENROUTER_POOL_SIZE = int(os.getenv('OPENROUTER_POOL_SIZE', 20))
+    OPENROUTER_POOL_IDLE_TIMEOUT = float(os.getenv('OPENROUTER_POOL_IDLE_TIMEOUT', 300))
+    OPENROUTER_KEEPALIVE_TIMEOUT = float(os.getenv('OPENROUTER_KEEPALIVE_TIMEOUT', 30))
+
+    # Stream /ask responses and progressively edit the reply (seconds between edits)
+    ASK_STREAMING = os.getenv('ASK_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+
+    # Worker threads the Discord bot uses for blocking database work
+    DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', 8))
+
+    # Seconds the bot caches the ai_model table before reloading it
+    MODEL_REGISTRY_TTL = float(os.getenv('MODEL_REGISTRY_TTL', 60))
+
+    # Write-behind batching for conversation history inserts made by the bot
+    HISTORY_WRITE_BEHIND = os.getenv('HISTORY_WRITE_BEHIND', 'true').lower() in ('1', 'true', 'yes')
+    HISTORY_FLUSH_BATCH = int(os.getenv('HISTORY_FLUSH_BATCH', 100))
+    HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', 0.5))
+
+    # Hot in-memory tier of recent messages per active user
+    CONVERSATION_CACHE_USERS = int(os.getenv('CONVERSATION_CACHE_USERS', 1000))
+    CONVERSATION_CACHE_MESSAGES = int(os.getenv('CONVERSATION_CACHE_MESSAGES', 50))
+
+    # Conversation context sent with /ask: at most this many recent messages and history
+    # tokens, further limited by the model's context window (default for unknown models)
+    CONTEXT_MAX_MESSAGES = int(os.getenv('CONTEXT_MAX_MESSAGES', 50))
+    CONTEXT_HISTORY_TOKENS = int(os.getenv('CONTEXT_HISTORY_TOKENS', 4000))
+    DEFAULT_CONTEXT_WINDOW = int(os.getenv('DEFAULT_CONTEXT_WINDOW', 8192))
+
+    # Background compaction of long histories into a rolling summary written by a cheap model.
+    # Off by default: it sends users' history to SUMMARY_MODEL and deletes the summarized rows.
+    # SUMMARY_API_KEY defaults to the API key of the model the user is chatting with.
+    SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'google/gemini-flash-1.5:free')
+    SUMMARY_API_KEY = os.getenv('SUMMARY_API_KEY') or None
+    SUMMARY_TRIGGER_TOKENS = int(os.getenv('SUMMARY_TRIGGER_TOKENS', 3000))
+    SUMMARY_KEEP_MESSAGES = int(os.getenv('SUMMARY_KEEP_MESSAGES', 10))
+    SUMMARY_BATCH_TOKENS = int(os.getenv('SUMMARY_BATCH_TOKENS', 8000))
+
+    # Conversation history retention, enforced by a background job that deletes in batches of
+    # RETENTION_BATCH_SIZE rows every RETENTION_INTERVAL seconds. 0 turns a limit off; rows hidden
+    # by /clear_memory are purged regardless. Pruned rows are appended to gzipped JSONL files in
+    # RETENTION_ARCHIVE_DIR first when it is set.
+    RETENTION_MAX_AGE_DAYS = float(os.getenv('RETENTION_MAX_AGE_DAYS', 0))
+    RETENTION_MAX_MESSAGES_PER_USER = int(os.getenv('RETENTION_MAX_MESSAGES_PER_USER', 0))
+    RETENTION_INACTIVE_DAYS = float(os.getenv('RETENTION_INACTIVE_DAYS', 0))
+    RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 600))
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 500))
+    RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', 0.05))
+    RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', '')
+
+    # Shared OpenRouter rate limit per (API key, model): requests per second, burst size,
+    # and the longest a request may queue for a slot before giving up (seconds)
+    RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', 10.0))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 20))
+    RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 60))
+
+    # Per-model circuit breaker: trips when, within BREAKER_WINDOW seconds and at least
+    # BREAKER_MIN_REQUESTS requests, the error rate or share of calls slower than
+    # BREAKER_SLOW_CALL seconds reaches its threshold; probes again after BREAKER_COOLDOWN
+    BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', 120))
+    BREAKER_MIN_REQUESTS = int(os.getenv('BREAKER_MIN_REQUESTS', 5))
+    BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', 0.5))
+    BREAKER_SLOW_CALL = float(os.getenv('BREAKER_SLOW_CALL', 20))
+    BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', 0.8))
+    BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', 30))
+    BREAKER_PROBE_INTERVAL = float(os.getenv('BREAKER_PROBE_INTERVAL', 10))
+
+    # Opt-in hedging: when a request has no first token after the model's HEDGE_PERCENTILE
+    # time to first token (HEDGE_DEFAULT_DELAY until enough samples, never below HEDGE_MIN_DELAY),
+    # send a second one to the same model or its sibling and use whichever answers first.
+    # HEDGE_MAX_RATE caps the share of requests hedged; HEDGE_SIBLINGS is "model=sibling,...".
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.95))
+    HEDGE_MAX_RATE = float(os.getenv('HEDGE_MAX_RATE', 0.1))
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 2.0))
+    HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', 10.0))
+    HEDGE_SIBLINGS = os.getenv('HEDGE_SIBLINGS', '')
+
+    # Opt-in exact-match response cache. RESPONSE_CACHE_MODELS lists the official model names
+    # to cache as "model" or "model=ttl_seconds", comma separated ("*" caches every model).
+    # Requests with conversation history bypass the cache unless RESPONSE_CACHE_STATEFUL is set.
+    RESPONSE_CACHE_MODELS = os.getenv('RESPONSE_CACHE_MODELS', '')
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 600))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 5 * 1024 * 1024))
+    RESPONSE_CACHE_STATEFUL = os.getenv('RESPONSE_CACHE_STATEFUL', 'false').lower() in ('1', 'true', 'yes')
+
+    # Identical /ask requests in flight at the same time share one OpenRouter call
+    COALESCE_REQUESTS = os.getenv('COALESCE_REQUESTS', 'true').lower() in ('1', 'true', 'yes')
+
+    # Admission control for /ask. At most SCHEDULER_MAX_QUEUE questions wait at once and each user
+    # may have SCHEDULER_MAX_PER_USER outstanding; waiting questions are served fairly per user and
+    # guild (a guild gets SCHEDULER_GUILD_WEIGHT users' worth of turns), team members first, with
+    # at most SCHEDULER_MODEL_CONCURRENCY running per model. SCHEDULER_MAX_WAIT is in seconds.
+    SCHEDULER_MAX_QUEUE = int(os.getenv('SCHEDULER_MAX_QUEUE', 50))
+    SCHEDULER_MAX_PER_USER = int(os.getenv('SCHEDULER_MAX_PER_USER', 2))
+    SCHEDULER_MODEL_CONCURRENCY = int(os.getenv('SCHEDULER_MODEL_CONCURRENCY', 8))
+    SCHEDULER_GUILD_WEIGHT = float(os.getenv('SCHEDULER_GUILD_WEIGHT', 4))
+    SCHEDULER_MAX_WAIT = float(os.getenv('SCHEDULER_MAX_WAIT', 120))
+
+    # What a new /ask does about the same user's unfinished ones: "cancel" stops them, "queue" waits
+    # for them to finish and "parallel" runs them side by side. /clear_memory always stops them.
+    ASK_SUPERSEDE_POLICY = os.getenv('ASK_SUPERSEDE_POLICY', 'cancel').lower()
+
+    # Bearer token required to scrape /metrics; leave empty to serve it without authentication
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+    # Share of /ask interactions traced end to end (0 disables tracing). Traces are appended to
+    # TRACE_FILE as JSON lines, rotated at TRACE_MAX_BYTES with TRACE_BACKUP_COUNT old files kept.
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.05))
+    TRACE_FILE = os.getenv('TRACE_FILE', 'logs/traces.jsonl')
+    TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', 10 * 1024 * 1024))
+    TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', 3))
+
+    # Event loop watchdog: a heartbeat every LOOP_WATCHDOG_INTERVAL seconds measures loop lag, and a
+    # heartbeat late by LOOP_STALL_THRESHOLD seconds captures the stack of whatever blocks the loop.
+    LOOP_WATCHDOG_ENABLED = os.getenv('LOOP_WATCHDOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', 0.1))
+    LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', 0.25))
+    LOOP_STALL_HISTORY = int(os.getenv('LOOP_STALL_HISTORY', 50))
@@ -1,8 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import Config
+from token_budget import estimate_tokens, pack_history
+import atexit
+import sys
+import threading
+import time
 
 db = SQLAlchemy()
 
+# Role of the rolling summary row that stands in for a user's compacted older messages
+SUMMARY_ROLE = 'summary'
+
+# Stands in for "no watermark" when comparing against history timestamps
+EPOCH = datetime(1970, 1, 1)
+
 class UserPreference(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(50), unique=True, nullable=False)
@@ -17,58 +33,694 @@ class AIModel(db.Model):
     api_key = db.Column(db.String(500), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     team_only = db.Column(db.Boolean, default=False)  # New field for team-only mode
+    is_fallback = db.Column(db.Boolean, default=False)  # Answers /ask while another model's circuit breaker is open
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class CircuitBreakerState(db.Model):
+    """Last known circuit breaker state per model, written by the bot for the dashboard"""
+    official_name = db.Column(db.String(100), primary_key=True)
+    state = db.Column(db.String(10), nullable=False)  # 'closed', 'open' or 'half_open'
+    reason = db.Column(db.String(100))
+    transitions = db.Column(db.Integer, default=0)
+    error_rate = db.Column(db.Float)
+    slow_rate = db.Column(db.Float)
+    p95_latency = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def save(snapshot: Dict[str, Any]):
+        """Store a breaker snapshot, ignoring ones older than what is already stored"""
+        row = db.session.get(CircuitBreakerState, snapshot["official_name"])
+        if row is None:
+            row = CircuitBreakerState(official_name=snapshot["official_name"])
+            db.session.add(row)
+        elif (row.transitions or 0) > snapshot["transitions"]:
+            return
+        row.state = snapshot["state"]
+        row.reason = snapshot["reason"]
+        row.transitions = snapshot["transitions"]
+        row.error_rate = snapshot["error_rate"]
+        row.slow_rate = snapshot["slow_rate"]
+        row.p95_latency = snapshot["p95_latency"]
+        row.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    @staticmethod
+    def reset_all():
+        """Mark every stored breaker closed; a new bot process starts with fresh breakers"""
+        CircuitBreakerState.query.update({
+            CircuitBreakerState.state: 'closed',
+            CircuitBreakerState.reason: None,
+            CircuitBreakerState.transitions: 0,
+            CircuitBreakerState.error_rate: None,
+            CircuitBreakerState.slow_rate: None,
+            CircuitBreakerState.p95_latency: None,
+            CircuitBreakerState.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+
 class ConversationHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(50), nullable=False)
-    role = db.Column(db.String(10), nullable=False)  # 'user' or 'assistant'
+    role = db.Column(db.String(10), nullable=False)  # 'user', 'assistant' or 'summary'
     content = db.Column(db.Text, nullable=False)
     model_name = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    token_count = db.Column(db.Integer)  # Estimated tokens in content, cached for context packing
 
     # Index for faster queries
     __table_args__ = (
         db.Index('idx_user_created', 'user_id', 'created_at'),
     )
 
+    @staticmethod
+    def visible(user_id: str):
+        """Query for a user's rows, minus those hidden by /clear_memory and not yet purged"""
+        cleared_before = db.select(HistoryWatermark.cleared_before).where(HistoryWatermark.user_id == user_id).scalar_subquery()
+        return ConversationHistory.query.filter(
+            ConversationHistory.user_id == user_id,
+            ConversationHistory.created_at > func.coalesce(cleared_before, EPOCH)
+        )
+
     @staticmethod
     def get_user_history(user_id: str, limit: int = 10):
         """Get recent conversation history for a user"""
-        return ConversationHistory.query.filter_by(user_id=user_id)\
-            .order_by(ConversationHistory.created_at.desc())\
-            .limit(limit).all()
+        def query():
+            return ConversationHistory.visible(user_id).filter(ConversationHistory.role != SUMMARY_ROLE)\
+                .order_by(ConversationHistory.created_at.desc())\
+                .limit(limit).all()
+
+        history, pending = history_writer.read_through(user_id, query)
+        if not pending:
+            return history
+
+        # Merge rows still waiting in the write-behind queue (newest first)
+        history.extend(ConversationHistory(**row) for row in pending)
+        history.sort(key=lambda msg: msg.created_at, reverse=True)
+        return history[:limit]
+
+    @staticmethod
+    def count_messages(user_id: str, role: Optional[str] = None) -> int:
+        """Count a user's messages, including ones not yet flushed"""
+        def query():
+            q = ConversationHistory.visible(user_id)
+            if role:
+                q = q.filter_by(role=role)
+            else:
+                q = q.filter(ConversationHistory.role != SUMMARY_ROLE)
+            return q.count()
+
+        count, pending = history_writer.read_through(user_id, query)
+        return count + sum(1 for row in pending if role is None or row["role"] == role)
+
+    @staticmethod
+    def get_summary(user_id: str):
+        """The user's rolling summary of compacted messages, if any"""
+        return ConversationHistory.visible(user_id).filter_by(role=SUMMARY_ROLE)\
+            .order_by(ConversationHistory.created_at.desc()).first()
 
     @staticmethod
     def add_message(user_id: str, role: str, content: str, model_name: str):
         """Add a new message to conversation history"""
-        message = ConversationHistory(
-            user_id=user_id,
-            role=role,
-            content=content,
-            model_name=model_name
-        )
+        row = {
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "model_name": model_name,
+            "created_at": datetime.utcnow(),
+            "token_count": estimate_tokens(content)
+        }
+
+        if history_writer.running:
+            # Batched into a bulk insert by the write-behind thread
+            history_writer.enqueue(row)
+            conversation_cache.append(user_id, role, content, row["token_count"])
+            return ConversationHistory(**row)
+
+        message = ConversationHistory(**row)
         db.session.add(message)
+        ConversationStats.record_added([row])
         db.session.commit()
+        conversation_cache.append(user_id, role, content, row["token_count"])
         return message
 
     @staticmethod
     def clear_user_history(user_id: str):
-        """Clear all conversation history for a user"""
-        ConversationHistory.query.filter_by(user_id=user_id).delete()
-        db.session.commit()
+        """Clear all conversation history for a user
+
+        Rather than deleting what may be a huge history in one statement, this
+        only moves the user's watermark to now, which hides every existing row
+        at once. The retention job deletes the hidden rows in small batches.
+        """
+        with history_writer.flush_lock:
+            # Drop queued rows too, and make sure no in-flight batch lands after the watermark
+            history_writer.discard_user(user_id)
+            watermark = db.session.get(HistoryWatermark, user_id)
+            if watermark is None:
+                watermark = HistoryWatermark(user_id=user_id)
+                db.session.add(watermark)
+            watermark.cleared_before = datetime.utcnow()
+            ConversationStats.query.filter_by(user_id=user_id).delete()
+            db.session.commit()
+            conversation_cache.drop(user_id)
+
+    @staticmethod
+    def get_cached_context(user_id: str, limit: int = 10, token_budget: Optional[int] = None) -> Optional[Tuple[List[Dict[str, str]], int]]:
+        """
+        Conversation context from the in-memory tier, or None if the user isn't cached
+
+        Returns ``(messages, tokens)``: the newest of the last ``limit`` messages
+        that fit in ``token_budget`` (all of them when no budget is given) and
+        their estimated token count.
+        """
+        cached = conversation_cache.get(user_id, limit)
+        if cached is None:
+            return None
+        summary, entries = cached
+        return pack_history(entries, sys.maxsize if token_budget is None else token_budget, summary)
 
     @staticmethod
-    def get_conversation_context(user_id: str, limit: int = 10):
+    def get_conversation_context(user_id: str, limit: int = 10, token_budget: Optional[int] = None):
         """Get conversation history formatted for API calls"""
-        history = ConversationHistory.get_user_history(user_id, limit)
+        cached = ConversationHistory.get_cached_context(user_id, limit, token_budget)
+        if cached is None:
+            cached = ConversationHistory.load_conversation_context(user_id, limit, token_budget)
+        return cached[0]
+
+    @staticmethod
+    def load_conversation_context(user_id: str, limit: int = 10, token_budget: Optional[int] = None) -> Tuple[List[Dict[str, str]], int]:
+        """Read conversation context from the database and warm the in-memory tier"""
+        # Load enough to fill the user's ring buffer, not just this request
+        load_limit = max(limit, conversation_cache.per_user)
+        token = conversation_cache.begin_load(user_id)
+        summary_row = ConversationHistory.get_summary(user_id)
+        history = ConversationHistory.get_user_history(user_id, load_limit)
         # Reverse to get chronological order (oldest first)
         history.reverse()
 
-        messages = []
-        for msg in history:
-            messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
-        return messages
+        # Rows written before token counts were stored are estimated on the fly
+        entries = [
+            (msg.role, msg.content, msg.token_count if msg.token_count is not None else estimate_tokens(msg.content))
+            for msg in history
+        ]
+        summary = None
+        if summary_row is not None:
+            summary = (summary_row.content, summary_row.token_count if summary_row.token_count is not None else estimate_tokens(summary_row.content))
+        conversation_cache.populate(user_id, token, entries, complete=len(entries) < load_limit, summary=summary)
+
+        recent = entries[-limit:] if limit else []
+        return pack_history(recent, sys.maxsize if token_budget is None else token_budget, summary)
+
+
+class HistoryWatermark(db.Model):
+    """Per-user cutoff set by /clear_memory: older rows are hidden until the retention job purges them"""
+    user_id = db.Column(db.String(50), primary_key=True)
+    cleared_before = db.Column(db.DateTime, nullable=False)
+
+
+class ConversationStats(db.Model):
+    """Per-user message and token totals, kept in step with conversation_history
+
+    Every write to the history updates its user's row in the same
+    transaction, so /memory_info and /clear_memory read one row by primary
+    key instead of counting the user's history. A user without a row (new,
+    cleared, or from before this table existed) gets one built from the
+    history table on first read; :meth:`rebuild` recomputes every row.
+    """
+    user_id = db.Column(db.String(50), primary_key=True)
+    user_messages = db.Column(db.Integer, nullable=False, default=0)
+    assistant_messages = db.Column(db.Integer, nullable=False, default=0)
+    user_tokens = db.Column(db.Integer, nullable=False, default=0)
+    assistant_tokens = db.Column(db.Integer, nullable=False, default=0)
+    has_summary = db.Column(db.Boolean, nullable=False, default=False)
+    summary_tokens = db.Column(db.Integer, nullable=False, default=0)
+    last_message_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def record_added(rows: List[Dict[str, Any]]):
+        """Count new history rows into their users' stats; call in the transaction inserting them"""
+        deltas: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            delta = deltas.setdefault(row["user_id"], {"user": [0, 0], "assistant": [0, 0], "summary": None, "last": None})
+            tokens = row.get("token_count") or 0
+            if row["role"] == SUMMARY_ROLE:
+                delta["summary"] = tokens
+                continue
+            if row["role"] in ("user", "assistant"):
+                delta[row["role"]][0] += 1
+                delta[row["role"]][1] += tokens
+            if delta["last"] is None or row["created_at"] > delta["last"]:
+                delta["last"] = row["created_at"]
+
+        stats = ConversationStats
+        for user_id, delta in deltas.items():
+            values = {
+                "user_messages": stats.user_messages + delta["user"][0],
+                "assistant_messages": stats.assistant_messages + delta["assistant"][0],
+                "user_tokens": stats.user_tokens + delta["user"][1],
+                "assistant_tokens": stats.assistant_tokens + delta["assistant"][1],
+                "updated_at": datetime.utcnow()
+            }
+            if delta["last"] is not None:
+                values["last_message_at"] = delta["last"]
+            if delta["summary"] is not None:
+                values["has_summary"] = True
+                values["summary_tokens"] = delta["summary"]
+            # Users without a row are built from the history table when next read
+            db.session.execute(db.update(stats).where(stats.user_id == user_id).values(**values))
+
+    @staticmethod
+    def record_compacted(user_id: str, messages: List[Dict[str, Any]], summary_tokens: int):
+        """Account for messages folded into a new rolling summary; call in the same transaction"""
+        stats = ConversationStats
+        counts = {"user": [0, 0], "assistant": [0, 0]}
+        for message in messages:
+            if message["role"] in counts:
+                counts[message["role"]][0] += 1
+                counts[message["role"]][1] += message["tokens"]
+        db.session.execute(db.update(stats).where(stats.user_id == user_id).values(
+            user_messages=stats.user_messages - counts["user"][0],
+            assistant_messages=stats.assistant_messages - counts["assistant"][0],
+            user_tokens=stats.user_tokens - counts["user"][1],
+            assistant_tokens=stats.assistant_tokens - counts["assistant"][1],
+            has_summary=True,
+            summary_tokens=summary_tokens,
+            updated_at=datetime.utcnow()
+        ))
+
+    @staticmethod
+    def record_removed(user_id: str, rows: List["ConversationHistory"]):
+        """Take pruned history rows out of a user's stats; call in the transaction deleting them"""
+        stats = ConversationStats
+        counts = {"user": [0, 0], "assistant": [0, 0]}
+        summary_removed = False
+        for row in rows:
+            if row.role == SUMMARY_ROLE:
+                summary_removed = True
+            elif row.role in counts:
+                counts[row.role][0] += 1
+                counts[row.role][1] += row.token_count or 0
+        values = {
+            "user_messages": stats.user_messages - counts["user"][0],
+            "assistant_messages": stats.assistant_messages - counts["assistant"][0],
+            "user_tokens": stats.user_tokens - counts["user"][1],
+            "assistant_tokens": stats.assistant_tokens - counts["assistant"][1],
+            "updated_at": datetime.utcnow()
+        }
+        if summary_removed:
+            values["has_summary"] = False
+            values["summary_tokens"] = 0
+        db.session.execute(db.update(stats).where(stats.user_id == user_id).values(**values))
+
+    @staticmethod
+    def _aggregate():
+        """SELECT computing stats rows from conversation_history, one per user"""
+        history = ConversationHistory
+        tokens = func.coalesce(history.token_count, 0)
+
+        def total(role, value):
+            return func.coalesce(func.sum(case((history.role == role, value), else_=0)), 0)
+
+        return db.select(
+            history.user_id,
+            total("user", 1),
+            total("assistant", 1),
+            total("user", tokens),
+            total("assistant", tokens),
+            func.max(case((history.role == SUMMARY_ROLE, 1), else_=0)) > 0,
+            total(SUMMARY_ROLE, tokens),
+            func.max(case((history.role != SUMMARY_ROLE, history.created_at))),
+            db.literal(datetime.utcnow(), db.DateTime)
+        ).outerjoin(HistoryWatermark, HistoryWatermark.user_id == history.user_id)\
+            .where(history.created_at > func.coalesce(HistoryWatermark.cleared_before, EPOCH))\
+            .group_by(history.user_id)
+
+    @staticmethod
+    def _insert_from_history(user_id: Optional[str] = None):
+        columns = ["user_id", "user_messages", "assistant_messages", "user_tokens", "assistant_tokens",
+                   "has_summary", "summary_tokens", "last_message_at", "updated_at"]
+        select = ConversationStats._aggregate()
+        if user_id is not None:
+            select = select.where(ConversationHistory.user_id == user_id)
+        return db.session.execute(db.insert(ConversationStats).from_select(columns, select)).rowcount
+
+    @staticmethod
+    def rebuild(user_id: Optional[str] = None) -> int:
+        """Recompute stats from conversation_history for one user or everyone; returns rows written"""
+        # Keeps write-behind flushes and /clear_memory from landing between the delete and the insert
+        with history_writer.flush_lock:
+            query = ConversationStats.query
+            if user_id is not None:
+                query = query.filter_by(user_id=user_id)
+            query.delete(synchronize_session=False)
+            written = ConversationStats._insert_from_history(user_id)
+            db.session.commit()
+        return written
+
+    @staticmethod
+    def _load(user_id: str):
+        stats = ConversationStats
+        columns = (stats.user_messages, stats.assistant_messages, stats.user_tokens, stats.assistant_tokens,
+                   stats.has_summary, stats.summary_tokens, stats.last_message_at)
+        row = db.session.execute(db.select(*columns).where(stats.user_id == user_id)).first()
+        if row is not None:
+            return row
+        # Like rebuild(): a write-behind flush landing between the aggregate and the
+        # insert would have its record_added UPDATE miss the row and its rows go uncounted
+        with history_writer.flush_lock:
+            row = db.session.execute(db.select(*columns).where(stats.user_id == user_id)).first()
+            if row is not None:
+                return row
+            if not ConversationHistory.visible(user_id).limit(1).first():
+                return None
+            try:
+                ConversationStats._insert_from_history(user_id)
+                db.session.commit()
+            except IntegrityError:
+                # Another process built it first
+                db.session.rollback()
+            return db.session.execute(db.select(*columns).where(stats.user_id == user_id)).first()
+
+    @staticmethod
+    def for_user(user_id: str) -> Dict[str, Any]:
+        """A user's totals, including messages still queued for the database"""
+        row, pending = history_writer.read_through(user_id, lambda: ConversationStats._load(user_id))
+        user_messages, assistant_messages, user_tokens, assistant_tokens, has_summary, summary_tokens, last_message_at = \
+            row if row is not None else (0, 0, 0, 0, False, 0, None)
+        for message in pending:
+            tokens = message.get("token_count") or 0
+            if message["role"] == "user":
+                user_messages += 1
+                user_tokens += tokens
+            elif message["role"] == "assistant":
+                assistant_messages += 1
+                assistant_tokens += tokens
+            if last_message_at is None or message["created_at"] > last_message_at:
+                last_message_at = message["created_at"]
+        return {
+            "messages": user_messages + assistant_messages,
+            "user_messages": user_messages,
+            "assistant_messages": assistant_messages,
+            "tokens": user_tokens + assistant_tokens,
+            "user_tokens": user_tokens,
+            "assistant_tokens": assistant_tokens,
+            "summarized": bool(has_summary),
+            "summary_tokens": summary_tokens,
+            "last_message_at": last_message_at
+        }
+
+
+class ConversationCache:
+    """Hot in-memory tier of recent messages for active users
+
+    An LRU over users, each holding a bounded ring buffer of
+    ``(role, content, tokens)`` tuples plus the user's rolling summary. Buffers are filled lazily from the database, kept current by
+    ``add_message`` and dropped by ``clear_user_history``, so an active chat
+    builds its context without a query.
+    """
+
+    def __init__(self, max_users: int = Config.CONVERSATION_CACHE_USERS, per_user: int = Config.CONVERSATION_CACHE_MESSAGES):
+        self.max_users = max_users
+        self.per_user = per_user
+        self._lock = threading.Lock()
+        # user_id -> [deque of (role, content, tokens), complete, (summary, tokens) or None];
+        # complete means the deque holds every message newer than the summary
+        self._users: "OrderedDict[str, list]" = OrderedDict()
+        # user_id -> dirty flag for loads in progress, so a write during a load isn't lost
+        self._loading: Dict[str, bool] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, limit: int) -> Optional[Tuple[Optional[Tuple[str, int]], List[Tuple[str, str, int]]]]:
+        """``(summary, newest limit messages in chronological order)``, or None on a miss"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or (len(entry[0]) < limit and not entry[1]):
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            messages = list(entry[0])
+            return entry[2], messages[-limit:] if limit else []
+
+    def begin_load(self, user_id: str) -> object:
+        with self._lock:
+            self._loading[user_id] = False
+            return user_id
+
+    def populate(self, user_id: str, token: object, entries: List[Tuple[str, str, int]], complete: bool, summary: Optional[Tuple[str, int]] = None):
+        """Install messages read from the database, unless they changed while loading"""
+        with self._lock:
+            dirty = self._loading.pop(token, True)
+            if dirty or self.per_user <= 0:
+                return
+            self._users[user_id] = [deque(entries[-self.per_user:], maxlen=self.per_user), complete and len(entries) <= self.per_user, summary]
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def append(self, user_id: str, role: str, content: str, tokens: int):
+        with self._lock:
+            if user_id in self._loading:
+                self._loading[user_id] = True
+            entry = self._users.get(user_id)
+            if entry is None:
+                return
+            if len(entry[0]) == entry[0].maxlen:
+                # The oldest message falls out of the buffer
+                entry[1] = False
+            entry[0].append((role, content, tokens))
+
+    def usage(self, user_id: str) -> Optional[Tuple[int, int, bool]]:
+        """``(messages, tokens, complete)`` held for a user, without touching the LRU order or hit rate"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            return len(entry[0]), sum(tokens for _, _, tokens in entry[0]), entry[1]
+
+    def drop(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+            if user_id in self._loading:
+                self._loading[user_id] = True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "per_user": self.per_user,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class HistoryWriteBehind:
+    """Write-behind queue for ConversationHistory inserts
+
+    ``add_message`` hands rows to this queue instead of committing each one.
+    A background thread flushes them as a single bulk insert once
+    ``max_batch`` rows are waiting or every ``interval`` seconds, whichever
+    comes first. Reads for a user with queued rows merge them in, and
+    :meth:`stop` flushes everything that is left.
+    """
+
+    def __init__(self, max_batch: int = Config.HISTORY_FLUSH_BATCH, interval: float = Config.HISTORY_FLUSH_INTERVAL):
+        self.max_batch = max_batch
+        self.interval = interval
+        self._app_factory = None
+        self._thread = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Held for the whole of a flush, so readers never see a batch half-way into the table
+        self.flush_lock = threading.RLock()
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_users: Dict[str, int] = {}
+
+        # Tuning metrics
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_flushed = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._stopping
+
+    def start(self, app_factory: Callable):
+        """Start the flush thread; ``app_factory`` returns the Flask app to flush under"""
+        if self._thread is not None:
+            return
+        self._app_factory = app_factory
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="history-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def enqueue(self, row: Dict[str, Any]):
+        with self._lock:
+            self._pending.append(row)
+            self._pending_users[row["user_id"]] = self._pending_users.get(row["user_id"], 0) + 1
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def read_through(self, user_id: str, query: Callable):
+        """Run ``query`` and return ``(result, queued rows for user_id)`` as one consistent view"""
+        with self._lock:
+            has_pending = user_id in self._pending_users
+        if not has_pending:
+            return query(), []
+
+        with self.flush_lock:
+            result = query()
+            with self._lock:
+                return result, [row for row in self._pending if row["user_id"] == user_id]
+
+    def discard_user(self, user_id: str) -> int:
+        """Drop queued rows for a user, returning how many were dropped"""
+        with self._lock:
+            dropped = self._pending_users.pop(user_id, 0)
+            if dropped:
+                self._pending = [row for row in self._pending if row["user_id"] != user_id]
+            return dropped
+
+    def flush(self):
+        """Bulk insert everything queued so far"""
+        with self.flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._pending_users = {}
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            try:
+                with self._app_factory().app_context():
+                    try:
+                        db.session.execute(db.insert(ConversationHistory), batch)
+                        ConversationStats.record_added(batch)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+            except Exception as e:
+                print(f"❌ History flush of {len(batch)} rows failed: {e}")
+                with self._lock:
+                    # Put the batch back in front of anything queued meanwhile and retry next cycle
+                    self._pending = batch + self._pending
+                    for row in batch:
+                        self._pending_users[row["user_id"]] = self._pending_users.get(row["user_id"], 0) + 1
+                    self.failed_flushes += 1
+                return
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.flushes += 1
+                self.rows_flushed += len(batch)
+                self.last_batch_size = len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                self.total_flush_ms += elapsed_ms
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and write out anything still queued"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "rows_flushed": self.rows_flushed,
+                "avg_batch_size": round(self.rows_flushed / self.flushes, 2) if self.flushes else 0.0,
+                "last_batch_size": self.last_batch_size,
+                "max_batch_size": self.max_batch_size,
+                "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "max_batch": self.max_batch,
+                "interval": self.interval
+            }
+
+
+# Columns added to existing tables after their first release: table -> [(column, DDL type)]
+ADDED_COLUMNS = {
+    'ai_model': [('team_only', 'BOOLEAN DEFAULT FALSE'), ('is_fallback', 'BOOLEAN DEFAULT FALSE')],
+    'conversation_history': [('token_count', 'INTEGER')],
+}
+
+
+def migrate_schema() -> Dict[str, Any]:
+    """Bring an existing database up to date; safe to run on every start (needs an app context)
+
+    ``create_all`` only creates missing tables, so columns added to existing
+    ones since are added here, and rows stored before ``token_count`` existed
+    get their estimate, in batches so large histories don't load at once.
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    added = []
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, ddl in columns:
+            if name in existing:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            except Exception as e:
+                # Another process starting at the same time may have added it first
+                if name not in {column['name'] for column in db.inspect(db.engine).get_columns(table)}:
+                    raise
+                print(f"⚠️ Column {table}.{name} was added concurrently: {e}")
+                continue
+            added.append(f"{table}.{name}")
+            print(f"✅ Added {name} column to {table} table")
+
+    backfilled = 0
+    while True:
+        batch = ConversationHistory.query.filter(ConversationHistory.token_count.is_(None))\
+            .order_by(ConversationHistory.id).limit(1000).all()
+        if not batch:
+            break
+        for message in batch:
+            message.token_count = estimate_tokens(message.content)
+        db.session.commit()
+        backfilled += len(batch)
+    if backfilled:
+        print(f"✅ Estimated token counts for {backfilled} stored messages")
+        # Totals built before the estimates existed counted those rows as 0 tokens
+        ConversationStats.rebuild()
+
+    return {"added_columns": added, "backfilled": backfilled}
+
+
+# Started by the Discord bot; web-only processes keep committing inserts directly
+history_writer = HistoryWriteBehind()
+
+conversation_cache = ConversationCache()
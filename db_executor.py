@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from config import Config
+from database import db
+from tracing import tracer
+
+
+class DatabaseExecutor:
+    """Runs blocking SQLAlchemy work on a bounded thread pool
+
+    Each call gets its own Flask app context, and therefore its own session,
+    which Flask-SQLAlchemy removes when the context is torn down. Coroutines
+    ``await db_executor.run(fn, ...)`` instead of querying on the event loop,
+    so a slow database never stalls the Discord gateway connection.
+    """
+
+    def __init__(self, max_workers: int = Config.DB_EXECUTOR_WORKERS):
+        self.max_workers = max_workers
+        self._app_factory = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Saturation metrics
+        self.queued = 0
+        self.active = 0
+        self.peak_active = 0
+        self.peak_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def init_app(self, app_factory: Callable):
+        """Set the callable that returns the Flask app used for app contexts"""
+        self._app_factory = app_factory
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+            return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` inside an app context on the DB pool and await its result"""
+        if self._app_factory is None:
+            raise RuntimeError("DatabaseExecutor has no app factory; call init_app() first")
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        # Carry context variables (tracing, etc.) into the worker thread
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, self._call, fn, args, kwargs, time.monotonic())
+        return await loop.run_in_executor(self._get_executor(), call)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue ``fn(*args, **kwargs)`` from any thread without waiting for it"""
+        if self._app_factory is None:
+            raise RuntimeError("DatabaseExecutor has no app factory; call init_app() first")
+
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        ctx = contextvars.copy_context()
+        return self._get_executor().submit(ctx.run, self._call, fn, args, kwargs, time.monotonic())
+
+    def _call(self, fn: Callable, args: tuple, kwargs: Dict[str, Any], submitted_at: float) -> Any:
+        started_at = time.monotonic()
+        wait = started_at - submitted_at
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        ok = False
+        try:
+            with tracer.span(f"db.{getattr(fn, '__name__', 'call')}", wait_ms=round(wait * 1000, 3)):
+                with tracer.span("get_flask_app"):
+                    app = self._app_factory()
+                with app.app_context():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception:
+                        db.session.rollback()
+                        raise
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.total_run += time.monotonic() - started_at
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool saturation statistics for diagnostics"""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "saturation": round(self.active / self.max_workers, 4) if self.max_workers else 0.0,
+                "peak_active": self.peak_active,
+                "peak_queued": self.peak_queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.total_wait / finished * 1000, 3) if finished else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "avg_run_ms": round(self.total_run / finished * 1000, 3) if finished else 0.0
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker threads"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def engine_pool_stats(engine) -> Optional[Dict[str, Any]]:
+    """Connection pool usage for a SQLAlchemy engine, when the pool reports it"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return None
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checked_in": pool.checkedin()
+    }
+
+
+# Shared by every Discord command handler
+db_executor = DatabaseExecutor()
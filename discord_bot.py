@@ -2,34 +2,191 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import asyncio
+import calendar
+import functools
 import threading
 import time
 import os
 from datetime import datetime
 from config import Config
-from database import db, UserPreference, AIModel, ConversationHistory
-from openrouter_client import OpenRouterClient
+from database import db, UserPreference, AIModel, ConversationHistory, ConversationStats, CircuitBreakerState, history_writer, migrate_schema
+from openrouter_client import client_registry, StreamIncomplete
+from db_executor import db_executor
+from model_registry import model_registry
+from autocomplete_index import model_usage
+from token_budget import MESSAGE_OVERHEAD, estimate_tokens
+from summarizer import summarizer
+from circuit_breaker import circuit_breakers
+from request_scheduler import SchedulerFullError, request_scheduler
+from generation_tracker import GenerationCancelled, active_generations
+from metrics import ASK_OUTCOMES, ASK_PHASE_SECONDS, ASK_TOKENS, DISCORD_SEND_SECONDS
+from loop_watchdog import loop_watchdog
+from retention import history_retention
+from tracing import tracer
 from flask import Flask
 from flask_web import create_app
 from team_config import is_team_member
 
 # Global Flask app instance
 flask_app = None
+flask_app_lock = threading.Lock()
 
 def get_flask_app():
     """Get the Flask app instance, creating it if necessary"""
     global flask_app
     if flask_app is None:
-        print("🔄 Creating Flask app on demand...")
-        flask_app = create_app()
-        with flask_app.app_context():
-            db.create_all()
+        # DB worker threads may race to create the app on first use
+        with flask_app_lock:
+            if flask_app is None:
+                print("🔄 Creating Flask app on demand...")
+                app = create_app()
+                with app.app_context():
+                    migrate_schema()
+                flask_app = app
     return flask_app
 
+def traced_command(name: str):
+    """Run a slash command callback inside a (sampled) trace named ``name``"""
+    def decorator(callback):
+        @functools.wraps(callback)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            with tracer.trace(name, user_id=str(interaction.user.id), guild_id=str(interaction.guild_id) if interaction.guild_id else None):
+                return await callback(interaction, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def cancelled_message(reason: str) -> str:
+    """What /ask shows when its generation was stopped for ``reason``"""
+    if reason == "cleared":
+        return "⏹️ Stopped: your conversation history was cleared."
+    return "⏹️ Stopped: you asked a new question before this answer finished."
+
+class ProgressiveReply:
+    """Renders a growing AI response into followup messages, throttling edits
+
+    The first chunk of text is shown as soon as it arrives; after that edits
+    are spaced at least ``min_interval`` seconds apart to stay within Discord's
+    message edit rate limits. Text longer than one message spills into new
+    followups.
+    """
+
+    def __init__(self, interaction: discord.Interaction, header: str, min_interval: float = Config.STREAM_EDIT_INTERVAL, chunk_size: int = 1900):
+        self.interaction = interaction
+        self.header = header
+        self.min_interval = min_interval
+        self.chunk_size = chunk_size
+        self.messages = []
+        self.rendered = []
+        self.last_edit = 0.0
+        self.has_content = False
+
+    async def start(self, placeholder: str):
+        with DISCORD_SEND_SECONDS.time("send"), tracer.span("discord.send"):
+            message = await self.interaction.followup.send(placeholder, wait=True)
+        self.messages.append(message)
+        self.rendered.append(placeholder)
+
+    async def update(self, text: str):
+        """Show partial text, unless an edit went out too recently"""
+        first_content = not self.has_content
+        if not first_content and time.monotonic() - self.last_edit < self.min_interval:
+            return
+        await self._render(text, final=False)
+
+    async def finish(self, text: str):
+        """Show the complete text"""
+        await self._render(text, final=True)
+
+    async def set_status(self, text: str):
+        """Replace the placeholder with another status line before any text arrives"""
+        if self.rendered[0] != text:
+            with DISCORD_SEND_SECONDS.time("edit"), tracer.span("discord.edit"):
+                await self.messages[0].edit(content=text)
+            self.rendered[0] = text
+
+    async def fail(self, error_msg: str):
+        """Replace the placeholder with an error message"""
+        with DISCORD_SEND_SECONDS.time("edit"), tracer.span("discord.edit"):
+            await self.messages[0].edit(content=error_msg)
+        self.rendered[0] = error_msg
+
+    async def _render(self, text: str, final: bool):
+        chunks = [text[i:i+self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        for i, chunk in enumerate(chunks):
+            body = f"{self.header}{chunk}" if i == 0 else chunk
+            if not final and i == len(chunks) - 1:
+                body += " ▌"
+
+            if i < len(self.messages):
+                if self.rendered[i] != body:
+                    with DISCORD_SEND_SECONDS.time("edit"), tracer.span("discord.edit", chunk=i):
+                        await self.messages[i].edit(content=body)
+                    self.rendered[i] = body
+            else:
+                with DISCORD_SEND_SECONDS.time("send"), tracer.span("discord.send", chunk=i):
+                    self.messages.append(await self.interaction.followup.send(body, wait=True))
+                self.rendered.append(body)
+
+        self.has_content = self.has_content or bool(text)
+        self.last_edit = time.monotonic()
+
 class DiscordBot:
     def __init__(self):
         self.bot = commands.Bot(command_prefix='!', intents=discord.Intents.default())
+        self.models_lock = asyncio.Lock()
+        self.background_tasks = set()
+        db_executor.init_app(get_flask_app)
+        if Config.HISTORY_WRITE_BEHIND:
+            history_writer.start(get_flask_app)
+        history_retention.start(get_flask_app)
+        # Rows left by the previous process would otherwise stay open on the
+        # dashboard, and their transition counts would hide this process's changes
+        try:
+            with get_flask_app().app_context():
+                CircuitBreakerState.reset_all()
+        except Exception as e:
+            print(f"❌ Failed to reset stored circuit breaker state: {e}")
+        circuit_breakers.on_change = self.store_breaker_state
         self.setup_commands()
+        # Lets the loop watchdog name the command that blocked the event loop
+        for command in self.bot.tree.get_commands():
+            loop_watchdog.register_command(command.name, command.callback)
+
+    def spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def store_breaker_state(self, snapshot):
+        """Persist a circuit breaker transition for the dashboard (called from any thread)"""
+        def report(future):
+            if future.exception() is not None:
+                print(f"❌ Failed to store circuit breaker state: {future.exception()}")
+
+        db_executor.submit(CircuitBreakerState.save, snapshot).add_done_callback(report)
+
+    async def load_models(self):
+        """Return the model registry, reloading it off the event loop when stale"""
+        if not model_registry.is_fresh():
+            # One reload at a time; concurrent callers reuse its result
+            async with self.models_lock:
+                if not model_registry.is_fresh():
+                    await db_executor.run(model_registry.refresh)
+        return model_registry
+
+    async def cached_models(self):
+        """Return the model registry without waiting on the database when any snapshot exists
+
+        A stale snapshot is served as-is and reloaded in the background, which
+        keeps latency-critical paths like autocomplete off the database entirely.
+        """
+        if not model_registry.has_snapshot():
+            return await self.load_models()
+        if not model_registry.is_fresh() and not self.models_lock.locked():
+            self.spawn(self.load_models())
+        return model_registry
 
     def setup_commands(self):
         @self.bot.tree.command(name="ping", description="Check if the bot is working")
@@ -41,19 +198,16 @@ class DiscordBot:
         @self.bot.tree.command(name="test_models", description="Test command to check available models")
         async def test_models(interaction: discord.Interaction):
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    available_models = AIModel.query.filter_by(is_active=True).all()
-                    model_names = [m.name for m in available_models]
-                    await interaction.response.send_message(f"Available models: {model_names}", ephemeral=True)
+                registry = await self.load_models()
+                model_names = [m.name for m in registry.active_models()]
+                await interaction.response.send_message(f"Available models: {model_names}", ephemeral=True)
             except Exception as e:
                 await interaction.response.send_message(f"Error: {e}", ephemeral=True)
 
         @self.bot.tree.command(name="debug_db", description="Debug database connection and models")
         async def debug_db(interaction: discord.Interaction):
             try:
-                app = get_flask_app()
-                with app.app_context():
+                def load_debug_info():
                     # Check if we can connect to the database
                     total_models = AIModel.query.count()
                     active_models = AIModel.query.filter_by(is_active=True).count()
@@ -68,8 +222,13 @@ class DiscordBot:
                     debug_info += f"Total models: {total_models}\n"
                     debug_info += f"Active models: {active_models}\n"
                     debug_info += f"All models:\n" + "\n".join(model_details)
+                    return debug_info
+
+                debug_info = await db_executor.run(load_debug_info)
+                pool = db_executor.stats()
+                debug_info += f"\nDB workers: {pool['active']}/{pool['max_workers']} busy, {pool['queued']} queued"
 
-                    await interaction.response.send_message(debug_info, ephemeral=True)
+                await interaction.response.send_message(debug_info, ephemeral=True)
 
             except Exception as e:
                 await interaction.response.send_message(f"❌ Database error: {e}", ephemeral=True)
@@ -77,30 +236,33 @@ class DiscordBot:
         @self.bot.tree.command(name="models", description="Show available AI models and your current selection")
         async def models(interaction: discord.Interaction):
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    # Get available models
-                    available_models = AIModel.query.filter_by(is_active=True).all()
+                user_id = str(interaction.user.id)
 
-                    if not available_models:
-                        await interaction.response.send_message("❌ No active models available. Please add models through the web interface.")
-                        return
+                # Get available models
+                available_models = (await self.load_models()).active_models()
+
+                if not available_models:
+                    await interaction.response.send_message("❌ No active models available. Please add models through the web interface.")
+                    return
 
+                def load_current_model():
                     # Get user's current model
-                    user_pref = UserPreference.query.filter_by(user_id=str(interaction.user.id)).first()
-                    current_model = user_pref.model_name if user_pref else "None"
+                    user_pref = UserPreference.query.filter_by(user_id=user_id).first()
+                    return user_pref.model_name if user_pref else "None"
 
-                    # Create response message
-                    model_list = "\n".join([f"• {model.name}{' (Team Only)' if model.team_only else ''}" for model in available_models])
+                current_model = await db_executor.run(load_current_model)
 
-                    embed = discord.Embed(
-                        title="🤖 Available AI Models",
-                        description=f"**Your current model:** {current_model}\n\n**Available models:**\n{model_list}",
-                        color=0x00ff00
-                    )
-                    embed.set_footer(text="Use /change to select a different model")
+                # Create response message
+                model_list = "\n".join([f"• {model.name}{' (Team Only)' if model.team_only else ''}" for model in available_models])
+
+                embed = discord.Embed(
+                    title="🤖 Available AI Models",
+                    description=f"**Your current model:** {current_model}\n\n**Available models:**\n{model_list}",
+                    color=0x00ff00
+                )
+                embed.set_footer(text="Use /change to select a different model")
 
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
+                await interaction.response.send_message(embed=embed, ephemeral=True)
 
             except Exception as e:
                 print(f"Error in models command: {e}")
@@ -108,82 +270,230 @@ class DiscordBot:
 
         @self.bot.tree.command(name="ask", description="Ask the AI a question")
         @app_commands.describe(content="Your question or message for the AI")
+        @traced_command("ask")
         async def ask(interaction: discord.Interaction, content: str):
-            await interaction.response.defer()
+            ask_started = time.perf_counter()
 
+            # Turn requests away before deferring when the bot is saturated, so the reply is immediate
             try:
-                app = get_flask_app()
-                with app.app_context():
+                ticket = request_scheduler.admit(
+                    str(interaction.user.id),
+                    str(interaction.guild_id) if interaction.guild_id else None,
+                    team=is_team_member(interaction.user.name)
+                )
+            except SchedulerFullError as e:
+                ASK_OUTCOMES.inc(f"rejected_{e.reason}")
+                if e.reason == "user":
+                    await interaction.response.send_message("⏳ You already have questions waiting for an answer. Please wait for them to finish before asking another.", ephemeral=True)
+                else:
+                    await interaction.response.send_message("⏳ The bot is handling a lot of questions right now. Please try again in a minute.", ephemeral=True)
+                return
+
+            try:
+                await interaction.response.defer()
+            except Exception:
+                ticket.release()
+                raise
+
+            generation = None
+            try:
+                user_id = str(interaction.user.id)
+
+                # Applies the supersede policy to this user's unfinished questions
+                generation = await active_generations.begin(user_id)
+                # A queued question may have been stopped by /clear_memory while it waited
+                generation.check()
+
+                def load_preference():
                     # Get user's preferred model
-                    user_pref = UserPreference.query.filter_by(user_id=str(interaction.user.id)).first()
+                    user_pref = UserPreference.query.filter_by(user_id=user_id).first()
+                    return user_pref.model_name if user_pref else None
 
-                    if not user_pref:
-                        await interaction.followup.send("❌ You haven't set a model yet! Use `/change` to set your preferred model.")
-                        return
+                model_name = await db_executor.run(load_preference)
+
+                if not model_name:
+                    await interaction.followup.send("❌ You haven't set a model yet! Use `/change` to set your preferred model.")
+                    return
+
+                # Get the AI model configuration
+                with tracer.span("load_models"):
+                    registry = await self.load_models()
+                ai_model = registry.get_by_name(model_name)
+
+                if not ai_model:
+                    await interaction.followup.send("❌ Your selected model is not available. Please use `/change` to select a different model.")
+                    return
 
-                    # Get the AI model configuration
-                    ai_model = AIModel.query.filter_by(name=user_pref.model_name, is_active=True).first()
+                # Check if model is team-only and user is not in team
+                if ai_model.team_only:
+                    user_username = interaction.user.name
 
-                    if not ai_model:
-                        await interaction.followup.send("❌ Your selected model is not available. Please use `/change` to select a different model.")
+                    if not is_team_member(user_username):
+                        await interaction.followup.send("❌ This model is restricted to team members only. Please contact the team owner for access.")
                         return
 
-                    # Check if model is team-only and user is not in team
-                    if ai_model.team_only:
-                        user_username = interaction.user.name
+                # Route around a model whose circuit breaker is open
+                if not circuit_breakers.allow(ai_model.official_name):
+                    fallback = registry.fallback_model()
+                    if (fallback is None or fallback.official_name == ai_model.official_name
+                            or (fallback.team_only and not is_team_member(interaction.user.name))
+                            or not circuit_breakers.allow(fallback.official_name)):
+                        await interaction.followup.send(f"❌ **{ai_model.name}** is temporarily unavailable. Please try again in a minute or switch models with `/change`.")
+                        return
 
-                        if not is_team_member(user_username):
-                            await interaction.followup.send("❌ This model is restricted to team members only. Please contact the team owner for access.")
-                            return
+                    await interaction.followup.send(f"⚠️ **{ai_model.name}** is having trouble right now, so **{fallback.name}** will answer instead.")
+                    ai_model = fallback
 
-                    # Get conversation history for context
-                    user_id = str(interaction.user.id)
-                    conversation_history = ConversationHistory.get_conversation_context(user_id, limit=10)
+                display_name = ai_model.name
+                official_name = ai_model.official_name
+                model_usage.record(user_id, model_name)
 
-                    # Store user's message
-                    ConversationHistory.add_message(user_id, "user", content, user_pref.model_name)
+                # Enhanced system prompt for better responses
+                system_prompt = "You are a helpful AI assistant in a Discord server. Provide clear, concise, and engaging responses. If asked about images and you can't see them, politely explain your limitations."
 
-                    # Create OpenRouter client and generate response with context
-                    client = OpenRouterClient(ai_model.api_key)
+                # Await the pooled async client so concurrent /ask calls don't block the event loop
+                client = client_registry.get_async_client(ai_model.api_key)
 
-                    # Enhanced system prompt for better responses
-                    system_prompt = "You are a helpful AI assistant in a Discord server. Provide clear, concise, and engaging responses. If asked about images and you can't see them, politely explain your limitations."
+                # Pack as much recent history as fits the model's window, newest first
+                history_budget = client.get_history_budget(official_name, system_prompt, content)
 
-                    response = client.generate_response(
-                        model=ai_model.official_name,
-                        message=content,
-                        system_prompt=system_prompt,
-                        conversation_history=conversation_history
-                    )
+                def prepare_context(context):
+                    # Get conversation history for context
+                    if context is None:
+                        context = ConversationHistory.load_conversation_context(
+                            user_id, limit=Config.CONTEXT_MAX_MESSAGES, token_budget=history_budget
+                        )
 
-                    if response and response.strip():
-                        # Store AI's response
-                        ConversationHistory.add_message(user_id, "assistant", response, user_pref.model_name)
-
-                        # Split long responses
-                        if len(response) > 2000:
-                            chunks = [response[i:i+1900] for i in range(0, len(response), 1900)]
-                            for i, chunk in enumerate(chunks):
-                                if i == 0:
-                                    await interaction.followup.send(f"🤖 **AI Response:**\n{chunk}")
-                                else:
-                                    await interaction.followup.send(chunk)
-                        else:
-                            await interaction.followup.send(f"🤖 **{ai_model.name} Response:**\n{response}")
+                    # Store user's message, unless /clear_memory stopped this question meanwhile. Checked
+                    # under the lock the clear holds, so the message either lands before the watermark or not at all
+                    with history_writer.flush_lock:
+                        generation.check()
+                        ConversationHistory.add_message(user_id, "user", content, model_name)
+                    return context
+
+                # Active chats are served from the in-memory tier and the insert is only queued,
+                # so neither step needs the database or a worker thread
+                with ASK_PHASE_SECONDS.time("db"), tracer.span("context") as span:
+                    context = ConversationHistory.get_cached_context(
+                        user_id, limit=Config.CONTEXT_MAX_MESSAGES, token_budget=history_budget
+                    )
+                    span.set(cached=context is not None)
+                    if context is not None and history_writer.running:
+                        # /clear_memory cancels on this loop too, so nothing can slip in between
+                        generation.check()
+                        ConversationHistory.add_message(user_id, "user", content, model_name)
                     else:
-                        # More informative error message
-                        error_msg = f"❌ Sorry, **{ai_model.name}** couldn't generate a response. "
-                        if 'gemini' in ai_model.official_name.lower():
-                            error_msg += "This might be due to content policy restrictions or API limitations. Try rephrasing your question."
-                        elif 'gpt' in ai_model.official_name.lower():
-                            error_msg += "This might be due to API quota limits or temporary unavailability."
+                        context = await db_executor.run(prepare_context, context)
+
+                conversation_history, history_tokens = context
+                prompt_tokens = history_tokens + estimate_tokens(system_prompt) + estimate_tokens(content) + 2 * MESSAGE_OVERHEAD
+                print(f"📊 /ask {official_name}: {len(conversation_history)} history messages, "
+                      f"~{history_tokens}/{history_budget} history tokens, ~{prompt_tokens} prompt tokens{tracer.log_suffix()}")
+                ASK_TOKENS.observe(prompt_tokens, "prompt")
+                tracer.annotate(model=official_name, history_messages=len(conversation_history), prompt_tokens=prompt_tokens)
+
+                reply = ProgressiveReply(interaction, f"🤖 **{display_name} Response:**\n")
+
+                async def produce():
+                    """The response text and whether it is complete"""
+                    started = time.perf_counter()
+                    if Config.ASK_STREAMING:
+                        response = ""
+                        try:
+                            async for delta in client.stream_response(
+                                model=official_name,
+                                message=content,
+                                system_prompt=system_prompt,
+                                conversation_history=conversation_history
+                            ):
+                                if not response:
+                                    ASK_PHASE_SECONDS.observe(time.perf_counter() - started, "ttft")
+                                response += delta
+                                await reply.update(response)
+                        except StreamIncomplete as e:
+                            print(f"⚠️ /ask {official_name}: response cut off after {len(response)} characters: {e.reason}{tracer.log_suffix()}")
+                            ASK_PHASE_SECONDS.observe(time.perf_counter() - started, "upstream")
+                            return response, False
+                    else:
+                        response = await client.generate_response(
+                            model=official_name,
+                            message=content,
+                            system_prompt=system_prompt,
+                            conversation_history=conversation_history
+                        )
+                    ASK_PHASE_SECONDS.observe(time.perf_counter() - started, "upstream")
+                    return response, True
+
+                # Both the wait for a turn and the model call stop early if this question is superseded
+                try:
+                    # Wait for a fair turn and a free slot on the model
+                    queued_at = time.perf_counter()
+                    position = ticket.enqueue(official_name)
+                    if position:
+                        await reply.start(f"⏳ **{display_name}** is busy, your question is #{position} in line...")
+                        with tracer.span("queue", position=position):
+                            dispatched = await generation.run(ticket.wait(Config.SCHEDULER_MAX_WAIT))
+                        if not dispatched:
+                            ASK_OUTCOMES.inc("busy")
+                            await reply.fail(f"⏳ **{display_name}** is too busy right now. Please try again in a minute.")
+                            return
+                        ASK_PHASE_SECONDS.observe(time.perf_counter() - queued_at, "queue")
+                        await reply.set_status(f"🤖 **{display_name}** is thinking...")
+                    else:
+                        ASK_PHASE_SECONDS.observe(time.perf_counter() - queued_at, "queue")
+                        await reply.start(f"🤖 **{display_name}** is thinking...")
+
+                    with tracer.span("upstream", model=official_name, streaming=Config.ASK_STREAMING):
+                        response, complete = await generation.run(produce())
+                except GenerationCancelled as e:
+                    ASK_OUTCOMES.inc(e.reason)
+                    await reply.fail(cancelled_message(e.reason))
+                    return
+
+                if response and response.strip() and not complete:
+                    # Show what arrived, but keep a partial answer out of the conversation history
+                    await reply.finish(response.strip() + "\n\n⚠️ *This response is incomplete: the model's stream ended early. "
+                                       "It was not saved to your conversation memory, so ask again if you need the rest.*")
+                    ASK_PHASE_SECONDS.observe(time.perf_counter() - ask_started, "total")
+                    ASK_OUTCOMES.inc("truncated")
+                elif response and response.strip():
+                    response = response.strip()
+
+                    # Store AI's response
+                    with tracer.span("store_response"):
+                        if history_writer.running:
+                            ConversationHistory.add_message(user_id, "assistant", response, display_name)
                         else:
-                            error_msg += "Please try again or switch to a different model using `/change`."
+                            await db_executor.run(ConversationHistory.add_message, user_id, "assistant", response, display_name)
 
-                        await interaction.followup.send(error_msg)
+                    await reply.finish(response)
+                    ASK_TOKENS.observe(estimate_tokens(response), "response")
+                    ASK_PHASE_SECONDS.observe(time.perf_counter() - ask_started, "total")
+                    ASK_OUTCOMES.inc("ok")
 
+                    # Fold older turns into the rolling summary off the request path
+                    if Config.SUMMARY_ENABLED and summarizer.should_compact(user_id):
+                        self.spawn(summarizer.compact(user_id, ai_model.api_key))
+                else:
+                    # More informative error message
+                    error_msg = f"❌ Sorry, **{display_name}** couldn't generate a response. "
+                    if 'gemini' in official_name.lower():
+                        error_msg += "This might be due to content policy restrictions or API limitations. Try rephrasing your question."
+                    elif 'gpt' in official_name.lower():
+                        error_msg += "This might be due to API quota limits or temporary unavailability."
+                    else:
+                        error_msg += "Please try again or switch to a different model using `/change`."
+
+                    ASK_OUTCOMES.inc("empty")
+                    await reply.fail(error_msg)
+
+            except GenerationCancelled as e:
+                # Stopped before the model call started
+                ASK_OUTCOMES.inc(e.reason)
+                await interaction.followup.send(cancelled_message(e.reason))
             except Exception as e:
-                print(f"Error in ask command: {e}")
+                print(f"Error in ask command: {e}{tracer.log_suffix()}")
+                ASK_OUTCOMES.inc("error")
                 error_detail = str(e)
                 if "rate limit" in error_detail.lower():
                     await interaction.followup.send("⏱️ Rate limit reached. Please wait a moment and try again.")
@@ -193,42 +503,50 @@ class DiscordBot:
                     await interaction.followup.send("⏰ Request timed out. The model might be overloaded. Try again in a moment.")
                 else:
                     await interaction.followup.send("❌ An unexpected error occurred. Please try again or contact support.")
+            finally:
+                if generation is not None:
+                    generation.finish()
+                ticket.release()
 
         @self.bot.tree.command(name="change", description="Change your preferred AI model")
         @app_commands.describe(model="The AI model you want to use")
         async def change(interaction: discord.Interaction, model: str):
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    # Check if the model exists and is active
-                    ai_model = AIModel.query.filter_by(name=model, is_active=True).first()
+                user_id = str(interaction.user.id)
 
-                    if not ai_model:
-                        # Get available models
-                        available_models = AIModel.query.filter_by(is_active=True).all()
-                        model_names = [m.name for m in available_models]
+                # Check if the model exists and is active
+                registry = await self.load_models()
+                ai_model = registry.get_by_name(model)
 
-                        await interaction.response.send_message(
-                            f"❌ Model '{model}' not found or not active.\n\n"
-                            f"Available models: {', '.join(model_names) if model_names else 'None'}"
-                        )
-                        return
+                if not ai_model:
+                    # Get available models
+                    model_names = [m.name for m in registry.active_models()]
+
+                    await interaction.response.send_message(
+                        f"❌ Model '{model}' not found or not active.\n\n"
+                        f"Available models: {', '.join(model_names) if model_names else 'None'}"
+                    )
+                    return
 
+                def update_preference():
                     # Update or create user preference
-                    user_pref = UserPreference.query.filter_by(user_id=str(interaction.user.id)).first()
+                    user_pref = UserPreference.query.filter_by(user_id=user_id).first()
 
                     if user_pref:
                         user_pref.model_name = model
                         user_pref.updated_at = datetime.utcnow()
                     else:
-                        user_pref = UserPreference(user_id=str(interaction.user.id), model_name=model)
+                        user_pref = UserPreference(user_id=user_id, model_name=model)
                         db.session.add(user_pref)
 
                     db.session.commit()
 
-                    # Check if model is team-only
-                    team_status = " (Team Only)" if ai_model.team_only else ""
-                    await interaction.response.send_message(f"✅ Your preferred model has been changed to: **{model}**{team_status}")
+                await db_executor.run(update_preference)
+                model_usage.record(user_id, model)
+
+                # Check if model is team-only
+                team_status = " (Team Only)" if ai_model.team_only else ""
+                await interaction.response.send_message(f"✅ Your preferred model has been changed to: **{model}**{team_status}")
 
             except Exception as e:
                 print(f"Error in change command: {e}")
@@ -237,28 +555,18 @@ class DiscordBot:
         # Define autocomplete function outside the command
         async def change_autocomplete(interaction: discord.Interaction, current: str):
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    # Get available models
-                    available_models = AIModel.query.filter_by(is_active=True).all()
-                    print(f"Available models: {[m.name for m in available_models]}")
-                    print(f"Current input: '{current}'")
-
-                    # Filter models that match the current input
-                    matching_models = [
-                        model.name for model in available_models
-                        if current.lower() in model.name.lower()
-                    ]
-                    print(f"Matching models: {matching_models}")
-
-                    # Return up to 25 choices (Discord limit)
-                    choices = [
-                        discord.app_commands.Choice(name=model_name, value=model_name)
-                        for model_name in matching_models[:25]
-                    ]
-                    print(f"Returning choices: {[c.name for c in choices]}")
-
-                    return choices
+                # Prefix/fuzzy search over the in-memory index, recently used models first
+                registry = await self.cached_models()
+                matching_models = registry.autocomplete.search(
+                    current,
+                    limit=25,  # Discord limit
+                    preferred=model_usage.recent(str(interaction.user.id))
+                )
+
+                return [
+                    discord.app_commands.Choice(name=model_name, value=model_name)
+                    for model_name in matching_models
+                ]
 
             except Exception as e:
                 print(f"Error in change autocomplete: {e}")
@@ -271,21 +579,27 @@ class DiscordBot:
         @self.bot.tree.command(name="clear_memory", description="Clear your conversation history")
         async def clear_memory(interaction: discord.Interaction):
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    user_id = str(interaction.user.id)
+                user_id = str(interaction.user.id)
+
+                # Stop answers still being generated so they don't land in the wiped history
+                active_generations.cancel_user(user_id)
 
+                def clear_history():
                     # Check if user has any conversation history
-                    history_count = ConversationHistory.query.filter_by(user_id=user_id).count()
+                    history_count = ConversationStats.for_user(user_id)["messages"]
 
-                    if history_count == 0:
-                        await interaction.response.send_message("🤖 You don't have any conversation history to clear.", ephemeral=True)
-                        return
+                    if history_count > 0:
+                        # Clear user's conversation history
+                        ConversationHistory.clear_user_history(user_id)
+                    return history_count
+
+                history_count = await db_executor.run(clear_history)
 
-                    # Clear user's conversation history
-                    ConversationHistory.clear_user_history(user_id)
+                if history_count == 0:
+                    await interaction.response.send_message("🤖 You don't have any conversation history to clear.", ephemeral=True)
+                    return
 
-                    await interaction.response.send_message(f"✅ Cleared {history_count} messages from your conversation history. The AI will no longer remember our previous conversations.", ephemeral=True)
+                await interaction.response.send_message(f"✅ Cleared {history_count} messages from your conversation history. The AI will no longer remember our previous conversations.", ephemeral=True)
 
             except Exception as e:
                 print(f"Error in clear_memory command: {e}")
@@ -294,49 +608,54 @@ class DiscordBot:
         @self.bot.tree.command(name="memory_info", description="View information about your conversation memory")
         async def memory_info(interaction: discord.Interaction):
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    user_id = str(interaction.user.id)
-
-                    # Get conversation statistics
-                    total_messages = ConversationHistory.query.filter_by(user_id=user_id).count()
-                    user_messages = ConversationHistory.query.filter_by(user_id=user_id, role="user").count()
-                    ai_messages = ConversationHistory.query.filter_by(user_id=user_id, role="assistant").count()
+                user_id = str(interaction.user.id)
 
-                    if total_messages == 0:
-                        await interaction.response.send_message("🤖 You don't have any conversation history yet. Start chatting with `/ask`!", ephemeral=True)
-                        return
+                def load_memory_info():
+                    # Get conversation statistics (one row, maintained as messages are stored)
+                    stats = ConversationStats.for_user(user_id)
 
                     # Get the most recent conversation
-                    recent_messages = ConversationHistory.get_user_history(user_id, limit=5)
-
-                    embed = discord.Embed(
-                        title="🧠 Your Conversation Memory",
-                        color=0x00ff00
-                    )
+                    recent_messages = []
+                    if stats["messages"]:
+                        recent_messages = [(msg.role, msg.content) for msg in ConversationHistory.get_user_history(user_id, limit=5)]
+                    return stats, recent_messages
+
+                stats, recent_messages = await db_executor.run(load_memory_info)
+
+                if stats["messages"] == 0:
+                    await interaction.response.send_message("🤖 You don't have any conversation history yet. Start chatting with `/ask`!", ephemeral=True)
+                    return
+
+                embed = discord.Embed(
+                    title="🧠 Your Conversation Memory",
+                    color=0x00ff00
+                )
+
+                embed.add_field(
+                    name="📊 Statistics",
+                    value=f"• Total messages: {stats['messages']}\n• Your messages: {stats['user_messages']}\n• AI responses: {stats['assistant_messages']}"
+                          + f"\n• Stored tokens: ~{stats['tokens'] + stats['summary_tokens']}"
+                          + ("\n• Older messages: summarized" if stats["summarized"] else "")
+                          + (f"\n• Last message: <t:{int(calendar.timegm(stats['last_message_at'].timetuple()))}:R>" if stats["last_message_at"] else ""),
+                    inline=False
+                )
+
+                if recent_messages:
+                    recent_preview = []
+                    for role, msg_content in reversed(recent_messages[-3:]):  # Show last 3 messages
+                        role_emoji = "👤" if role == "user" else "🤖"
+                        content_preview = msg_content[:50] + "..." if len(msg_content) > 50 else msg_content
+                        recent_preview.append(f"{role_emoji} {content_preview}")
 
                     embed.add_field(
-                        name="📊 Statistics",
-                        value=f"• Total messages: {total_messages}\n• Your messages: {user_messages}\n• AI responses: {ai_messages}",
+                        name="💬 Recent Messages",
+                        value="\n".join(recent_preview),
                         inline=False
                     )
 
-                    if recent_messages:
-                        recent_preview = []
-                        for msg in reversed(recent_messages[-3:]):  # Show last 3 messages
-                            role_emoji = "👤" if msg.role == "user" else "🤖"
-                            content_preview = msg.content[:50] + "..." if len(msg.content) > 50 else msg.content
-                            recent_preview.append(f"{role_emoji} {content_preview}")
-
-                        embed.add_field(
-                            name="💬 Recent Messages",
-                            value="\n".join(recent_preview),
-                            inline=False
-                        )
-
-                    embed.set_footer(text="Use /clear_memory to reset your conversation history")
+                embed.set_footer(text="Use /clear_memory to reset your conversation history")
 
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
+                await interaction.response.send_message(embed=embed, ephemeral=True)
 
             except Exception as e:
                 print(f"Error in memory_info command: {e}")
@@ -353,26 +672,46 @@ class DiscordBot:
 
             # Test database connection on startup
             try:
-                app = get_flask_app()
-                with app.app_context():
+                def check_models():
                     # Ensure database tables exist
                     db.create_all()
 
-                    # Check if we have any models
-                    model_count = AIModel.query.count()
-                    print(f"📊 Database has {model_count} models")
+                    # Check if we have any models, warming the registry cache as we go
+                    model_registry.refresh()
+                    return len(model_registry.all_models()), len(model_registry.active_models())
 
-                    if model_count == 0:
-                        print("⚠️  No models found in database. Add models through the web interface.")
-                    else:
-                        active_models = AIModel.query.filter_by(is_active=True).all()
-                        print(f"✅ {len(active_models)} active models available")
+                model_count, active_count = await db_executor.run(check_models)
+                print(f"📊 Database has {model_count} models")
+
+                if model_count == 0:
+                    print("⚠️  No models found in database. Add models through the web interface.")
+                else:
+                    print(f"✅ {active_count} active models available")
 
             except Exception as e:
                 print(f"❌ Database error on startup: {e}")
 
+    async def shutdown(self):
+        """Release resources held on the bot's event loop"""
+        loop_watchdog.stop()
+        await asyncio.to_thread(history_retention.stop)
+        await client_registry.aclose()
+        # Flush queued history rows before the worker threads go away
+        await asyncio.to_thread(history_writer.stop)
+        db_executor.shutdown(wait=False)
+
     def run(self):
-        self.bot.run(Config.DISCORD_BOT_TOKEN)
+        async def runner():
+            async with self.bot:
+                if Config.LOOP_WATCHDOG_ENABLED:
+                    loop_watchdog.start()
+                try:
+                    await self.bot.start(Config.DISCORD_BOT_TOKEN)
+                finally:
+                    await self.shutdown()
+
+        discord.utils.setup_logging()
+        asyncio.run(runner())
 
 def main():
     """Main function for Discord bot when run standalone or in thread"""
@@ -385,7 +724,7 @@ def main():
 
         # Initialize database
         with flask_app.app_context():
-            db.create_all()
+            migrate_schema()
             print("✅ Database initialized")
 
         # Start Discord bot
@@ -1,7 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from database import db, AIModel
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from database import db, AIModel, CircuitBreakerState, history_writer, conversation_cache, migrate_schema
 from config import Config
-from openrouter_client import OpenRouterClient
+from openrouter_client import client_registry, hedge_policy
+from response_cache import response_cache
+from request_coalescer import request_coalescer
+from request_scheduler import request_scheduler
+from generation_tracker import active_generations
+from rate_limiter import rate_limiter
+from circuit_breaker import OPEN, circuit_breakers
+from metrics import metrics
+from tracing import tracer
+from loop_watchdog import loop_watchdog
+from db_executor import db_executor, engine_pool_stats
+from model_registry import model_registry
+from summarizer import summarizer
+from retention import history_retention
 import os
 import hashlib
 import json
@@ -138,6 +151,7 @@ def create_app():
                             db.session.add(new_model)
 
                 db.session.commit()
+                model_registry.invalidate()
 
             return jsonify({'success': True})
 
@@ -186,6 +200,7 @@ def create_app():
             try:
                 AIModel.query.delete()
                 db.session.commit()
+                model_registry.invalidate()
             except:
                 pass
 
@@ -274,6 +289,7 @@ def create_app():
             for model in models:
                 model.api_key = new_api_key
             db.session.commit()
+            model_registry.invalidate()
 
             return jsonify({'success': True, 'message': 'API key updated successfully'})
 
@@ -316,6 +332,7 @@ def create_app():
 
             db.session.add(new_model)
             db.session.commit()
+            model_registry.invalidate()
 
             return jsonify({
                 'success': True,
@@ -336,6 +353,7 @@ def create_app():
             old_status = model.is_active
             model.is_active = not model.is_active
             db.session.commit()
+            model_registry.invalidate()
 
             status_text = "enabled" if model.is_active else "disabled"
             return jsonify({
@@ -347,6 +365,30 @@ def create_app():
             db.session.rollback()
             return jsonify({'success': False, 'error': f'Failed to toggle model: {str(e)}'})
 
+    @app.route('/set_fallback/<int:model_id>', methods=['POST'])
+    @setup_required
+    @login_required
+    def set_fallback(model_id):
+        try:
+            model = AIModel.query.get_or_404(model_id)
+            is_fallback = not model.is_fallback
+
+            # Only one model can be the fallback at a time
+            AIModel.query.filter(AIModel.id != model.id).update({'is_fallback': False})
+            model.is_fallback = is_fallback
+            db.session.commit()
+            model_registry.invalidate()
+
+            status_text = "is now the fallback model" if is_fallback else "is no longer the fallback model"
+            return jsonify({
+                'success': True,
+                'is_fallback': is_fallback,
+                'message': f'{model.name} {status_text}'
+            })
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': f'Failed to set fallback model: {str(e)}'})
+
     @app.route('/delete_model/<int:model_id>', methods=['POST'])
     @setup_required
     @login_required
@@ -356,6 +398,7 @@ def create_app():
             model_name = model.name
             db.session.delete(model)
             db.session.commit()
+            model_registry.invalidate()
             return jsonify({'success': True, 'message': f'🗑️ {model_name} has been permanently deleted'})
         except Exception as e:
             db.session.rollback()
@@ -369,12 +412,13 @@ def create_app():
             model = AIModel.query.get_or_404(model_id)
             test_message = request.json.get('message', 'Hello, how are you?')
 
-            client = OpenRouterClient(model.api_key)
+            client = client_registry.get_client(model.api_key)
 
             # Enhanced system prompt for better testing
             system_prompt = "You are a helpful AI assistant. Respond in a friendly and informative way. If this is a test message, acknowledge it and demonstrate your capabilities."
 
-            response = client.generate_response(model.official_name, test_message, system_prompt)
+            # A test has to reach the model, so never answer it from the response cache
+            response = client.generate_response(model.official_name, test_message, system_prompt, use_cache=False)
 
             if response:
                 return jsonify({
@@ -415,6 +459,134 @@ def create_app():
     def health():
         return {'status': 'healthy', 'message': 'Discord AI Bot is running'}, 200
 
+    # Pools and queues are read when /metrics is scraped, so they cost nothing in between
+    metrics.gauge("discordai_db_pool_connections", "Database connection pool usage", ("state",),
+                  collect=lambda: [((state,), value) for state, value in (engine_pool_stats(db.engine) or {}).items()])
+    metrics.gauge("discordai_db_executor_tasks", "Tasks on the database worker pool", ("state",),
+                  collect=lambda: [(("active",), db_executor.active), (("queued",), db_executor.queued)])
+    metrics.gauge("discordai_history_pending_rows", "Conversation rows waiting for the write-behind flush",
+                  collect=lambda: [((), history_writer.stats()["pending"])])
+    metrics.gauge("discordai_scheduler_waiting", "/ask requests waiting for a turn",
+                  collect=lambda: [((), request_scheduler.stats()["waiting"])])
+    metrics.gauge("discordai_scheduler_running", "/ask requests running per model", ("model",),
+                  collect=lambda: [((model,), count) for model, count in request_scheduler.stats()["running"].items()])
+    metrics.gauge("discordai_response_cache_bytes", "Size of the response cache",
+                  collect=lambda: [((), response_cache.bytes)])
+    metrics.gauge("discordai_circuit_breaker_open", "Whether a model's circuit breaker is open (1) or not (0)", ("model",),
+                  collect=lambda: [((breaker["official_name"],), 1 if breaker["state"] == OPEN else 0) for breaker in circuit_breakers.stats()])
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus text exposition of bot and web metrics (bearer token protected when METRICS_TOKEN is set)"""
+        if Config.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {Config.METRICS_TOKEN}":
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/client_pools')
+    @setup_required
+    @login_required
+    def api_client_pools():
+        """API endpoint for OpenRouter connection pool statistics"""
+        return jsonify(client_registry.stats())
+
+    @app.route('/api/hedging')
+    @setup_required
+    @login_required
+    def api_hedging():
+        """API endpoint for hedged request counts and thresholds"""
+        return jsonify({'enabled': Config.HEDGE_ENABLED, **hedge_policy.stats()})
+
+    @app.route('/api/response_cache')
+    @setup_required
+    @login_required
+    def api_response_cache():
+        """API endpoint for response cache size and hit rate"""
+        return jsonify(response_cache.stats())
+
+    @app.route('/api/request_coalescing')
+    @setup_required
+    @login_required
+    def api_request_coalescing():
+        """API endpoint for how many requests shared an in-flight OpenRouter call"""
+        return jsonify({'enabled': Config.COALESCE_REQUESTS, **request_coalescer.stats()})
+
+    @app.route('/api/scheduler')
+    @setup_required
+    @login_required
+    def api_scheduler():
+        """API endpoint for /ask queue depth, rejections and waits"""
+        return jsonify({**request_scheduler.stats(), 'generations': active_generations.stats()})
+
+    @app.route('/api/traces')
+    @setup_required
+    @login_required
+    def api_traces():
+        """API endpoint for the slowest recently sampled /ask traces"""
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        return jsonify({'stats': tracer.stats(), 'slowest': tracer.slowest(limit)})
+
+    @app.route('/api/event_loop')
+    @setup_required
+    @login_required
+    def api_event_loop():
+        """API endpoint for bot event loop lag and the stalls that caused it"""
+        return jsonify({'stats': loop_watchdog.stats(), 'stalls': loop_watchdog.recent_stalls()})
+
+    @app.route('/api/retention')
+    @setup_required
+    @login_required
+    def api_retention():
+        """API endpoint for conversation history retention runs and rows pruned"""
+        return jsonify(history_retention.stats())
+
+    @app.route('/api/rate_limits')
+    @setup_required
+    @login_required
+    def api_rate_limits():
+        """API endpoint for OpenRouter rate limiter state per API key and model"""
+        return jsonify(rate_limiter.stats())
+
+    @app.route('/api/circuit_breakers')
+    @setup_required
+    @login_required
+    def api_circuit_breakers():
+        """API endpoint for the last stored circuit breaker state of each model"""
+        fallback = AIModel.query.filter_by(is_fallback=True).first()
+        return jsonify({
+            'fallback': fallback.name if fallback else None,
+            'breakers': [{
+                'official_name': row.official_name,
+                'state': row.state,
+                'reason': row.reason,
+                'transitions': row.transitions,
+                'error_rate': row.error_rate,
+                'slow_rate': row.slow_rate,
+                'p95_latency': row.p95_latency,
+                'updated_at': row.updated_at.isoformat() + 'Z' if row.updated_at else None
+            } for row in CircuitBreakerState.query.order_by(CircuitBreakerState.official_name).all()]
+        })
+
+    @app.route('/api/db_pool')
+    @setup_required
+    @login_required
+    def api_db_pool():
+        """API endpoint for bot DB worker and connection pool saturation"""
+        return jsonify({
+            'executor': db_executor.stats(),
+            'connections': engine_pool_stats(db.engine)
+        })
+
+    @app.route('/api/history')
+    @setup_required
+    @login_required
+    def api_history():
+        """API endpoint for conversation history write-behind, cache and summary metrics"""
+        return jsonify({
+            'write_behind': history_writer.stats(),
+            'conversation_cache': conversation_cache.stats(),
+            'summarizer': summarizer.stats()
+        })
+
     @app.route('/api/models')
     @setup_required
     @login_required
@@ -427,5 +599,5 @@ def create_app():
 if __name__ == '__main__':
     app = create_app()
     with app.app_context():
-        db.create_all()
+        migrate_schema()
     app.run(debug=True)
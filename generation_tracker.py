@@ -0,0 +1,162 @@
+import asyncio
+from typing import Any, Awaitable, Dict, List
+from config import Config
+
+# What a new /ask does about the same user's unfinished ones
+CANCEL = "cancel"
+QUEUE = "queue"
+PARALLEL = "parallel"
+POLICIES = (CANCEL, QUEUE, PARALLEL)
+
+
+class GenerationCancelled(Exception):
+    """Raised by :meth:`Generation.run` when the generation was stopped on purpose"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Generation:
+    """One user's in-flight /ask, from before its context is built until :meth:`finish`"""
+
+    def __init__(self, tracker: "GenerationTracker", user_id: str):
+        self.tracker = tracker
+        self.user_id = user_id
+        self.reason = None
+        self.task = None
+        self.finished = asyncio.Event()
+        # Set once cancelled, so a generation waiting for its turn stops waiting
+        self.stopped = asyncio.Event()
+
+    def check(self):
+        """Raise :class:`GenerationCancelled` if the generation was stopped"""
+        if self.reason is not None:
+            raise GenerationCancelled(self.reason)
+
+    async def run(self, coro: Awaitable[Any]) -> Any:
+        """Await the model call, raising :class:`GenerationCancelled` if it gets stopped"""
+        if self.reason is not None:
+            coro.close()
+            raise GenerationCancelled(self.reason)
+        self.task = asyncio.ensure_future(coro)
+        try:
+            result = await self.task
+        except asyncio.CancelledError:
+            # Only our own cancellation is turned into an error; anything else keeps propagating
+            if self.reason is not None and self.task.cancelled():
+                raise GenerationCancelled(self.reason) from None
+            raise
+        # Stopped after the answer arrived but before the caller could use it
+        if self.reason is not None:
+            raise GenerationCancelled(self.reason)
+        return result
+
+    def cancel(self, reason: str) -> bool:
+        """Stop the generation, aborting its upstream request if one is running"""
+        if self.reason is not None or self.finished.is_set():
+            return False
+        self.reason = reason
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+        return True
+
+    def finish(self):
+        self.tracker._finish(self)
+
+
+class GenerationTracker:
+    """Per-user tracking of in-flight generations
+
+    With the ``cancel`` policy a new /ask stops the user's unfinished ones,
+    ``queue`` makes it wait for them (so it sees their answers in its
+    context) and ``parallel`` lets them all run. /clear_memory stops a
+    user's generations regardless of policy, so no answer lands in the
+    history they just wiped. Only used from the bot's event loop.
+    """
+
+    def __init__(self, policy: str = Config.ASK_SUPERSEDE_POLICY):
+        if policy not in POLICIES:
+            print(f"⚠️ Unknown ASK_SUPERSEDE_POLICY {policy!r}, using {CANCEL}")
+            policy = CANCEL
+        self.policy = policy
+        self._active: Dict[str, List[Generation]] = {}
+
+        self.started = 0
+        self.superseded = 0
+        self.cleared = 0
+        self.queued = 0
+
+    async def begin(self, user_id: str) -> Generation:
+        """Register a new generation for ``user_id`` and apply the supersede policy
+
+        The generation is registered before it waits for its turn, so
+        /clear_memory can stop it while it waits; check its ``reason``
+        afterwards.
+        """
+        ahead = list(self._active.get(user_id, ()))
+        generation = Generation(self, user_id)
+        self._active.setdefault(user_id, []).append(generation)
+        self.started += 1
+
+        if ahead and self.policy == CANCEL:
+            self.superseded += sum(1 for previous in ahead if previous.cancel("superseded"))
+        elif ahead and self.policy == QUEUE:
+            self.queued += 1
+            try:
+                await self._wait_turn(generation, ahead)
+            except BaseException:
+                generation.finish()
+                raise
+        return generation
+
+    @staticmethod
+    async def _wait_turn(generation: Generation, ahead: List[Generation]):
+        """Wait for the generations registered earlier, oldest first, unless ``generation`` is stopped"""
+        stopped = asyncio.ensure_future(generation.stopped.wait())
+        try:
+            for previous in ahead:
+                finished = asyncio.ensure_future(previous.finished.wait())
+                try:
+                    await asyncio.wait((finished, stopped), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    finished.cancel()
+                if generation.reason is not None:
+                    return
+        finally:
+            stopped.cancel()
+
+    def cancel_user(self, user_id: str, reason: str = "cleared") -> int:
+        """Stop every in-flight generation of a user; returns how many were stopped"""
+        stopped = sum(1 for generation in list(self._active.get(user_id, ())) if generation.cancel(reason))
+        self.cleared += stopped
+        return stopped
+
+    def active(self, user_id: str) -> int:
+        return len(self._active.get(user_id, ()))
+
+    def _finish(self, generation: Generation):
+        if generation.finished.is_set():
+            return
+        generation.finished.set()
+        generations = self._active.get(generation.user_id)
+        if generations and generation in generations:
+            generations.remove(generation)
+            if not generations:
+                del self._active[generation.user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "active_users": len(self._active),
+            "active": sum(len(generations) for generations in self._active.values()),
+            "started": self.started,
+            "superseded": self.superseded,
+            "cleared": self.cleared,
+            "queued": self.queued
+        }
+
+
+# Shared by /ask and /clear_memory
+active_generations = GenerationTracker()
@@ -0,0 +1,167 @@
+import asyncio
+import inspect
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from types import CodeType
+from typing import Any, Callable, Dict, List
+from config import Config
+from metrics import EVENT_LOOP_LAG_SECONDS, LOOP_STALL_SECONDS, LOOP_STALLS
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+    """Measures the bot's event loop lag and catches what blocks it
+
+    A heartbeat task on the loop wakes up every ``interval`` seconds and
+    records how late it was. A watcher thread checks the heartbeat; once it
+    is overdue by ``threshold`` seconds the loop is stuck in synchronous
+    code, so the watcher captures the loop thread's stack right then and
+    attributes the stall to the slash command running (from the command
+    callbacks registered with :meth:`register_command`) and to the innermost
+    frame in this project. The most recent stalls are kept for the
+    dashboard.
+    """
+
+    def __init__(self, interval: float = Config.LOOP_WATCHDOG_INTERVAL, threshold: float = Config.LOOP_STALL_THRESHOLD,
+                 history: int = Config.LOOP_STALL_HISTORY):
+        self.interval = interval
+        self.threshold = threshold
+        self._stalls = deque(maxlen=history)
+        self._commands: Dict[CodeType, str] = {}
+        self._loop = None
+        self._loop_thread_id = None
+        self._task = None
+        self._watcher = None
+        self._stop = threading.Event()
+        # Monotonic time of the last heartbeat; written by the loop, read by the watcher
+        self._beat = 0.0
+        self._current = None
+
+        self.beats = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stall_count = 0
+
+    def register_command(self, name: str, callback: Callable):
+        """Attribute stalls inside ``callback`` (or anything it awaits) to command ``name``"""
+        self._commands[inspect.unwrap(callback).__code__] = name
+
+    def start(self):
+        """Start watching the running event loop; call from a coroutine on that loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled)
+            self._beat = time.monotonic()
+            self.beats += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+    def _watch(self):
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            beat = self._beat
+            overdue = time.monotonic() - (beat + self.interval)
+            stall = self._current
+            if stall is None:
+                if overdue >= self.threshold:
+                    self._current = self._capture(beat)
+            elif beat != stall["beat"]:
+                self._finish(stall, beat)
+                self._current = None
+
+    def _capture(self, beat: float) -> Dict[str, Any]:
+        """Snapshot what the loop thread is running while it is stuck"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame is not None else []
+        command = None
+        frame_walk = frame
+        while frame_walk is not None:
+            # The outermost registered callback on the stack is the command being handled
+            command = self._commands.get(frame_walk.f_code, command)
+            frame_walk = frame_walk.f_back
+
+        location = None
+        for entry in reversed(stack):
+            if entry.filename.startswith(PROJECT_DIR) and os.path.abspath(entry.filename) != os.path.abspath(__file__):
+                location = f"{os.path.relpath(entry.filename, PROJECT_DIR)}:{entry.lineno} in {entry.name}"
+                break
+
+        task = None
+        try:
+            current = asyncio.current_task(self._loop)
+            task = current.get_name() if current is not None else None
+        except RuntimeError:
+            pass
+
+        return {
+            "beat": beat,
+            "detected_at": time.time(),
+            "command": command,
+            "task": task,
+            "location": location,
+            "stack": [f"{os.path.relpath(e.filename, PROJECT_DIR) if e.filename.startswith(PROJECT_DIR) else e.filename}:{e.lineno} in {e.name}"
+                      + (f"\n    {e.line}" if e.line else "") for e in stack[-15:]]
+        }
+
+    def _finish(self, stall: Dict[str, Any], beat: float):
+        # The heartbeat that ended the stall was due one interval after the last one
+        duration = max(0.0, beat - (stall["beat"] + self.interval))
+        record = {key: value for key, value in stall.items() if key != "beat"}
+        record["duration_ms"] = round(duration * 1000, 3)
+        self._stalls.append(record)
+        self.stall_count += 1
+        LOOP_STALLS.inc(stall["command"] or "none")
+        LOOP_STALL_SECONDS.observe(duration)
+        print(f"🐢 Event loop blocked for {duration:.2f}s"
+              + (f" in /{stall['command']}" if stall["command"] else "")
+              + (f" at {stall['location']}" if stall["location"] else ""))
+
+    def recent_stalls(self) -> List[Dict[str, Any]]:
+        """Recent stalls, newest first, including one still in progress"""
+        stalls = list(self._stalls)
+        current = self._current
+        if current is not None:
+            ongoing = {key: value for key, value in current.items() if key != "beat"}
+            ongoing["duration_ms"] = round(max(0.0, time.monotonic() - (current["beat"] + self.interval)) * 1000, 3)
+            ongoing["ongoing"] = True
+            stalls.append(ongoing)
+        return list(reversed(stalls))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "beats": self.beats,
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "stalls": self.stall_count
+        }
+
+
+# Started with the bot; its report is shown on the dashboard
+loop_watchdog = LoopWatchdog()
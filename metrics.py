@@ -0,0 +1,217 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; covers everything from a cache hit to a slow model
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """Base for one named metric family with a fixed set of label names"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _check(self, labels: Labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+    def samples(self) -> Iterable[Tuple[str, Labels, Sequence[str], float]]:
+        """``(suffix, label_names, label_values, value)`` tuples for exposition"""
+        return ()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            self._check(labels)
+            yield "", self.labelnames, labels, value
+
+
+class Gauge(Metric):
+    """Gauge set directly, or read from ``collect`` (``[(label_values, value), ...]``) at scrape time"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), collect: Optional[Callable[[], Iterable[Tuple[Labels, float]]]] = None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.collect is not None:
+            try:
+                values.update((tuple(labels), value) for labels, value in self.collect())
+            except Exception as e:
+                print(f"⚠️ Failed to collect metric {self.name}: {e}")
+        for labels, value in sorted(values.items()):
+            self._check(labels)
+            if value is not None:
+                yield "", self.labelnames, labels, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self._values[labels] = entry
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the duration of a ``with`` block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(entry)) for labels, entry in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, entry in sorted(values):
+            self._check(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                yield "_bucket", names, labels + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, labels, entry[-2]
+            yield "_count", self.labelnames, labels, entry[-1]
+
+
+class MetricsRegistry:
+    """Process-wide metric families, rendered in the Prometheus text format
+
+    Registering a name twice returns the existing metric (a gauge gets the
+    new ``collect`` callback), so modules and app factories can declare the
+    metrics they use without coordinating.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, cls, name: str, *args, **kwargs) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            elif isinstance(metric, Gauge) and kwargs.get("collect") is not None:
+                metric.collect = kwargs["collect"]
+            return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), collect=None) -> Gauge:
+        return self._register(Gauge, name, help, labels, collect=collect)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Exposed on the web app's /metrics route
+metrics = MetricsRegistry()
+
+# /ask, broken down: queue (waiting for a turn), db (building context), ttft and upstream (model call), total
+ASK_PHASE_SECONDS = metrics.histogram("discordai_ask_phase_seconds", "Time spent in each phase of /ask", ("phase",))
+ASK_TOKENS = metrics.histogram("discordai_ask_tokens", "Estimated tokens per /ask request", ("kind",), buckets=TOKEN_BUCKETS)
+ASK_OUTCOMES = metrics.counter("discordai_ask_total", "/ask requests by outcome", ("outcome",))
+DISCORD_SEND_SECONDS = metrics.histogram("discordai_discord_send_seconds", "Latency of Discord message sends and edits", ("op",))
+EVENT_LOOP_LAG_SECONDS = metrics.histogram("discordai_event_loop_lag_seconds", "Delay of the bot's event loop beyond a scheduled wakeup",
+                                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_STALLS = metrics.counter("discordai_event_loop_stalls_total", "Event loop stalls over the threshold by command", ("command",))
+LOOP_STALL_SECONDS = metrics.histogram("discordai_event_loop_stall_seconds", "Duration of event loop stalls over the threshold",
+                                       buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+HISTORY_PRUNED = metrics.counter("discordai_history_pruned_total", "Conversation history rows deleted by the retention job", ("reason",))
+
+UPSTREAM_REQUESTS = metrics.counter("discordai_openrouter_requests_total", "OpenRouter HTTP attempts by model and status", ("model", "status"))
+UPSTREAM_RETRIES = metrics.counter("discordai_openrouter_retries_total", "OpenRouter retries by model and reason", ("model", "reason"))
+UPSTREAM_TTFT_SECONDS = metrics.histogram("discordai_openrouter_ttft_seconds", "Time to the first streamed token", ("model",))
+UPSTREAM_SECONDS = metrics.histogram("discordai_openrouter_request_seconds", "Total OpenRouter completion time including retries", ("model", "mode"))
@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Dict, List, Optional
+from config import Config
+from database import AIModel
+from autocomplete_index import AutocompleteIndex
+
+
+class ModelInfo:
+    """Read-only snapshot of an AIModel row, safe to use outside a session"""
+
+    __slots__ = ("id", "name", "official_name", "api_key", "is_active", "team_only", "is_fallback")
+
+    def __init__(self, model: AIModel):
+        self.id = model.id
+        self.name = model.name
+        self.official_name = model.official_name
+        self.api_key = model.api_key
+        self.is_active = bool(model.is_active)
+        self.team_only = bool(model.team_only)
+        self.is_fallback = bool(model.is_fallback)
+
+    def __repr__(self):
+        return f"<ModelInfo {self.name!r} ({self.official_name})>"
+
+
+class ModelRegistry:
+    """In-memory cache of the ai_model table
+
+    The table is tiny and changes rarely, so the bot reads it from here instead
+    of querying on every command and autocomplete keystroke. Entries expire
+    after ``ttl`` seconds, and the web dashboard calls :meth:`invalidate`
+    whenever it changes a model.
+    """
+
+    def __init__(self, ttl: float = Config.MODEL_REGISTRY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = 0
+        self._loaded_at = None
+        self._models: List[ModelInfo] = []
+        self._active: List[ModelInfo] = []
+        self._by_name: Dict[str, ModelInfo] = {}
+        self._by_official_name: Dict[str, ModelInfo] = {}
+        self._fallback: Optional[ModelInfo] = None
+        self._autocomplete = AutocompleteIndex([])
+        self.refreshes = 0
+        self.invalidations = 0
+
+    def is_fresh(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next lookup reloads from the database"""
+        with self._lock:
+            self._version += 1
+            self._loaded_at = None
+            self.invalidations += 1
+
+    def refresh(self):
+        """Reload every model from the database (requires an app context)"""
+        with self._lock:
+            version = self._version
+
+        models = [ModelInfo(m) for m in AIModel.query.order_by(AIModel.id).all()]
+        active = [m for m in models if m.is_active]
+
+        # Match the first-row-wins semantics of .first() for duplicate names
+        by_name = {}
+        by_official_name = {}
+        for model in active:
+            by_name.setdefault(model.name, model)
+            by_official_name.setdefault(model.official_name, model)
+        autocomplete = AutocompleteIndex(m.name for m in active)
+        fallback = next((m for m in active if m.is_fallback), None)
+
+        with self._lock:
+            self._models = models
+            self._active = active
+            self._by_name = by_name
+            self._by_official_name = by_official_name
+            self._autocomplete = autocomplete
+            self._fallback = fallback
+            self.refreshes += 1
+            # An invalidation that raced with this load leaves the snapshot stale
+            if version == self._version:
+                self._loaded_at = time.monotonic()
+
+    def has_snapshot(self) -> bool:
+        """Whether any data has been loaded, even if it has since gone stale"""
+        return self.refreshes > 0
+
+    @property
+    def autocomplete(self) -> AutocompleteIndex:
+        """Search index over active model names"""
+        return self._autocomplete
+
+    def all_models(self) -> List[ModelInfo]:
+        return self._models
+
+    def active_models(self) -> List[ModelInfo]:
+        return self._active
+
+    def get_by_name(self, name: str) -> Optional[ModelInfo]:
+        """Active model by display name"""
+        return self._by_name.get(name)
+
+    def get_by_official_name(self, official_name: str) -> Optional[ModelInfo]:
+        """Active model by OpenRouter model id"""
+        return self._by_official_name.get(official_name)
+
+    def fallback_model(self) -> Optional[ModelInfo]:
+        """Active model chosen on the dashboard to stand in for models with an open circuit breaker"""
+        return self._fallback
+
+    def stats(self):
+        return {
+            "models": len(self._models),
+            "active": len(self._active),
+            "fresh": self.is_fresh(),
+            "ttl": self.ttl,
+            "refreshes": self.refreshes,
+            "invalidations": self.invalidations
+        }
+
+
+# Shared by the Discord bot (reads) and the web dashboard (invalidation)
+model_registry = ModelRegistry()
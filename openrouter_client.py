@@ -1,13 +1,46 @@
 import requests
+from requests.adapters import HTTPAdapter
+import aiohttp
+import asyncio
 import json
 import base64
-from typing import Optional, Dict, Any, List, Union
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Union, AsyncIterator
 import time
+from config import Config
+from token_budget import MESSAGE_OVERHEAD, estimate_tokens
+from rate_limiter import rate_limiter
+from circuit_breaker import CLOSED, circuit_breakers
+from response_cache import response_cache
+from request_coalescer import request_coalescer, request_key
+from metrics import UPSTREAM_REQUESTS, UPSTREAM_RETRIES, UPSTREAM_SECONDS, UPSTREAM_TTFT_SECONDS
+from tracing import tracer
+from cassette import cassette
+
+class StreamIncomplete(Exception):
+    """Raised at the end of a response stream that produced text but never reached [DONE]"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
 
 class OpenRouterClient:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, session: Optional[requests.Session] = None):
         self.api_key = api_key
-        self.base_url = "https://openrouter.ai/api/v1"
+        # Pooled keep-alive session when provided by the registry, plain requests otherwise
+        self.http = session if session is not None else requests
+        # Shared per (API key, model) so every client backs off together
+        self.limiter = rate_limiter
+        # Per-model health, fed with every request's outcome
+        self.breakers = circuit_breakers
+        # Exact-match cache for repeated prompts (only models enabled in config)
+        self.cache = response_cache
+        # Records or replays completions when a cassette mode is configured
+        self.cassette = cassette if cassette.mode else None
+        self.base_url = Config.OPENROUTER_BASE_URL
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
@@ -21,21 +54,96 @@ class OpenRouterClient:
             "google/gemini-2.5-flash-image-preview:free": {
                 "supports_images": True,
                 "max_tokens": 8192,
+                "context_window": 32768,
                 "temperature_range": [0.0, 2.0]
             },
             "google/gemini-flash-1.5:free": {
                 "supports_images": True,
                 "max_tokens": 8192,
+                "context_window": 1000000,
                 "temperature_range": [0.0, 2.0]
             },
             "openai/gpt-4o": {
                 "supports_images": True,
                 "max_tokens": 4096,
+                "context_window": 128000,
                 "temperature_range": [0.0, 2.0]
             }
         }
 
-    def generate_response(self, model: str, message: Union[str, List[Dict]], system_prompt: str = "You are a helpful AI assistant.", conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None) -> Optional[str]:
+    def _build_payload(self, model: str, message: Union[str, List[Dict]], system_prompt: str, conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Build the chat completions payload shared by the sync and async clients"""
+        # Get model configuration
+        model_config = self.model_configs.get(model, {})
+        max_tokens = model_config.get("max_tokens", 1000)
+        supports_images = model_config.get("supports_images", False)
+
+        # Build messages array with system prompt
+        messages = [{"role": "system", "content": system_prompt}]
+
+        # Add conversation history if provided
+        if conversation_history:
+            messages.extend(conversation_history)
+
+        # Handle multimodal content
+        user_message = {"role": "user"}
+
+        if isinstance(message, list):
+            # Already formatted multimodal content
+            user_message["content"] = message
+        elif image_data and supports_images:
+            # Create multimodal message with image
+            image_b64 = base64.b64encode(image_data).decode('utf-8')
+            user_message["content"] = [
+                {"type": "text", "text": message},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{image_b64}"
+                    }
+                }
+            ]
+        else:
+            # Simple text message
+            user_message["content"] = message
+
+        messages.append(user_message)
+
+        # Build payload with model-specific optimizations
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "stream": False
+        }
+
+        # Add model-specific parameters
+        if "gemini" in model.lower():
+            payload.update({
+                "temperature": 0.8,
+                "top_k": 40,
+                "top_p": 0.95
+            })
+        elif "gpt" in model.lower():
+            payload.update({
+                "presence_penalty": 0.1,
+                "frequency_penalty": 0.1
+            })
+
+        return payload
+
+    @staticmethod
+    def _extract_content(data: Dict[str, Any]) -> Optional[str]:
+        """Pull the assistant text out of a chat completions response body"""
+        if data.get('choices') and len(data['choices']) > 0:
+            content = data['choices'][0]['message']['content']
+            if content and content.strip():
+                return content.strip()
+        return None
+
+    def generate_response(self, model: str, message: Union[str, List[Dict]], system_prompt: str = "You are a helpful AI assistant.", conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None, use_cache: bool = True) -> Optional[str]:
         """
         Generate a response using the specified model with optional conversation history and image support
 
@@ -45,90 +153,51 @@ class OpenRouterClient:
             system_prompt: System instruction for the AI
             conversation_history: Previous conversation messages
             image_data: Optional image bytes for multimodal models
+            use_cache: Whether the response cache may answer or remember this request
         """
         try:
-            # Get model configuration
-            model_config = self.model_configs.get(model, {})
-            max_tokens = model_config.get("max_tokens", 1000)
-            supports_images = model_config.get("supports_images", False)
-
-            # Build messages array with system prompt
-            messages = [{"role": "system", "content": system_prompt}]
-
-            # Add conversation history if provided
-            if conversation_history:
-                messages.extend(conversation_history)
-
-            # Handle multimodal content
-            user_message = {"role": "user"}
-
-            if isinstance(message, list):
-                # Already formatted multimodal content
-                user_message["content"] = message
-            elif image_data and supports_images:
-                # Create multimodal message with image
-                image_b64 = base64.b64encode(image_data).decode('utf-8')
-                user_message["content"] = [
-                    {"type": "text", "text": message},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_b64}"
-                        }
-                    }
-                ]
-            else:
-                # Simple text message
-                user_message["content"] = message
-
-            messages.append(user_message)
-
-            # Build payload with model-specific optimizations
-            payload = {
-                "model": model,
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "stream": False
-            }
+            cache_key, cached = self.cache.lookup(model, message, system_prompt, conversation_history, image_data) if use_cache else (None, None)
+            if cached is not None:
+                return cached
 
-            # Add model-specific parameters
-            if "gemini" in model.lower():
-                payload.update({
-                    "temperature": 0.8,
-                    "top_k": 40,
-                    "top_p": 0.95
-                })
-            elif "gpt" in model.lower():
-                payload.update({
-                    "presence_penalty": 0.1,
-                    "frequency_penalty": 0.1
-                })
+            payload = self._build_payload(model, message, system_prompt, conversation_history, image_data)
+            request_started = time.monotonic()
 
             # Make request with retry logic
             max_retries = 3
             for attempt in range(max_retries):
+                # Don't keep retrying a model whose breaker tripped meanwhile
+                if attempt and self.breakers.state(model) != CLOSED:
+                    print(f"Circuit breaker for {model} is open, not retrying")
+                    return None
+
+                # Queue for the key's rate limit; after a 429 this waits out the backoff
+                if not self.limiter.acquire_sync(self.api_key, model):
+                    print(f"Rate limit queue for {model} is full, giving up")
+                    return None
+
+                started = time.monotonic()
                 try:
-                    response = requests.post(
-                        f"{self.base_url}/chat/completions",
-                        headers=self.headers,
-                        json=payload,
-                        timeout=60
-                    )
+                    try:
+                        with tracer.span("openrouter.post", model=model, attempt=attempt + 1) as span:
+                            response = self._post_sync(payload)
+                            span.set(status=response.status_code)
+                    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                        self.breakers.record(model, False, time.monotonic() - started)
+                        UPSTREAM_REQUESTS.inc(model, "timeout" if isinstance(e, requests.exceptions.Timeout) else "error")
+                        raise
+                    UPSTREAM_REQUESTS.inc(model, str(response.status_code))
+                    self.limiter.record(self.api_key, model, response.status_code, response.headers)
+                    if response.status_code == 200 or response.status_code >= 500:
+                        self.breakers.record(model, response.status_code == 200, time.monotonic() - started)
 
                     if response.status_code == 200:
-                        data = response.json()
-                        if data.get('choices') and len(data['choices']) > 0:
-                            content = data['choices'][0]['message']['content']
-                            if content and content.strip():
-                                return content.strip()
-                        return None
+                        UPSTREAM_SECONDS.observe(time.monotonic() - request_started, model, "sync")
+                        return self.cache.store(cache_key, model, self._extract_content(response.json()))
                     elif response.status_code == 429:  # Rate limit
                         if attempt < max_retries - 1:
-                            wait_time = 2 ** attempt
-                            print(f"Rate limited, waiting {wait_time}s before retry...")
-                            time.sleep(wait_time)
+                            print(f"Rate limited on {model}, retrying after backoff...")
+                            UPSTREAM_RETRIES.inc(model, "429")
                             continue
                         else:
                             print(f"Rate limit error: {response.text}")
@@ -148,6 +217,7 @@ class OpenRouterClient:
                 except requests.exceptions.Timeout:
                     if attempt < max_retries - 1:
                         print(f"Request timeout, retrying... (attempt {attempt + 1})")
+                        UPSTREAM_RETRIES.inc(model, "timeout")
                         continue
                     else:
                         print(f"Request timeout after {max_retries} attempts")
@@ -159,10 +229,32 @@ class OpenRouterClient:
             print(f"Error generating response: {e}")
             return None
 
+    def _completion_headers(self) -> Dict[str, str]:
+        """Request headers, tagged with the current trace ID so upstream logs can be matched to a trace"""
+        trace_id = tracer.current_trace_id()
+        if trace_id is None:
+            return self.headers
+        return {**self.headers, "X-Request-ID": trace_id}
+
+    def _post_sync(self, payload: Dict[str, Any]):
+        """POST a completion, or answer it from the cassette when replaying"""
+        if self.cassette is not None and self.cassette.replaying:
+            return self.cassette.replay_sync(payload)
+        started = time.monotonic()
+        response = self.http.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._completion_headers(),
+            json=payload,
+            timeout=60
+        )
+        if self.cassette is not None and self.cassette.recording:
+            self.cassette.record_sync(payload, response, time.monotonic() - started)
+        return response
+
     def get_models(self) -> Optional[Dict[str, Any]]:
         """Get available models from OpenRouter"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/models",
                 headers=self.headers,
                 timeout=15
@@ -184,7 +276,8 @@ class OpenRouterClient:
             test_response = self.generate_response(
                 model=model,
                 message="Hello! Please respond with 'OK' to confirm you're working.",
-                system_prompt="You are a test assistant. Respond briefly."
+                system_prompt="You are a test assistant. Respond briefly.",
+                use_cache=False
             )
             return test_response is not None and len(test_response.strip()) > 0
         except Exception as e:
@@ -198,5 +291,648 @@ class OpenRouterClient:
             "supports_images": config.get("supports_images", False),
             "max_tokens": config.get("max_tokens", 1000),
             "temperature_range": config.get("temperature_range", [0.0, 2.0]),
+            "context_window": config.get("context_window", Config.DEFAULT_CONTEXT_WINDOW),
             "is_multimodal": config.get("supports_images", False)
         }
+
+    def get_history_budget(self, model: str, system_prompt: str, message: str) -> int:
+        """
+        Tokens available for conversation history in a request to ``model``
+
+        The model's context window minus the reply's ``max_tokens``, the system
+        prompt and the new message, capped at ``Config.CONTEXT_HISTORY_TOKENS``
+        so large-window models don't get sent (and billed for) the whole history.
+        """
+        config = self.model_configs.get(model, {})
+        window = config.get("context_window", Config.DEFAULT_CONTEXT_WINDOW)
+        reserved = config.get("max_tokens", 1000) + estimate_tokens(system_prompt) + estimate_tokens(message) + 2 * MESSAGE_OVERHEAD
+        return max(0, min(window - reserved, Config.CONTEXT_HISTORY_TOKENS))
+
+
+def parse_siblings(value: Optional[str]) -> Dict[str, str]:
+    """Parse ``"model-a=model-b,model-c=model-d"`` into a hedge target mapping"""
+    siblings = {}
+    for pair in (value or "").split(","):
+        if "=" in pair:
+            model, sibling = pair.split("=", 1)
+            if model.strip() and sibling.strip():
+                siblings[model.strip()] = sibling.strip()
+    return siblings
+
+
+class HedgePolicy:
+    """Decides when a request is hedged, and keeps count of what hedging costs
+
+    A request is hedged once it has waited longer than ``percentile`` of the
+    model's recent times to first token without producing one. The hedge goes
+    to the model's configured sibling, or to the same model. Every request
+    earns ``max_rate`` of a hedge credit (up to ``burst``) and every hedge
+    spends a whole one, so at most about ``max_rate`` of requests are sent twice.
+    """
+
+    def __init__(self, percentile: float = Config.HEDGE_PERCENTILE, max_rate: float = Config.HEDGE_MAX_RATE,
+                 min_delay: float = Config.HEDGE_MIN_DELAY, default_delay: float = Config.HEDGE_DEFAULT_DELAY,
+                 siblings: Optional[Dict[str, str]] = None, window: int = 200, min_samples: int = 20, burst: float = 3.0):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.siblings = siblings if siblings is not None else parse_siblings(Config.HEDGE_SIBLINGS)
+        self.window = window
+        self.min_samples = min_samples
+        self.burst = burst
+        self.credit = 1.0
+        self._lock = threading.Lock()
+        self._ttft: Dict[str, deque] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, model: str, key: str):
+        counts = self._counts.setdefault(model, {"requests": 0, "hedged": 0, "hedge_wins": 0, "suppressed": 0})
+        counts[key] += 1
+
+    def delay(self, model: str) -> float:
+        """Seconds to wait for a first token before hedging"""
+        with self._lock:
+            samples = self._ttft.get(model)
+            if not samples or len(samples) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(samples)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))])
+
+    def target(self, model: str) -> str:
+        return self.siblings.get(model, model)
+
+    def begin(self, model: str):
+        with self._lock:
+            self._count(model, "requests")
+            self.credit = min(self.burst, self.credit + self.max_rate)
+
+    def try_hedge(self, model: str) -> bool:
+        """Spend a hedge credit, or count the hedge as suppressed when there is none"""
+        with self._lock:
+            if self.credit < 1.0:
+                self._count(model, "suppressed")
+                return False
+            self.credit -= 1.0
+            self._count(model, "hedged")
+            return True
+
+    def record_ttft(self, model: str, seconds: float):
+        """Time to first token of a primary request (a lower bound when the hedge beat it)"""
+        with self._lock:
+            self._ttft.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def record_hedge_win(self, model: str):
+        with self._lock:
+            self._count(model, "hedge_wins")
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        with self._lock:
+            names = list(self._counts)
+            counts = {name: dict(self._counts[name]) for name in names}
+            credit = self.credit
+        for name in names:
+            entry = counts[name]
+            entry["hedge_rate"] = round(entry["hedged"] / entry["requests"], 4) if entry["requests"] else 0.0
+            entry["threshold"] = round(self.delay(name), 3)
+            entry["target"] = self.target(name)
+            models[name] = entry
+        return {
+            "percentile": self.percentile,
+            "max_rate": self.max_rate,
+            "credit": round(credit, 3),
+            "requests": sum(c["requests"] for c in counts.values()),
+            "hedged": sum(c["hedged"] for c in counts.values()),
+            "hedge_wins": sum(c["hedge_wins"] for c in counts.values()),
+            "suppressed": sum(c["suppressed"] for c in counts.values()),
+            "models": models
+        }
+
+
+# Shared by every async client so thresholds and the hedge budget are process-wide
+hedge_policy = HedgePolicy()
+
+
+class AsyncOpenRouterClient(OpenRouterClient):
+    """asyncio-native OpenRouter client for use on the Discord bot's event loop
+
+    Requests go through aiohttp and wait for rate limit slots with
+    ``asyncio.sleep`` so a slow model never blocks other commands, heartbeats
+    or autocomplete.
+    """
+
+    def __init__(self, api_key: str, session: Optional[aiohttp.ClientSession] = None):
+        super().__init__(api_key)
+        self.http = None
+        self._session = session
+        self._owns_session = session is None
+        # Opt-in tail latency hedging for /ask
+        self.hedging = hedge_policy if Config.HEDGE_ENABLED else None
+        # Identical concurrent requests share one upstream call
+        self.coalescer = request_coalescer if Config.COALESCE_REQUESTS else None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        """Close the underlying HTTP session if this client created it"""
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, session: aiohttp.ClientSession, payload: Dict[str, Any], timeout: aiohttp.ClientTimeout):
+        """POST a completion, or answer it from the cassette when replaying"""
+        if self.cassette is not None and self.cassette.replaying:
+            return await self.cassette.replay(payload)
+        started = time.monotonic()
+        response = await session.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._completion_headers(),
+            json=payload,
+            timeout=timeout
+        )
+        if self.cassette is not None and self.cassette.recording:
+            return self.cassette.record(payload, response, time.monotonic() - started)
+        return response
+
+    @asynccontextmanager
+    async def _request(self, payload: Dict[str, Any], timeout: aiohttp.ClientTimeout):
+        """POST a completion with non-blocking retries, yielding the 200 response or None"""
+        session = self._get_session()
+        response = None
+        model = payload["model"]
+
+        max_retries = 3
+        for attempt in range(max_retries):
+            # Don't keep retrying a model whose breaker tripped meanwhile
+            if attempt and self.breakers.state(model) != CLOSED:
+                print(f"Circuit breaker for {model} is open, not retrying")
+                break
+
+            # Queue for the key's rate limit; after a 429 this waits out the backoff
+            if not await self.limiter.acquire(self.api_key, model):
+                print(f"Rate limit queue for {model} is full, giving up")
+                break
+
+            started = time.monotonic()
+            try:
+                with tracer.span("openrouter.post", model=model, attempt=attempt + 1, stream=bool(payload.get("stream"))) as span:
+                    candidate = await self._post(session, payload, timeout)
+                    span.set(status=candidate.status)
+            # Before ClientError: aiohttp's connect and sock_read timeouts subclass both
+            except asyncio.TimeoutError:
+                self.breakers.record(model, False, time.monotonic() - started)
+                UPSTREAM_REQUESTS.inc(model, "timeout")
+                if attempt < max_retries - 1:
+                    print(f"Request timeout, retrying... (attempt {attempt + 1})")
+                    UPSTREAM_RETRIES.inc(model, "timeout")
+                    continue
+                else:
+                    print(f"Request timeout after {max_retries} attempts")
+                    break
+            except aiohttp.ClientError:
+                self.breakers.record(model, False, time.monotonic() - started)
+                UPSTREAM_REQUESTS.inc(model, "error")
+                raise
+
+            UPSTREAM_REQUESTS.inc(model, str(candidate.status))
+            self.limiter.record(self.api_key, model, candidate.status, candidate.headers)
+            if candidate.status == 200 or candidate.status >= 500:
+                self.breakers.record(model, candidate.status == 200, time.monotonic() - started)
+            if candidate.status == 200:
+                response = candidate
+                break
+
+            try:
+                if candidate.status == 429:  # Rate limit
+                    if attempt < max_retries - 1:
+                        print(f"Rate limited on {model}, retrying after backoff...")
+                        UPSTREAM_RETRIES.inc(model, "429")
+                        continue
+                    else:
+                        print(f"Rate limit error: {await candidate.text()}")
+                elif candidate.status == 401:
+                    print(f"Authentication error: Invalid API key")
+                elif candidate.status == 400:
+                    error_text = await candidate.text()
+                    try:
+                        error_msg = json.loads(error_text).get('error', {}).get('message', error_text)
+                    except ValueError:
+                        error_msg = error_text
+                    print(f"Bad request error: {error_msg}")
+                else:
+                    print(f"HTTP {candidate.status}: {await candidate.text()}")
+                break
+            finally:
+                candidate.release()
+
+        try:
+            yield response
+        finally:
+            if response is not None:
+                response.release()
+
+    async def generate_response(self, model: str, message: Union[str, List[Dict]], system_prompt: str = "You are a helpful AI assistant.", conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None, use_cache: bool = True) -> Optional[str]:
+        """Async version of :meth:`OpenRouterClient.generate_response`, hedged and coalesced when enabled"""
+        cache_key, cached = self.cache.lookup(model, message, system_prompt, conversation_history, image_data) if use_cache else (None, None)
+        if cached is not None:
+            return cached
+
+        args = (message, system_prompt, conversation_history, image_data)
+        if self.coalescer is None:
+            return await self._generate_upstream(model, args, cache_key)
+        return await self.coalescer.call(
+            request_key(self.api_key, model, *args),
+            lambda: self._generate_upstream(model, args, cache_key)
+        )
+
+    async def _generate_upstream(self, model: str, args: tuple, cache_key: Optional[str]) -> Optional[str]:
+        if self.hedging is None:
+            response = await self._generate_once(model, *args)
+        else:
+            response = await self._hedged_generate(model, args)
+        return self.cache.store(cache_key, model, response)
+
+    async def _hedged_generate(self, model: str, args: tuple) -> Optional[str]:
+        """Race a second request against a slow first one and return whichever answers first"""
+        policy = self.hedging
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        policy.begin(model)
+
+        primary = asyncio.create_task(self._generate_once(model, *args))
+        hedge = None
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=policy.delay(model))
+            if not done:
+                hedge_model = policy.target(model)
+                if self.breakers.state(hedge_model) == CLOSED and policy.try_hedge(model):
+                    hedge = asyncio.create_task(self._generate_once(hedge_model, *args))
+                    pending.add(hedge)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result is None:
+                        continue
+                    policy.record_ttft(model, loop.time() - started)
+                    if task is hedge:
+                        policy.record_hedge_win(model)
+                    return result
+            return None
+        finally:
+            # Cancel the loser so its connection goes back to the pool
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _generate_once(self, model: str, message: Union[str, List[Dict]], system_prompt: str, conversation_history: Optional[List[Dict[str, str]]], image_data: Optional[bytes]) -> Optional[str]:
+        try:
+            payload = self._build_payload(model, message, system_prompt, conversation_history, image_data)
+            started = time.monotonic()
+
+            async with self._request(payload, aiohttp.ClientTimeout(total=60)) as response:
+                if response is None:
+                    return None
+                content = self._extract_content(await response.json(content_type=None))
+                UPSTREAM_SECONDS.observe(time.monotonic() - started, model, "async")
+                return content
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return None
+
+    async def stream_response(self, model: str, message: Union[str, List[Dict]], system_prompt: str = "You are a helpful AI assistant.", conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None) -> AsyncIterator[str]:
+        """
+        Stream a response over server-sent events, yielding text deltas as they arrive
+
+        Takes the same arguments as :meth:`generate_response`. A request that
+        fails before any text arrives gives an empty stream, which callers
+        should treat as "no response"; a stream that fails part-way raises
+        :class:`StreamIncomplete` after the text it did produce. With hedging enabled, a second stream is started when
+        the first is slow to produce a token, and the first to do so is used.
+        A cached response is yielded as a single delta, and a caller asking
+        for a stream that is already in flight joins it from the start.
+        """
+        cache_key, cached = self.cache.lookup(model, message, system_prompt, conversation_history, image_data)
+        if cached is not None:
+            yield cached
+            return
+
+        args = (message, system_prompt, conversation_history, image_data)
+        if self.coalescer is None:
+            stream = self._stream_upstream(model, args, cache_key)
+        else:
+            stream = self.coalescer.stream(
+                request_key(self.api_key, model, *args),
+                lambda: self._stream_upstream(model, args, cache_key)
+            )
+        try:
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose()
+
+    async def _stream_upstream(self, model: str, args: tuple, cache_key: Optional[str]) -> AsyncIterator[str]:
+        outcome = {}
+        stream = self._stream_once(model, *args, outcome=outcome) if self.hedging is None else self._hedged_stream(model, args, outcome)
+        parts = []
+        try:
+            async for delta in stream:
+                parts.append(delta)
+                yield delta
+        finally:
+            await stream.aclose()
+
+        # Only a stream that ran to [DONE] is worth remembering
+        if outcome.get("complete"):
+            self.cache.store(cache_key, model, "".join(parts).strip())
+        elif parts:
+            raise StreamIncomplete(outcome.get("error") or "the stream ended before the response was complete")
+
+    async def _hedged_stream(self, model: str, args: tuple, outcome: Dict[str, Any]) -> AsyncIterator[str]:
+        policy = self.hedging
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        hedge_at = started + policy.delay(model)
+        policy.begin(model)
+
+        # Each candidate stream is raced on fetching its first delta
+        outcomes = {}
+        primary = self._stream_once(model, *args, outcome=outcomes.setdefault("primary", {}))
+        candidates = {asyncio.ensure_future(primary.__anext__()): primary}
+        hedge = None
+        winner = None
+        first = None
+        try:
+            while candidates and winner is None:
+                timeout = max(0.0, hedge_at - loop.time()) if hedge_at is not None else None
+                done, _ = await asyncio.wait(candidates, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    hedge_model = policy.target(model)
+                    if self.breakers.state(hedge_model) == CLOSED and policy.try_hedge(model):
+                        hedge = self._stream_once(hedge_model, *args, outcome=outcomes.setdefault("hedge", {}))
+                        candidates[asyncio.ensure_future(hedge.__anext__())] = hedge
+                    continue
+
+                for task in done:
+                    stream = candidates.pop(task)
+                    try:
+                        first = task.result()
+                    except (StopAsyncIteration, Exception):
+                        # Ended without a token, i.e. the request failed
+                        await stream.aclose()
+                        continue
+                    winner = stream
+                    break
+
+            if winner is None:
+                return
+            policy.record_ttft(model, loop.time() - started)
+            if winner is hedge:
+                policy.record_hedge_win(model)
+
+            yield first
+            async for delta in winner:
+                yield delta
+            outcome.update(outcomes["hedge" if winner is hedge else "primary"])
+        finally:
+            # Cancel the loser so its connection goes back to the pool
+            for task in candidates:
+                task.cancel()
+            if candidates:
+                await asyncio.gather(*candidates, return_exceptions=True)
+            for stream in candidates.values():
+                await stream.aclose()
+            if winner is not None:
+                await winner.aclose()
+
+    async def _stream_once(self, model: str, message: Union[str, List[Dict]], system_prompt: str, conversation_history: Optional[List[Dict[str, str]]], image_data: Optional[bytes], outcome: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        try:
+            payload = self._build_payload(model, message, system_prompt, conversation_history, image_data)
+            payload["stream"] = True
+            started = time.monotonic()
+            first = True
+
+            # No total timeout for streams; give up only if the connection goes quiet
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60)
+            async with self._request(payload, timeout) as response:
+                if response is None:
+                    return
+
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+
+                    # Skip blank separators and SSE comments such as ": OPENROUTER PROCESSING"
+                    if not line.startswith('data:'):
+                        continue
+
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        if outcome is not None:
+                            outcome["complete"] = True
+                        UPSTREAM_SECONDS.observe(time.monotonic() - started, model, "stream")
+                        break
+
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        continue
+
+                    if chunk.get('error'):
+                        error = chunk['error'].get('message', chunk['error']) if isinstance(chunk['error'], dict) else chunk['error']
+                        print(f"Stream error: {error}")
+                        if outcome is not None:
+                            outcome["error"] = str(error)
+                        break
+
+                    choices = chunk.get('choices') or []
+                    if choices:
+                        delta = (choices[0].get('delta') or {}).get('content')
+                        if delta:
+                            if first:
+                                first = False
+                                UPSTREAM_TTFT_SECONDS.observe(time.monotonic() - started, model)
+                                tracer.annotate(ttft_ms=round((time.monotonic() - started) * 1000, 3))
+                            yield delta
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            if outcome is not None:
+                # A sock_read timeout has an empty message
+                outcome["error"] = str(e) or type(e).__name__
+
+    async def get_models(self) -> Optional[Dict[str, Any]]:
+        """Get available models from OpenRouter"""
+        try:
+            async with self._get_session().get(
+                f"{self.base_url}/models",
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=15)
+            ) as response:
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                else:
+                    print(f"Error fetching models: {response.status}")
+                    return None
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error getting models: {e}")
+            return None
+
+    async def test_model_availability(self, model: str) -> bool:
+        """Test if a model is available and responding"""
+        try:
+            test_response = await self.generate_response(
+                model=model,
+                message="Hello! Please respond with 'OK' to confirm you're working.",
+                system_prompt="You are a test assistant. Respond briefly.",
+                use_cache=False
+            )
+            return test_response is not None and len(test_response.strip()) > 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Model test failed for {model}: {e}")
+            return False
+
+
+class ClientRegistry:
+    """Process-wide OpenRouter clients keyed by API key
+
+    Each API key gets one long-lived client backed by a keep-alive connection
+    pool, so repeated requests skip the TCP+TLS handshake. Clients idle for
+    longer than ``idle_timeout`` seconds are evicted and their pools closed.
+    """
+
+    def __init__(self, pool_size: int = Config.OPENROUTER_POOL_SIZE, idle_timeout: float = Config.OPENROUTER_POOL_IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sync_clients = {}   # api_key -> [client, last_used]
+        self._async_clients = {}  # api_key -> [client, last_used, loop]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_client(self, api_key: str) -> OpenRouterClient:
+        """Get the pooled synchronous client for an API key"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sync_clients.get(api_key)
+            if entry is not None:
+                self.hits += 1
+                entry[1] = now
+                return entry[0]
+
+            self.misses += 1
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            client = OpenRouterClient(api_key, session=session)
+            self._sync_clients[api_key] = [client, now]
+            return client
+
+    def get_async_client(self, api_key: str) -> "AsyncOpenRouterClient":
+        """Get the pooled async client for an API key; must be called from the running event loop"""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._async_clients.get(api_key)
+            if entry is not None and entry[2] is loop and not entry[0]._session.closed:
+                self.hits += 1
+                entry[1] = now
+                return entry[0]
+
+            self.misses += 1
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=Config.OPENROUTER_KEEPALIVE_TIMEOUT)
+            session = aiohttp.ClientSession(connector=connector)
+            client = AsyncOpenRouterClient(api_key, session=session)
+            self._async_clients[api_key] = [client, now, loop]
+            return client
+
+    def _evict_idle(self, now: float):
+        """Drop clients that have not been used within the idle timeout (lock must be held)"""
+        for api_key, entry in list(self._sync_clients.items()):
+            if now - entry[1] > self.idle_timeout:
+                del self._sync_clients[api_key]
+                entry[0].http.close()
+                self.evictions += 1
+
+        for api_key, entry in list(self._async_clients.items()):
+            if now - entry[1] > self.idle_timeout:
+                del self._async_clients[api_key]
+                self._close_async_session(entry[0]._session, entry[2])
+                self.evictions += 1
+
+    @staticmethod
+    def _close_async_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop):
+        if session.closed or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            loop.create_task(session.close())
+        else:
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool hit/miss statistics for diagnostics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "sync_clients": len(self._sync_clients),
+                "async_clients": len(self._async_clients),
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout
+            }
+
+    def close(self):
+        """Close every synchronous pool"""
+        with self._lock:
+            for entry in self._sync_clients.values():
+                entry[0].http.close()
+            self._sync_clients.clear()
+
+    async def aclose(self):
+        """Close every async pool owned by the current event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entries = [(key, entry) for key, entry in self._async_clients.items() if entry[2] is loop]
+            for key, _ in entries:
+                del self._async_clients[key]
+        for _, entry in entries:
+            await entry[0]._session.close()
+
+
+# Shared by the Discord bot and the web dashboard
+client_registry = ClientRegistry()
@@ -0,0 +1,254 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from config import Config
+
+# Longest a single Retry-After or reset header may block a bucket
+MAX_BACKOFF = 300.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until an X-RateLimit-Reset time (epoch milliseconds, epoch seconds or a delta)"""
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        return max(0.0, reset / 1000 - time.time())
+    if reset > 1e9:
+        return max(0.0, reset - time.time())
+    return max(0.0, reset)
+
+
+class Reservation:
+    __slots__ = ("start", "shift")
+
+    def __init__(self, start: float, shift: float):
+        self.start = start
+        self.shift = shift
+
+
+class RateLimitBucket:
+    """Token bucket for one (API key, model) pair
+
+    Implemented as a GCRA: each caller reserves the next free slot, so callers
+    are served in arrival order and spaced ``1 / rate`` apart once the
+    ``burst`` allowance is used up. A 429 or an exhausted quota header blocks
+    the bucket and pushes every outstanding reservation back by the same
+    amount, keeping their order. The rate halves on each 429 and creeps back
+    to the configured rate on success.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.05):
+        self.configured_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, rate)
+        self._lock = threading.Lock()
+        self._tat = 0.0  # GCRA theoretical arrival time
+        self._shift = 0.0  # Total delay added by backoffs, applied to reservations already handed out
+        self.blocked_until = 0.0
+        self.consecutive_429 = 0
+        self.waiting = 0
+
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_retry_after = None
+
+    def _interval(self) -> float:
+        return 1.0 / self.rate
+
+    def reserve(self, max_wait: float) -> Optional[Reservation]:
+        """Claim the next slot, or None if it is more than ``max_wait`` seconds away"""
+        now = time.monotonic()
+        with self._lock:
+            interval = self._interval()
+            tolerance = (self.burst - 1) * interval
+            start = max(now, self._tat - tolerance, self.blocked_until)
+            if start - now > max_wait:
+                self.rejected += 1
+                return None
+            self._tat = max(self._tat, start) + interval
+            self.waiting += 1
+            return Reservation(start, self._shift)
+
+    def delay(self, reservation: Reservation) -> float:
+        """Seconds until a reservation may proceed, including backoffs added since it was made"""
+        with self._lock:
+            return reservation.start + (self._shift - reservation.shift) - time.monotonic()
+
+    def release(self, reservation: Reservation, waited: float, granted: bool):
+        with self._lock:
+            self.waiting -= 1
+            if granted:
+                self.granted += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def _block(self, seconds: float):
+        """Block for ``seconds`` from now, delaying outstanding reservations by the extra time"""
+        now = time.monotonic()
+        until = now + min(seconds, MAX_BACKOFF)
+        current = max(self.blocked_until, now)
+        if until <= current:
+            return
+        added = until - current
+        self.blocked_until = until
+        self._shift += added
+        self._tat = max(self._tat, now) + added
+
+    def record(self, status: int, headers: Mapping[str, str]):
+        """Adapt to a response: back off on 429 and honour quota headers"""
+        with self._lock:
+            if status == 429:
+                self.throttled += 1
+                self.consecutive_429 += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = parse_reset(headers.get("X-RateLimit-Reset"))
+                if retry_after is None:
+                    retry_after = float(2 ** min(self.consecutive_429 - 1, 6))
+                self.last_retry_after = retry_after
+                self._block(retry_after)
+                return
+
+            if 200 <= status < 300:
+                self.consecutive_429 = 0
+                self.rate = min(self.configured_rate, self.rate + self.configured_rate * 0.05)
+                # Quota used up: hold everyone until it resets instead of collecting a 429
+                if headers.get("X-RateLimit-Remaining") == "0":
+                    reset = parse_reset(headers.get("X-RateLimit-Reset"))
+                    if reset:
+                        self._block(reset)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            interval = self._interval()
+            backlog = max(0.0, self._tat - now)
+            available = max(0.0, min(float(self.burst), (self.burst * interval - backlog) / interval))
+            return {
+                "rate": round(self.rate, 4),
+                "configured_rate": self.configured_rate,
+                "burst": self.burst,
+                "available": round(available, 2),
+                "blocked_for": round(max(0.0, self.blocked_until - now), 3),
+                "waiting": self.waiting,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "avg_wait_ms": round(self.total_wait / self.granted * 1000, 3) if self.granted else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "last_retry_after": self.last_retry_after
+            }
+
+
+class RateLimiter:
+    """Shared OpenRouter rate limiter keyed by (API key, model)
+
+    Every request, from the bot's async client or the dashboard's sync one,
+    waits for a slot in its bucket before it is sent and reports the response
+    back, so concurrent callers queue behind one backoff instead of each
+    retrying an exhausted key on its own.
+    """
+
+    def __init__(self, rate: float = Config.RATE_LIMIT_RPS, burst: int = Config.RATE_LIMIT_BURST, max_wait: float = Config.RATE_LIMIT_MAX_WAIT):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], RateLimitBucket] = {}
+
+    def bucket(self, api_key: str, model: str) -> RateLimitBucket:
+        key = (api_key, model)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = RateLimitBucket(self.rate, self.burst)
+                    self._buckets[key] = bucket
+        return bucket
+
+    async def acquire(self, api_key: str, model: str) -> bool:
+        """Wait for a slot without blocking the event loop; False if the queue is too long"""
+        bucket = self.bucket(api_key, model)
+        reservation = bucket.reserve(self.max_wait)
+        if reservation is None:
+            return False
+        started = time.monotonic()
+        granted = False
+        try:
+            while True:
+                delay = bucket.delay(reservation)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            granted = True
+        finally:
+            bucket.release(reservation, time.monotonic() - started, granted)
+        return True
+
+    def acquire_sync(self, api_key: str, model: str) -> bool:
+        """Blocking version of :meth:`acquire` for worker threads and the web dashboard"""
+        bucket = self.bucket(api_key, model)
+        reservation = bucket.reserve(self.max_wait)
+        if reservation is None:
+            return False
+        started = time.monotonic()
+        granted = False
+        try:
+            while True:
+                delay = bucket.delay(reservation)
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+            granted = True
+        finally:
+            bucket.release(reservation, time.monotonic() - started, granted)
+        return True
+
+    def record(self, api_key: str, model: str, status: int, headers: Mapping[str, str]):
+        self.bucket(api_key, model).record(status, headers)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-bucket state for the dashboard, with API keys masked"""
+        with self._lock:
+            buckets = list(self._buckets.items())
+        result = []
+        for (api_key, model), bucket in buckets:
+            entry = {"api_key": f"…{api_key[-4:]}" if api_key else "", "model": model}
+            entry.update(bucket.stats())
+            result.append(entry)
+        result.sort(key=lambda entry: (entry["model"], entry["api_key"]))
+        return result
+
+
+# Shared by every OpenRouter client in the process
+rate_limiter = RateLimiter()
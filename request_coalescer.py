@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+
+def request_key(api_key: str, model: str, message: Union[str, List[Dict]], system_prompt: str,
+                conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None) -> str:
+    """Hash identifying an exact completion request (the API key is part of it, so keys never share calls)"""
+    material = json.dumps([
+        api_key,
+        model,
+        system_prompt,
+        message,
+        conversation_history or [],
+        hashlib.sha256(image_data).hexdigest() if image_data else None
+    ], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class _Stream:
+    __slots__ = ("task", "subscribers", "deltas", "done", "error", "changed")
+
+    def __init__(self):
+        self.task = None
+        self.subscribers = 0
+        self.deltas: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Replaced on every delta, so each wait sees exactly the next change
+        self.changed = asyncio.Event()
+
+
+class RequestCoalescer:
+    """Single-flight de-duplication of identical in-flight completions
+
+    The first caller for a request key starts the upstream call and later
+    identical callers attach to it instead of sending their own: plain
+    requests await the same result, and stream subscribers replay the
+    deltas received so far and then follow the live stream. The upstream
+    call is cancelled only when every caller attached to it has gone away.
+    Must be used from the bot's event loop.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Stream] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+        self.abandoned = 0
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await ``factory()``, sharing it with concurrent callers of the same key"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # Shielded so one caller giving up doesn't cancel the call for the others
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+                self.abandoned += 1
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Iterate ``factory()``, sharing one upstream stream with concurrent subscribers of the same key"""
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _Stream()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, factory))
+            self.stream_leaders += 1
+        else:
+            self.stream_coalesced += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.deltas):
+                    index += 1
+                    yield flight.deltas[index - 1]
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                self._forget(self._streams, key, flight)
+                flight.task.cancel()
+                self.abandoned += 1
+
+    async def _pump(self, key: str, flight: _Stream, factory: Callable[[], AsyncIterator[str]]):
+        """Read the upstream stream into ``flight`` for its subscribers"""
+        stream = factory()
+        try:
+            async for delta in stream:
+                flight.deltas.append(delta)
+                changed, flight.changed = flight.changed, asyncio.Event()
+                changed.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Every subscriber gets the error after the deltas, as it would from its own stream
+            print(f"Error in shared response stream: {e}")
+            flight.error = e
+        finally:
+            await stream.aclose()
+            flight.done = True
+            self._forget(self._streams, key, flight)
+            flight.changed.set()
+
+    @staticmethod
+    def _forget(flights: Dict[str, Any], key: str, flight: Any):
+        # A newer flight may already own the key
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.leaders + self.coalesced
+        streams = self.stream_leaders + self.stream_coalesced
+        return {
+            "in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "stream_leaders": self.stream_leaders,
+            "stream_coalesced": self.stream_coalesced,
+            "abandoned": self.abandoned,
+            "saved_rate": round((self.coalesced + self.stream_coalesced) / (requests + streams), 4) if requests + streams else 0.0
+        }
+
+
+# Shared by the async OpenRouter clients on the bot's event loop
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,211 @@
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+from config import Config
+
+# Tickets move through these states in order
+ADMITTED = "admitted"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+
+
+class SchedulerFullError(Exception):
+    """Raised by :meth:`RequestScheduler.admit` when a request can't be queued"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Ticket:
+    """A request's place in the scheduler, from admission until :meth:`release`"""
+
+    def __init__(self, scheduler: "RequestScheduler", user_id: str, guild_id: Optional[str], priority: int, finish: float, start: float, seq: int):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.priority = priority
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.model = None
+        self.state = ADMITTED
+        self.admitted_at = time.monotonic()
+        self.dispatched_at = None
+        self._ready = None
+
+    @property
+    def sort_key(self):
+        return (self.priority, self.finish, self.seq)
+
+    def enqueue(self, model: str) -> int:
+        """Ask for a slot on ``model``; returns how many requests are ahead (0 when it can run now)"""
+        return self.scheduler._enqueue(self, model)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the ticket may run; False if ``timeout`` passed first"""
+        if self.state == RUNNING:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), timeout)
+        except asyncio.TimeoutError:
+            # Dispatch may have happened in the same loop iteration as the timeout
+            return self.state == RUNNING
+        return True
+
+    def release(self):
+        """Give the slot (or the queue position) back; safe to call more than once"""
+        self.scheduler._release(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class RequestScheduler:
+    """Admission control and fair ordering for model requests
+
+    ``admit`` reserves a place in a bounded queue straight away, so an
+    overloaded bot can say so before the interaction is deferred. Waiting
+    requests are dispatched in weighted fair queuing order: each gets a
+    virtual finish time from its user's and guild's previous requests, so a
+    user sending many questions only gets their turn once quieter users have
+    had theirs, and a busy guild gets at most ``guild_weight`` users' worth
+    of turns. Team members are served ahead of everyone else. No more than
+    ``model_concurrency`` requests run against one model at a time.
+    """
+
+    def __init__(self, max_queue: int = Config.SCHEDULER_MAX_QUEUE, max_per_user: int = Config.SCHEDULER_MAX_PER_USER,
+                 model_concurrency: int = Config.SCHEDULER_MODEL_CONCURRENCY, guild_weight: float = Config.SCHEDULER_GUILD_WEIGHT):
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.model_concurrency = model_concurrency
+        self.guild_weight = guild_weight
+
+        self._seq = itertools.count()
+        self._virtual = 0.0
+        self._user_finish: Dict[str, float] = {}
+        self._guild_finish: Dict[str, float] = {}
+        self._outstanding: Dict[str, int] = {}
+        self._waiting = 0
+        self._queued: List[Ticket] = []
+        self._running: Dict[str, int] = {}
+
+        self.admitted = 0
+        self.rejected = 0
+        self.dispatched = 0
+        self.expired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def admit(self, user_id: str, guild_id: Optional[str] = None, team: bool = False) -> Ticket:
+        """Reserve a place for a request, or raise :class:`SchedulerFullError` immediately"""
+        if self._outstanding.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            raise SchedulerFullError("user")
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerFullError("queue")
+
+        # Start no earlier than the user's and the guild's previous requests allow
+        start = max(self._virtual, self._user_finish.get(user_id, 0.0))
+        if guild_id is not None:
+            start = max(start, self._guild_finish.get(guild_id, 0.0))
+            self._guild_finish[guild_id] = start + 1.0 / self.guild_weight
+        finish = start + 1.0
+        self._user_finish[user_id] = finish
+
+        ticket = Ticket(self, user_id, guild_id, 0 if team else 1, finish, start, next(self._seq))
+        self._outstanding[user_id] = self._outstanding.get(user_id, 0) + 1
+        self._waiting += 1
+        self.admitted += 1
+        return ticket
+
+    def _enqueue(self, ticket: Ticket, model: str) -> int:
+        if ticket.state != ADMITTED:
+            raise RuntimeError(f"Ticket is already {ticket.state}")
+        ticket.model = model
+        ticket.state = QUEUED
+        ticket._ready = asyncio.get_running_loop().create_future()
+        self._queued.append(ticket)
+        self._dispatch()
+        if ticket.state == RUNNING:
+            return 0
+        return sum(1 for other in self._queued if other.sort_key < ticket.sort_key) + 1
+
+    def _dispatch(self):
+        """Start queued tickets in fair order while their models have free slots"""
+        while True:
+            eligible = [t for t in self._queued if self._running.get(t.model, 0) < self.model_concurrency]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: t.sort_key)
+            self._queued.remove(ticket)
+            self._waiting -= 1
+            self._running[ticket.model] = self._running.get(ticket.model, 0) + 1
+            self._virtual = max(self._virtual, ticket.start)
+            ticket.state = RUNNING
+            ticket.dispatched_at = time.monotonic()
+            waited = ticket.dispatched_at - ticket.admitted_at
+            self.dispatched += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            if not ticket._ready.done():
+                ticket._ready.set_result(True)
+        self._prune()
+
+    def _prune(self):
+        """Forget finish times that no longer hold anyone back"""
+        if len(self._user_finish) > 1000:
+            self._user_finish = {k: v for k, v in self._user_finish.items() if v > self._virtual}
+        if len(self._guild_finish) > 1000:
+            self._guild_finish = {k: v for k, v in self._guild_finish.items() if v > self._virtual}
+
+    def _release(self, ticket: Ticket):
+        state = ticket.state
+        if state == DONE:
+            return
+        ticket.state = DONE
+
+        remaining = self._outstanding.get(ticket.user_id, 1) - 1
+        if remaining:
+            self._outstanding[ticket.user_id] = remaining
+        else:
+            self._outstanding.pop(ticket.user_id, None)
+
+        if state == RUNNING:
+            self._running[ticket.model] -= 1
+            if not self._running[ticket.model]:
+                del self._running[ticket.model]
+        else:
+            self._waiting -= 1
+            if state == QUEUED:
+                self._queued.remove(ticket)
+                self.expired += 1
+                if not ticket._ready.done():
+                    ticket._ready.cancel()
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "waiting": self._waiting,
+            "queued": len(self._queued),
+            "running": dict(self._running),
+            "max_queue": self.max_queue,
+            "max_per_user": self.max_per_user,
+            "model_concurrency": self.model_concurrency,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "dispatched": self.dispatched,
+            "expired": self.expired,
+            "avg_wait_ms": round(self.total_wait / self.dispatched * 1000, 3) if self.dispatched else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3)
+        }
+
+
+# Shared by the bot's model commands; only used from its event loop
+request_scheduler = RequestScheduler()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+from config import Config
+
+# Rough per-entry bookkeeping cost on top of the key and response text
+ENTRY_OVERHEAD = 200
+
+
+def parse_cache_models(value: Optional[str], default_ttl: float) -> Dict[str, float]:
+    """Parse ``"model=ttl,other-model,*"`` into per-model TTLs (``*`` matches every model)"""
+    models = {}
+    for entry in (value or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, ttl = entry.partition("=")
+        try:
+            models[model.strip()] = float(ttl) if ttl.strip() else default_ttl
+        except ValueError:
+            print(f"⚠️ Ignoring invalid response cache TTL for {model.strip()}: {ttl!r}")
+    return models
+
+
+class ResponseCache:
+    """Exact-match cache of model responses for repeated prompts
+
+    Keyed on a hash of the model, system prompt, normalized message and (when
+    allowed) the conversation context. Only models listed in
+    ``RESPONSE_CACHE_MODELS`` are cached, each with its own TTL. Entries are
+    evicted least recently used first once the cache holds ``max_bytes``.
+    Requests that carry conversation history bypass the cache unless
+    ``allow_stateful`` is set, since the same question can deserve a
+    different answer mid-conversation.
+    """
+
+    def __init__(self, max_bytes: int = Config.RESPONSE_CACHE_MAX_BYTES, default_ttl: float = Config.RESPONSE_CACHE_TTL,
+                 models: Optional[Dict[str, float]] = None, allow_stateful: bool = Config.RESPONSE_CACHE_STATEFUL):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.models = models if models is not None else parse_cache_models(Config.RESPONSE_CACHE_MODELS, default_ttl)
+        self.allow_stateful = allow_stateful
+        self._lock = threading.Lock()
+        # key -> (response, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._per_model: Dict[str, Dict[str, int]] = {}
+
+    def ttl_for(self, model: str) -> Optional[float]:
+        """TTL for a model's responses, or None if the model isn't cached"""
+        ttl = self.models.get(model)
+        if ttl is None:
+            ttl = self.models.get("*")
+        return ttl
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Fold case and whitespace so trivially different spellings share an entry"""
+        return " ".join(message.split()).casefold()
+
+    def _count(self, model: str, key: str):
+        counts = self._per_model.setdefault(model, {"hits": 0, "misses": 0})
+        counts[key] += 1
+
+    def lookup(self, model: str, message: Union[str, List[Dict]], system_prompt: str,
+               conversation_history: Optional[List[Dict[str, str]]] = None, image_data: Optional[bytes] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Look a request up in the cache
+
+        Returns:
+            ``(key, response)``: ``key`` is None when the request bypasses the
+            cache, and ``response`` is None on a miss
+        """
+        if self.ttl_for(model) is None:
+            return None, None
+        if image_data or not isinstance(message, str) or (conversation_history and not self.allow_stateful):
+            with self._lock:
+                self.bypassed += 1
+            return None, None
+
+        material = json.dumps([model, system_prompt, self.normalize(message), conversation_history or []], ensure_ascii=False)
+        key = hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                self._count(model, "misses")
+                return key, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._count(model, "hits")
+            return key, entry[0]
+
+    def store(self, key: Optional[str], model: str, response: Optional[str]) -> Optional[str]:
+        """Remember a response under a key from :meth:`lookup`; returns the response for chaining"""
+        if key is None or not response:
+            return response
+        ttl = self.ttl_for(model)
+        size = len(key) + len(response.encode("utf-8")) + ENTRY_OVERHEAD
+        if ttl is None or size > self.max_bytes:
+            return response
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, time.monotonic() + ttl, size)
+            self.bytes += size
+            self.stores += 1
+            while self.bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return response
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled_models": self.models,
+                "allow_stateful": self.allow_stateful,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "models": {model: dict(counts) for model, counts in self._per_model.items()}
+            }
+
+
+# Shared by every OpenRouter client in the process
+response_cache = ResponseCache()
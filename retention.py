@@ -0,0 +1,267 @@
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import case, func
+from config import Config
+from database import db, ConversationHistory, ConversationStats, HistoryWatermark, SUMMARY_ROLE, EPOCH, conversation_cache, history_writer
+from metrics import HISTORY_PRUNED
+
+# Reasons rows get deleted, used as the metric label and in the archive
+CLEARED = "cleared"
+INACTIVE = "inactive"
+AGE = "age"
+LIMIT = "limit"
+
+
+class HistoryRetention:
+    """Background enforcement of conversation history retention
+
+    Every ``interval`` seconds a thread purges rows hidden by /clear_memory
+    and applies the configured limits: users inactive for ``inactive_days``
+    lose their whole history, messages older than ``max_age_days`` go, and
+    only the newest ``max_messages`` messages (plus the rolling summary) are
+    kept per user. Rows are deleted ``batch_size`` at a time with a pause in
+    between, each batch in its own short transaction under the history flush
+    lock, so the bot's writes never wait behind a large DELETE. Rows pruned
+    by a limit are appended to a gzipped JSONL file per day in
+    ``archive_dir`` first, when set; cleared rows are not archived.
+    """
+
+    def __init__(self, max_age_days: float = Config.RETENTION_MAX_AGE_DAYS,
+                 max_messages: int = Config.RETENTION_MAX_MESSAGES_PER_USER,
+                 inactive_days: float = Config.RETENTION_INACTIVE_DAYS,
+                 interval: float = Config.RETENTION_INTERVAL, batch_size: int = Config.RETENTION_BATCH_SIZE,
+                 batch_pause: float = Config.RETENTION_BATCH_PAUSE, archive_dir: str = Config.RETENTION_ARCHIVE_DIR):
+        self.max_age_days = max_age_days
+        self.max_messages = max_messages
+        self.inactive_days = inactive_days
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.archive_dir = archive_dir
+        self._app_factory = None
+        self._thread = None
+        self._stopping = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+        self.runs = 0
+        self.failures = 0
+        self.batches = 0
+        self.deleted = {CLEARED: 0, INACTIVE: 0, AGE: 0, LIMIT: 0}
+        self.archived = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_ms = 0.0
+        self.max_batch_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._stopping
+
+    def start(self, app_factory: Callable):
+        """Start the retention thread; ``app_factory`` returns the Flask app to prune under"""
+        if self._thread is not None:
+            return
+        self._app_factory = app_factory
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="history-retention", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                break
+            with self._app_factory().app_context():
+                self.run_once()
+
+    def stop(self):
+        """Stop the retention thread, abandoning the current run after its batch"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def run_once(self) -> Dict[str, int]:
+        """One full retention pass; needs an app context. Returns rows deleted by reason"""
+        started = time.perf_counter()
+        before = dict(self.deleted)
+        try:
+            self._purge_cleared()
+            if self.inactive_days > 0 or self.max_age_days > 0 or self.max_messages > 0:
+                self._apply_limits()
+        except Exception as e:
+            db.session.rollback()
+            self.failures += 1
+            print(f"❌ History retention run failed: {e}")
+        finally:
+            db.session.remove()
+        self.runs += 1
+        self.last_run_at = datetime.utcnow()
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        removed = {reason: self.deleted[reason] - before[reason] for reason in self.deleted}
+        if any(removed.values()):
+            summary = ", ".join(f"{count} {reason}" for reason, count in removed.items() if count)
+            print(f"🧹 History retention removed {sum(removed.values())} messages ({summary}) in {self.last_run_ms:.0f}ms")
+        return removed
+
+    # Passes
+
+    def _purge_cleared(self):
+        """Delete rows hidden by /clear_memory, then the watermarks with nothing left behind them"""
+        for watermark in HistoryWatermark.query.all():
+            user_id, cleared_before = watermark.user_id, watermark.cleared_before
+            self._prune(user_id, CLEARED, lambda: ConversationHistory.query.filter(
+                ConversationHistory.user_id == user_id,
+                ConversationHistory.created_at <= cleared_before
+            ))
+            if self._stopping:
+                return
+            with history_writer.flush_lock:
+                # A later /clear_memory may have moved the watermark meanwhile; it is purged next run
+                current = db.session.get(HistoryWatermark, user_id)
+                if current is not None and not ConversationHistory.query.filter(
+                    ConversationHistory.user_id == user_id,
+                    ConversationHistory.created_at <= current.cleared_before
+                ).limit(1).first():
+                    db.session.delete(current)
+                db.session.commit()
+
+    def _apply_limits(self):
+        now = datetime.utcnow()
+        age_cutoff = now - timedelta(days=self.max_age_days) if self.max_age_days > 0 else None
+        inactive_cutoff = now - timedelta(days=self.inactive_days) if self.inactive_days > 0 else None
+
+        # One pass over idx_user_created for every user's visible history
+        history = ConversationHistory
+        users = db.session.execute(
+            db.select(
+                history.user_id,
+                func.coalesce(func.sum(case((history.role != SUMMARY_ROLE, 1), else_=0)), 0),
+                func.min(history.created_at),
+                func.max(case((history.role != SUMMARY_ROLE, history.created_at)))
+            ).outerjoin(HistoryWatermark, HistoryWatermark.user_id == history.user_id)
+            .where(history.created_at > func.coalesce(HistoryWatermark.cleared_before, EPOCH))
+            .group_by(history.user_id)
+        ).all()
+
+        for user_id, messages, oldest, last_message in users:
+            if self._stopping:
+                return
+            pruned = 0
+            if inactive_cutoff is not None and (last_message or oldest) < inactive_cutoff:
+                pruned += self._prune(user_id, INACTIVE, lambda: ConversationHistory.visible(user_id))
+            else:
+                if age_cutoff is not None and oldest < age_cutoff:
+                    pruned += self._prune(user_id, AGE, lambda: ConversationHistory.visible(user_id).filter(
+                        ConversationHistory.created_at < age_cutoff
+                    ))
+                if self.max_messages > 0 and messages > self.max_messages:
+                    pruned += self._prune(user_id, LIMIT, lambda: ConversationHistory.visible(user_id).filter(
+                        ConversationHistory.role != SUMMARY_ROLE
+                    ), keep_newest=self.max_messages)
+            if pruned:
+                self._forget_if_empty(user_id)
+
+    # Batches
+
+    def _prune(self, user_id: str, reason: str, query: Callable, keep_newest: int = 0) -> int:
+        """Delete the rows ``query()`` selects for a user, oldest first, one batch per transaction"""
+        pruned = 0
+        while not self._stopping:
+            batch_started = time.perf_counter()
+            with history_writer.flush_lock:
+                q = query()
+                limit = self.batch_size
+                if keep_newest:
+                    limit = min(limit, q.count() - keep_newest)
+                    if limit <= 0:
+                        break
+                rows = q.order_by(ConversationHistory.created_at, ConversationHistory.id).limit(limit).all()
+                if not rows:
+                    break
+                if reason != CLEARED and self.archive_dir:
+                    self._archive(rows, reason)
+                ConversationHistory.query.filter(
+                    ConversationHistory.id.in_([row.id for row in rows])
+                ).delete(synchronize_session=False)
+                if reason != CLEARED:
+                    ConversationStats.record_removed(user_id, rows)
+                db.session.commit()
+                if reason != CLEARED:
+                    conversation_cache.drop(user_id)
+
+            elapsed_ms = (time.perf_counter() - batch_started) * 1000
+            pruned += len(rows)
+            HISTORY_PRUNED.inc(reason, amount=len(rows))
+            with self._lock:
+                self.batches += 1
+                self.deleted[reason] += len(rows)
+                self.max_batch_ms = max(self.max_batch_ms, elapsed_ms)
+            if len(rows) < limit:
+                break
+            if self.batch_pause > 0:
+                time.sleep(self.batch_pause)
+        return pruned
+
+    def _forget_if_empty(self, user_id: str):
+        """Drop the stats row of a user whose whole history was pruned"""
+        with history_writer.flush_lock:
+            if not ConversationHistory.visible(user_id).limit(1).first():
+                ConversationStats.query.filter_by(user_id=user_id).delete()
+                db.session.commit()
+
+    def _archive(self, rows: List[ConversationHistory], reason: str):
+        """Append rows to today's archive file before they are deleted"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"conversation_history-{datetime.utcnow():%Y-%m-%d}.jsonl.gz")
+        archived_at = datetime.utcnow().isoformat()
+        lines = [json.dumps({
+            "id": row.id,
+            "user_id": row.user_id,
+            "role": row.role,
+            "content": row.content,
+            "model_name": row.model_name,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "token_count": row.token_count,
+            "reason": reason,
+            "archived_at": archived_at
+        }, ensure_ascii=False) + "\n" for row in rows]
+        # Each batch is its own gzip member; gzip readers concatenate them
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.writelines(lines)
+        with self._lock:
+            self.archived += len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "runs": self.runs,
+                "failures": self.failures,
+                "batches": self.batches,
+                "deleted": dict(self.deleted),
+                "archived": self.archived,
+                "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+                "last_run_ms": round(self.last_run_ms, 3),
+                "max_batch_ms": round(self.max_batch_ms, 3),
+                "max_age_days": self.max_age_days,
+                "max_messages": self.max_messages,
+                "inactive_days": self.inactive_days,
+                "interval": self.interval,
+                "batch_size": self.batch_size,
+                "archive_dir": self.archive_dir or None
+            }
+
+
+# Started by the Discord bot alongside the write-behind queue
+history_retention = HistoryRetention()
@@ -7,6 +7,7 @@ Runs Flask web interface and Discord bot together
 import os
 import sys
 import time
+import signal
 import threading
 from dotenv import load_dotenv
 
@@ -32,14 +33,14 @@ def check_environment():
     return True
 
 def setup_database():
-    """Initialize database tables"""
+    """Initialize database tables and migrate existing ones"""
     try:
         from flask_web import create_app
-        from database import db
+        from database import migrate_schema
 
         app = create_app()
         with app.app_context():
-            db.create_all()
+            migrate_schema()
             print("✅ Database initialized")
         return app
     except Exception as e:
@@ -70,6 +71,9 @@ def main():
     if not check_environment():
         sys.exit(1)
 
+    # Exit cleanly on SIGTERM (Railway redeploys) so atexit hooks flush queued history rows
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     # Initialize database and create Flask app
     app = setup_database()
     if not app:
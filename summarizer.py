@@ -0,0 +1,178 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+from config import Config
+from database import db, ConversationHistory, ConversationStats, SUMMARY_ROLE, conversation_cache, history_writer
+from db_executor import db_executor
+from openrouter_client import client_registry
+from token_budget import estimate_tokens
+
+SUMMARY_PROMPT = (
+    "You maintain the long-term memory of a Discord AI assistant. Merge the existing summary "
+    "(if any) and the conversation excerpt into one updated summary of what the user has told "
+    "the assistant and what was discussed: facts about the user, preferences, ongoing tasks and "
+    "decisions. Write it in the third person, keep it under 200 words, and reply with the summary only."
+)
+
+
+class ConversationSummarizer:
+    """Background compaction of long conversation histories
+
+    When a user's recent history grows past ``trigger_tokens`` (or past what
+    the in-memory tier holds), their oldest messages are rewritten into a
+    single rolling ``summary`` row by a cheap model, keeping the newest
+    ``keep_messages`` verbatim. Context building then sends the summary plus
+    the recent turns. Jobs run as background tasks, at most one per user.
+    """
+
+    def __init__(self, model: str = Config.SUMMARY_MODEL, api_key: Optional[str] = Config.SUMMARY_API_KEY,
+                 trigger_tokens: int = Config.SUMMARY_TRIGGER_TOKENS, keep_messages: int = Config.SUMMARY_KEEP_MESSAGES,
+                 batch_tokens: int = Config.SUMMARY_BATCH_TOKENS):
+        self.model = model
+        self.api_key = api_key
+        self.trigger_tokens = trigger_tokens
+        self.keep_messages = keep_messages
+        self.batch_tokens = batch_tokens
+        # Users with a compaction in flight; only touched on the event loop
+        self._in_progress: Set[str] = set()
+
+        self.runs = 0
+        self.failures = 0
+        self.messages_compacted = 0
+        self.tokens_compacted = 0
+        self.last_run_ms = 0.0
+
+    def should_compact(self, user_id: str) -> bool:
+        """Cheap check against the in-memory tier; users that aren't cached are left alone"""
+        if user_id in self._in_progress:
+            return False
+        usage = conversation_cache.usage(user_id)
+        if usage is None:
+            return False
+        messages, tokens, complete = usage
+        if messages <= self.keep_messages:
+            return False
+        return tokens > self.trigger_tokens or not complete
+
+    async def compact(self, user_id: str, api_key: str, max_passes: int = 5):
+        """Summarize a user's older messages; ``api_key`` is used unless SUMMARY_API_KEY is set"""
+        if user_id in self._in_progress:
+            return
+        self._in_progress.add(user_id)
+        started = time.perf_counter()
+        try:
+            client = client_registry.get_async_client(self.api_key or api_key)
+            # Very long histories are folded in a few batches
+            for _ in range(max_passes):
+                batch = await db_executor.run(self._load_batch, user_id)
+                if batch is None:
+                    break
+
+                summary = await client.generate_response(
+                    model=self.model,
+                    message=self._render(batch),
+                    system_prompt=SUMMARY_PROMPT
+                )
+                if not summary:
+                    self.failures += 1
+                    print(f"⚠️ Summary model {self.model} returned nothing for user {user_id}")
+                    break
+
+                if not await db_executor.run(self._store, user_id, batch, summary):
+                    # History changed underneath us (e.g. /clear_memory); try again later
+                    break
+                self.messages_compacted += len(batch["messages"])
+                self.tokens_compacted += sum(m["tokens"] for m in batch["messages"])
+            self.runs += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            print(f"❌ Conversation summary failed for user {user_id}: {e}")
+        finally:
+            self._in_progress.discard(user_id)
+            self.last_run_ms = (time.perf_counter() - started) * 1000
+
+    def _load_batch(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Oldest messages beyond the ones kept verbatim, up to ``batch_tokens`` (runs on the DB pool)"""
+        query = ConversationHistory.visible(user_id).filter(ConversationHistory.role != SUMMARY_ROLE)
+        # Rows still in the write-behind queue are newer still, so they only add to what is kept
+        excess = query.count() - self.keep_messages
+        if excess <= 0:
+            return None
+
+        rows = query.order_by(ConversationHistory.created_at, ConversationHistory.id).limit(min(excess, 500)).all()
+        messages = []
+        used = 0
+        for row in rows:
+            tokens = row.token_count if row.token_count is not None else estimate_tokens(row.content)
+            if messages and used + tokens > self.batch_tokens:
+                break
+            messages.append({"id": row.id, "role": row.role, "content": row.content, "tokens": tokens, "created_at": row.created_at})
+            used += tokens
+
+        previous = ConversationHistory.get_summary(user_id)
+        return {
+            "messages": messages,
+            "previous_id": previous.id if previous else None,
+            "previous": previous.content if previous else None
+        }
+
+    @staticmethod
+    def _render(batch: Dict[str, Any]) -> str:
+        lines = []
+        if batch["previous"]:
+            lines.append(f"Existing summary:\n{batch['previous']}\n")
+        lines.append("Conversation excerpt:")
+        for message in batch["messages"]:
+            speaker = "User" if message["role"] == "user" else "Assistant"
+            lines.append(f"{speaker}: {message['content']}")
+        return "\n".join(lines)
+
+    def _store(self, user_id: str, batch: Dict[str, Any], summary: str) -> bool:
+        """Replace the summarized rows with the new summary in one transaction (runs on the DB pool)"""
+        ids = [m["id"] for m in batch["messages"]]
+        if batch["previous_id"] is not None:
+            ids.append(batch["previous_id"])
+
+        # Same lock as /clear_memory and the write-behind flush, so neither interleaves with the rewrite
+        with history_writer.flush_lock:
+            # Rows hidden by a /clear_memory since the batch was loaded no longer count
+            deleted = ConversationHistory.visible(user_id).filter(
+                ConversationHistory.id.in_(ids)
+            ).delete(synchronize_session=False)
+            if deleted != len(ids):
+                db.session.rollback()
+                return False
+
+            summary = summary.strip()
+            ConversationStats.record_compacted(user_id, batch["messages"], estimate_tokens(summary))
+            db.session.add(ConversationHistory(
+                user_id=user_id,
+                role=SUMMARY_ROLE,
+                content=summary,
+                model_name=self.model,
+                # Sorts with the messages it replaces, ahead of everything kept
+                created_at=batch["messages"][-1]["created_at"] or datetime.utcnow(),
+                token_count=estimate_tokens(summary)
+            ))
+            db.session.commit()
+            # Reloaded with the summary on the next read
+            conversation_cache.drop(user_id)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "in_progress": len(self._in_progress),
+            "runs": self.runs,
+            "failures": self.failures,
+            "messages_compacted": self.messages_compacted,
+            "tokens_compacted": self.tokens_compacted,
+            "last_run_ms": round(self.last_run_ms, 3)
+        }
+
+
+# Scheduled by /ask, reported on the dashboard
+summarizer = ConversationSummarizer()
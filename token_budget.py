@@ -0,0 +1,52 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Role markers and separators each chat message costs on top of its text
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: about four UTF-8 bytes per token
+
+    Counting bytes rather than characters keeps the estimate on the safe side
+    for non-Latin scripts, which tokenize to far fewer characters per token.
+    """
+    if not text:
+        return 0
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def summary_message(summary: str) -> Dict[str, str]:
+    """API message carrying the rolling summary of a user's older conversation"""
+    return {"role": "system", "content": f"Summary of the earlier conversation with this user:\n{summary}"}
+
+
+def pack_history(entries: Iterable[Tuple[str, str, int]], token_budget: int, summary: Optional[Tuple[str, int]] = None) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Keep the newest messages whose estimated size fits in ``token_budget``
+
+    Args:
+        entries: ``(role, content, tokens)`` tuples in chronological order
+        token_budget: Tokens available for history, including per-message overhead
+        summary: Optional ``(content, tokens)`` rolling summary, packed first when it fits
+
+    Returns:
+        The packed messages (oldest first) formatted for the API, and the tokens they use
+    """
+    packed = []
+    used = 0
+    head = []
+    if summary is not None:
+        # The summary header costs a few tokens on top of the stored text
+        cost = summary[1] + MESSAGE_OVERHEAD + 8
+        if cost <= token_budget:
+            head.append(summary_message(summary[0]))
+            used += cost
+    for role, content, tokens in reversed(list(entries)):
+        cost = tokens + MESSAGE_OVERHEAD
+        if used + cost > token_budget:
+            # Stop at the first miss so the context never has gaps in it
+            break
+        packed.append({"role": role, "content": content})
+        used += cost
+    packed.reverse()
+    return head + packed, used
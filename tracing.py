@@ -0,0 +1,250 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+from config import Config
+
+# Keeps a runaway loop (e.g. one edit per streamed delta) from growing a trace without bound
+MAX_SPANS_PER_TRACE = 200
+
+
+class Trace:
+    """Spans recorded for one sampled interaction"""
+
+    __slots__ = ("trace_id", "name", "attrs", "started", "started_at", "spans", "dropped", "_next_id", "_lock")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def new_span_id(self) -> int:
+        # Spans can finish on DB worker threads
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def add(self, span: Dict[str, Any]):
+        with self._lock:
+            # The root span ends last; it is always kept so the trace keeps its duration
+            if len(self.spans) >= MAX_SPANS_PER_TRACE and span["parent"] is not None:
+                self.dropped += 1
+            else:
+                self.spans.append(span)
+
+
+class Span:
+    """An open span; ``set`` adds attributes that are recorded when it ends"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "started")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = trace.new_span_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    """Stands in for a span outside sampled traces, so callers never check for None"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Sampled span trees for /ask and the layers it calls into
+
+    ``trace`` starts a root span for a sampled fraction of interactions.
+    ``span`` opens a child of whatever span is current in the context, and
+    does nothing outside a sampled trace, so instrumented code costs one
+    context variable lookup when tracing is off. The current span travels
+    with asyncio tasks and, through ``db_executor``, into DB worker threads,
+    so the trace ID correlates the bot, the OpenRouter client and the
+    database layer. Finished traces are appended to a rotating JSONL file
+    by a background thread, and the recent ones are kept for the dashboard.
+    """
+
+    def __init__(self, sample_rate: float = Config.TRACE_SAMPLE_RATE, path: str = Config.TRACE_FILE,
+                 max_bytes: int = Config.TRACE_MAX_BYTES, backup_count: int = Config.TRACE_BACKUP_COUNT, keep_recent: int = 200):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._recent = deque(maxlen=keep_recent)
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        self.started = 0
+        self.sampled = 0
+        self.written = 0
+        self.write_errors = 0
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Root span for one interaction, recorded when sampled"""
+        self.started += 1
+        if _current.get() is not None or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            yield NOOP_SPAN
+            return
+        self.sampled += 1
+        trace = Trace(name, attrs)
+        root = Span(trace, name, None, attrs)
+        token = _current.set(root)
+        error = None
+        try:
+            yield root
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(trace, self._end(root, error))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Child of the current span; a no-op outside a sampled trace"""
+        parent = _current.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        span = Span(parent.trace, name, parent.span_id, attrs)
+        token = _current.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self._end(span, error)
+
+    @staticmethod
+    def _end(span: Span, error: Optional[str]) -> Dict[str, Any]:
+        record = {
+            "id": span.span_id,
+            "parent": span.parent_id,
+            "name": span.name,
+            "start_ms": round((span.started - span.trace.started) * 1000, 3),
+            "duration_ms": round((time.perf_counter() - span.started) * 1000, 3),
+            "thread": threading.current_thread().name
+        }
+        if span.attrs:
+            record["attrs"] = span.attrs
+        if error:
+            record["error"] = error
+        span.trace.add(record)
+        return record
+
+    def _finish(self, trace: Trace, root: Dict[str, Any]):
+        duration_ms = root["duration_ms"]
+        record = {
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "timestamp": trace.started_at,
+            "duration_ms": duration_ms,
+            "attrs": trace.attrs,
+            "dropped_spans": trace.dropped,
+            "spans": sorted(trace.spans, key=lambda s: s["start_ms"])
+        }
+        self._recent.append(record)
+        if self.path:
+            self._queue.put(record)
+            self._ensure_writer()
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        """Append finished traces to the JSONL file off the event loop"""
+        logger = logging.getLogger("discordai.traces")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding="utf-8")
+        except OSError as e:
+            print(f"❌ Cannot open trace file {self.path}: {e}")
+            self.path = None
+            return
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        while True:
+            record = self._queue.get()
+            try:
+                logger.info(json.dumps(record, default=str, ensure_ascii=False))
+                self.written += 1
+            except Exception as e:
+                self.write_errors += 1
+                print(f"❌ Failed to write trace: {e}")
+
+    def annotate(self, **attrs):
+        """Add attributes to the current span, if any"""
+        span = _current.get()
+        if span is not None:
+            span.set(**attrs)
+
+    def current_trace_id(self) -> Optional[str]:
+        """ID of the sampled trace in progress, for correlating logs and upstream requests"""
+        span = _current.get()
+        return span.trace.trace_id if span is not None else None
+
+    def log_suffix(self) -> str:
+        """`` [trace <id>]`` inside a sampled trace, else empty, for appending to log lines"""
+        trace_id = self.current_trace_id()
+        return f" [trace {trace_id}]" if trace_id else ""
+
+    def slowest(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """The slowest of the recently finished traces, slowest first"""
+        return sorted(list(self._recent), key=lambda record: record["duration_ms"], reverse=True)[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "file": self.path,
+            "started": self.started,
+            "sampled": self.sampled,
+            "written": self.written,
+            "write_errors": self.write_errors,
+            "recent": len(self._recent)
+        }
+
+
+# Shared by the bot, the OpenRouter client and the DB layer
+tracer = Tracer()
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 """
-Script to update database schema for team_only field
+Script to update database schema for team_only, is_fallback and token_count fields
+and rebuild the per-user conversation_stats table
 """
 
 from flask_web import create_app
-from database import db, AIModel
+from database import db, AIModel, ConversationStats, migrate_schema
 
 def update_database():
     """Update database schema and set default values"""
@@ -12,21 +13,8 @@ def update_database():
 
     with app.app_context():
         try:
-            # Get the database engine
-            engine = db.engine
-
-            # Check if team_only column already exists
-            inspector = db.inspect(engine)
-            columns = [col['name'] for col in inspector.get_columns('ai_model')]
-
-            if 'team_only' not in columns:
-                # Add the team_only column using raw SQL
-                with engine.connect() as conn:
-                    conn.execute(db.text("ALTER TABLE ai_model ADD COLUMN team_only BOOLEAN DEFAULT FALSE"))
-                    conn.commit()
-                print("✅ Added team_only column to ai_model table")
-            else:
-                print("✅ team_only column already exists")
+            # Missing tables and columns (team_only, is_fallback, token_count), as on every start
+            migrate_schema()
 
             # Now we can safely query the models
             models = AIModel.query.all()
@@ -42,12 +30,17 @@ def update_database():
                 db.session.commit()
                 print(f"✅ Updated {updated_count} models with default team_only = False")
 
+            # Per-user totals read by /memory_info, recomputed from the history
+            rebuilt = ConversationStats.rebuild()
+            print(f"✅ Rebuilt conversation stats for {rebuilt} users")
+
             # Show current models
             print("\n📋 Current models:")
             for model in AIModel.query.all():
                 status = "Team Only" if model.team_only else "Everyone"
                 active = "Active" if model.is_active else "Inactive"
-                print(f"  • {model.name} - {active}, {status}")
+                fallback = ", Fallback" if model.is_fallback else ""
+                print(f"  • {model.name} - {active}, {status}{fallback}")
 
         except Exception as e:
             print(f"❌ Error updating database: {e}")